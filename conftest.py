@@ -0,0 +1,15 @@
+# coding: utf-8
+"""
+    Configuration for py.test
+    -------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import sys
+
+# tinycss.aio uses the "async" syntax of Python 3.6.
+collect_ignore = []
+if sys.version_info < (3, 6):
+    collect_ignore.extend(['tinycss/aio.py', 'tinycss/tests/test_aio.py'])
@@ -97,12 +97,14 @@ def run_setup(with_extension):
             'Programming Language :: Python :: Implementation :: CPython',
             'Programming Language :: Python :: Implementation :: PyPy',
         ],
+        install_requires=['futures; python_version < "3"'],
         setup_requires=pytest_runner,
         tests_require=[
             'pytest-cov', 'pytest-flake8', 'pytest-isort', 'pytest-runner'],
         extras_require={'test': (
             'pytest-runner', 'pytest-cov', 'pytest-flake8', 'pytest-isort')},
         packages=['tinycss', 'tinycss.tests'],
+        package_data={'tinycss.tests': ['perf_corpus.json']},
         **kwargs
     )
 
@@ -36,12 +36,48 @@ def make_parser(*features, **kwargs):
     :param kwargs:
         Keyword arguments are passed to the parser’s constructor.
     :returns:
-        An instance of a new subclass of :class:`CSS21Parser`
+        An instance of a subclass of :class:`CSS21Parser`, the same
+        subclass for the same features.
 
     """
     if features:
-        bases = tuple(PARSER_MODULES.get(f, f) for f in features)
-        parser_class = type('CustomCSSParser', bases + (CSS21Parser,), {})
+        parser_class = _make_parser_class(features)
     else:
         parser_class = CSS21Parser
     return parser_class(**kwargs)
+
+
+# Parser classes made by make_parser(), by tuple of features
+_PARSER_CLASSES = {}
+
+
+def _make_parser_class(features):
+    """Return the subclass of :class:`CSS21Parser` for :func:`make_parser`.
+
+    Classes are made once per tuple of features, so that their resolved
+    :attr:`~CSS21Parser.AT_RULES` and the method caches of Python are kept
+    between parsers.
+
+    """
+    parser_class = _PARSER_CLASSES.get(features)
+    if parser_class is None:
+        bases = tuple(PARSER_MODULES.get(f, f) for f in features)
+        parser_class = _PARSER_CLASSES.setdefault(features, type(
+            'CustomCSSParser', bases + (CSS21Parser,), {
+                '_features': features, '__reduce__': _reduce_parser}))
+    return parser_class
+
+
+def _reduce_parser(parser):
+    """Pickle parsers made by :func:`make_parser`, whose class can not be
+    found by name.
+
+    """
+    return _unpickle_parser, (parser._features, parser.__dict__)
+
+
+def _unpickle_parser(features, state):
+    parser_class = _make_parser_class(features)
+    parser = parser_class.__new__(parser_class)
+    parser.__dict__.update(state)
+    return parser
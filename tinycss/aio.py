@@ -0,0 +1,157 @@
+# coding: utf-8
+"""
+    tinycss.aio
+    -----------
+
+    Parse stylesheets without blocking an :mod:`asyncio` event loop.
+    This module requires Python 3.6 or later.
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import asyncio
+
+from .css21 import CSS21Parser, Stylesheet, _SharedValues
+from .decoding import _read, decode
+from .parallel import split_chunks
+
+try:
+    _get_running_loop = asyncio.get_running_loop
+except AttributeError:  # Python 3.6
+    _get_running_loop = asyncio.get_event_loop
+
+
+class AsyncParser(object):
+    """Run a parser in an executor, one chunk of a stylesheet at a time.
+
+    Stylesheets are decoded, cut into chunks of whole statements and each
+    chunk is tokenized and parsed in the executor. The event loop is free
+    while this happens, and a cancelled task stops after the current chunk.
+    With a parser that has ``limits``, stylesheets are parsed in a single
+    chunk, as the limits apply to the whole stylesheet.
+
+    :param parser:
+        A :class:`~.css21.CSS21Parser` or a parser returned by
+        :func:`~tinycss.make_parser`. Defaults to a new
+        :class:`~.css21.CSS21Parser`.
+    :param concurrency:
+        The maximum number of stylesheets read and parsed at the same time.
+    :param executor:
+        A :class:`concurrent.futures.Executor`, or ``None`` (the default)
+        for the default executor of the event loop.
+    :param chunk_size:
+        The approximate length of each chunk, in characters.
+
+    """
+    def __init__(self, parser=None, concurrency=4, executor=None,
+                 chunk_size=1 << 16):
+        self.parser = parser if parser is not None else CSS21Parser()
+        self.concurrency = concurrency
+        self.executor = executor
+        self.chunk_size = chunk_size
+        # The event loop of the semaphore, and the semaphore.
+        self._semaphore = None, None
+
+    async def parse_stylesheet_file(self, css_file, protocol_encoding=None,
+                                    linking_encoding=None,
+                                    document_encoding=None):
+        """Parse a stylesheet from a file or filename.
+
+        The file is read in the executor. Parameters are the same as in
+        :meth:`~.css21.CSS21Parser.parse_stylesheet_file`.
+
+        :return:
+            A :class:`~.css21.Stylesheet`.
+
+        """
+        return await self._parse_stylesheet(self._iter_chunks(
+            css_file, None, protocol_encoding, linking_encoding,
+            document_encoding))
+
+    async def parse_stylesheet_bytes(self, css_bytes, protocol_encoding=None,
+                                     linking_encoding=None,
+                                     document_encoding=None):
+        """Parse a stylesheet from a byte string.
+
+        Parameters are the same as in
+        :meth:`~.css21.CSS21Parser.parse_stylesheet_bytes`.
+
+        :return:
+            A :class:`~.css21.Stylesheet`.
+
+        """
+        return await self._parse_stylesheet(self._iter_chunks(
+            None, css_bytes, protocol_encoding, linking_encoding,
+            document_encoding))
+
+    async def iter_rules(self, css_bytes, protocol_encoding=None,
+                         linking_encoding=None, document_encoding=None,
+                         errors=None):
+        """Parse a stylesheet from a byte string, yielding rules as soon as
+        their chunk is parsed.
+
+        Use with ``async for``. The next chunk is only parsed when the
+        rules of the previous one have been consumed, and the stylesheet
+        counts in ``concurrency`` until the iteration is done or the
+        iterator is closed with :meth:`aclose`. Parameters are the
+        same as in :meth:`~.css21.CSS21Parser.parse_stylesheet_bytes`, and:
+
+        :param errors:
+            A list, or ``None``. :class:`~.parsing.ParseError` objects
+            are appended to it as they are found.
+        :return:
+            An asynchronous iterator of rules, as in the
+            :attr:`~.css21.Stylesheet.rules` list.
+
+        """
+        async for _, rules, chunk_errors in self._iter_chunks(
+                None, css_bytes, protocol_encoding, linking_encoding,
+                document_encoding):
+            if errors is not None:
+                errors.extend(chunk_errors)
+            for rule in rules:
+                yield rule
+
+    async def _parse_stylesheet(self, chunks):
+        """Make a :class:`~.css21.Stylesheet` from parsed chunks."""
+        rules = []
+        errors = self.parser.new_error_list()
+        encoding = None
+        async for encoding, chunk_rules, chunk_errors in chunks:
+            rules.extend(chunk_rules)
+            errors.extend(chunk_errors)
+        if self.parser.share_values:
+            _SharedValues().share_rules(rules)
+        return Stylesheet(rules, errors, encoding)
+
+    async def _iter_chunks(self, css_file, css_bytes, protocol_encoding,
+                           linking_encoding, document_encoding):
+        """Yield ``(encoding, rules, errors)`` for each parsed chunk."""
+        loop = _get_running_loop()
+        if self._semaphore[0] is not loop:
+            # Semaphores only work in one loop, eg. of one asyncio.run() call.
+            self._semaphore = loop, asyncio.Semaphore(self.concurrency)
+        async with self._semaphore[1]:
+            if css_bytes is None:
+                css_bytes = await loop.run_in_executor(
+                    self.executor, _read, css_file)
+            errors = self.parser._length_errors(len(css_bytes))
+            if errors is not None:
+                yield None, [], errors
+                return
+            css_unicode, encoding = await loop.run_in_executor(
+                self.executor, decode, css_bytes, protocol_encoding,
+                linking_encoding, document_encoding)
+            if self.parser.limits is not None:
+                chunks = [(0, len(css_unicode), 1, 1)]
+            else:
+                chunks = await loop.run_in_executor(
+                    self.executor, split_chunks, css_unicode,
+                    self.chunk_size)
+            for index, (start, end, line, column) in enumerate(chunks):
+                statements = await loop.run_in_executor(
+                    self.executor, self.parser._parse_statement,
+                    css_unicode, start, end, line, column,
+                    encoding if index == 0 else None)
+                yield encoding, statements.rules, statements.errors
@@ -0,0 +1,376 @@
+# coding: utf-8
+"""
+    tinycss.cache
+    -------------
+
+    Cache parsed stylesheets, to avoid parsing the same source again.
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import errno
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from .css21 import CSS21Parser
+from .decoding import _read
+from .parsing import LIMITS, ParseLimits
+from .version import VERSION
+
+# Change this when the format of disk cache entries changes.
+_DISK_FORMAT = 1
+
+
+class ParseCache(object):
+    """A bounded cache of parsed stylesheets, shared by
+    :class:`CachingParser` objects.
+
+    Stylesheets are kept pickled: each hit unpickles new objects, so
+    callers can not modify cached stylesheets. When the cache is full, the
+    least recently used entries are removed. It can be used from multiple
+    threads.
+
+    :param max_size:
+        The maximum total size of the cached entries, in bytes.
+
+    .. attribute:: hits
+
+        The number of stylesheets found in the cache.
+
+    .. attribute:: misses
+
+        The number of stylesheets not found in the cache.
+
+    .. attribute:: size
+
+        The current total size of the cached entries, in bytes.
+
+    """
+    def __init__(self, max_size=64 << 20):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the pickled stylesheet for ``key``, or ``None``."""
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = data  # Most recently used
+            return data
+
+    def put(self, key, data):
+        """Add a pickled stylesheet, removing old entries if needed."""
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            while self._entries and self.size + len(data) > self.max_size:
+                _, old_data = self._entries.popitem(last=False)
+                self.size -= len(old_data)
+            self._entries[key] = data
+            self.size += len(data)
+
+    def clear(self):
+        """Remove all entries. Statistics are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache(object):
+    """A cache of parsed stylesheet files, kept in a directory.
+
+    Each entry is a file in ``directory``, with the size, modification time
+    and SHA-1 hash of the source file followed by the pickled stylesheet.
+    When the size and modification time of the source have not changed, the
+    source is not read again. When they have, the source is read and the
+    entry is still used if the hash is the same.
+
+    Entries are written to a temporary file and renamed, so many processes
+    can share a directory. Entries made by another version of tinycss or by
+    a parser with other features are not used. When the directory is
+    bigger than ``max_size``, the least recently used entries are removed
+    until it is down to three quarters of ``max_size``. The size of the
+    directory is only counted again then: entries written by other
+    processes are not seen until this happens.
+
+    :param directory:
+        The directory where entries are stored. It is created if needed.
+    :param max_size:
+        The maximum total size of the entries, in bytes.
+
+    .. attribute:: hits
+
+        The number of stylesheets found in the cache.
+
+    .. attribute:: misses
+
+        The number of stylesheets not found in the cache.
+
+    """
+    def __init__(self, directory, max_size=256 << 20):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Total size of the entries, or None before the directory is listed
+        self._size = None
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def parse_file(self, key, filename, parse):
+        """Return the stylesheet cached for ``key`` and ``filename``.
+
+        :param key:
+            A picklable object identifying the parser and its arguments.
+        :param filename:
+            The name of the stylesheet file.
+        :param parse:
+            Called with the content of the file as a byte string on misses,
+            and returns a :class:`~.css21.Stylesheet`.
+
+        """
+        entry = os.path.join(self.directory, hashlib.sha1(pickle.dumps(
+            (_DISK_FORMAT, VERSION, os.path.abspath(filename), key), 2)
+        ).hexdigest() + '.cache')
+        # Get the status before reading, so that changes made while reading
+        # are seen next time.
+        stat = os.stat(filename)
+        stat = stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        css_bytes = None
+        try:
+            with open(entry, 'rb') as fd:
+                entry_stat, digest = pickle.load(fd)
+                if entry_stat != stat:
+                    css_bytes = _read(filename)
+                    if hashlib.sha1(css_bytes).digest() != digest:
+                        raise ValueError
+                stylesheet = pickle.load(fd)
+        except Exception:
+            # Missing, outdated or broken entry
+            pass
+        else:
+            self._count_hit(True)
+            if css_bytes is None:
+                self._touch(entry)
+            else:
+                self._write(entry, stat, digest, stylesheet)
+            return stylesheet
+        self._count_hit(False)
+        if css_bytes is None:
+            css_bytes = _read(filename)
+        stylesheet = parse(css_bytes)
+        self._write(entry, stat, hashlib.sha1(css_bytes).digest(), stylesheet)
+        return stylesheet
+
+    def clear(self):
+        """Remove all entries. Statistics are kept."""
+        for entry, _, _ in self._entries():
+            _remove(entry)
+        with self._lock:
+            self._size = None
+
+    def _count_hit(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _touch(self, entry):
+        """Mark an entry as recently used."""
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass  # Removed by another process
+
+    def _write(self, entry, stat, digest, stylesheet):
+        """Atomically write an entry, and remove old entries if needed."""
+        fd, temp_name = tempfile.mkstemp(
+            dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                pickle.dump((stat, digest), temp_file, 2)
+                pickle.dump(stylesheet, temp_file, pickle.HIGHEST_PROTOCOL)
+                size = temp_file.tell()
+            try:
+                size -= os.stat(entry).st_size
+            except OSError:
+                pass  # New entry
+            _replace(temp_name, entry)
+        except Exception:
+            _remove(temp_name)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+                if self._size <= self.max_size:
+                    return
+        self._evict()
+
+    def _evict(self):
+        """Count the size of the directory, and remove the least recently
+        used entries if it is too big.
+
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size > self.max_size:
+            # Leave some room, not to list the directory on each write.
+            for old_entry, entry_size, _ in entries:
+                if size <= self.max_size * 0.75:
+                    break
+                _remove(old_entry)
+                size -= entry_size
+        with self._lock:
+            self._size = size
+
+    def _entries(self):
+        """Yield ``(path, size, mtime)`` for each entry in the directory."""
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process
+                yield path, stat.st_size, stat.st_mtime
+
+
+def _remove(path):
+    """Remove a file, unless it is already removed."""
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+
+# os.rename does not replace existing files on Windows with Python 2.
+_replace = getattr(os, 'replace', os.rename)
+
+
+class CachingParser(object):
+    """Wrap a parser to cache its results.
+
+    Results are cached by the hash of the source, the encoding arguments
+    and the parser (its class and configuration), so a :class:`ParseCache`
+    can be shared by different parsers.
+
+    :param parser:
+        A :class:`~.css21.CSS21Parser` or a parser returned by
+        :func:`~tinycss.make_parser`. Defaults to a new
+        :class:`~.css21.CSS21Parser`.
+    :param cache:
+        A :class:`ParseCache`. Defaults to a new :class:`ParseCache`.
+    :param disk_cache:
+        A :class:`DiskCache` used by :meth:`parse_stylesheet_file` for
+        filenames, or ``None`` (the default).
+
+    """
+    def __init__(self, parser=None, cache=None, disk_cache=None):
+        self.parser = parser if parser is not None else CSS21Parser()
+        self.cache = cache if cache is not None else ParseCache()
+        self.disk_cache = disk_cache
+        self._parser_key = _parser_key(self.parser)
+
+    def parse_stylesheet_file(self, css_file, protocol_encoding=None,
+                              linking_encoding=None, document_encoding=None):
+        """Same as :meth:`~.css21.CSS21Parser.parse_stylesheet_file`,
+        with caching.
+
+        """
+        if self.disk_cache is None or hasattr(css_file, 'read'):
+            return self.parse_stylesheet_bytes(
+                _read(css_file), protocol_encoding, linking_encoding,
+                document_encoding)
+        return self.disk_cache.parse_file(
+            (self._parser_key, protocol_encoding, linking_encoding,
+             document_encoding),
+            css_file,
+            lambda css_bytes: self.parse_stylesheet_bytes(
+                css_bytes, protocol_encoding, linking_encoding,
+                document_encoding))
+
+    def parse_stylesheet_bytes(self, css_bytes, protocol_encoding=None,
+                               linking_encoding=None, document_encoding=None):
+        """Same as :meth:`~.css21.CSS21Parser.parse_stylesheet_bytes`,
+        with caching.
+
+        """
+        return self._parse(
+            css_bytes,
+            ('bytes', protocol_encoding, linking_encoding, document_encoding),
+            self.parser.parse_stylesheet_bytes, css_bytes, protocol_encoding,
+            linking_encoding, document_encoding)
+
+    def parse_stylesheet(self, css_unicode, encoding=None):
+        """Same as :meth:`~.css21.CSS21Parser.parse_stylesheet`,
+        with caching.
+
+        """
+        return self._parse(
+            css_unicode.encode('utf8', 'surrogatepass'),
+            ('unicode', encoding),
+            self.parser.parse_stylesheet, css_unicode, encoding)
+
+    def _parse(self, css_bytes, arguments, parse, *args):
+        """Return a cached stylesheet, or call ``parse(*args)``."""
+        key = (self._parser_key, hashlib.sha1(css_bytes).digest(), arguments)
+        data = self.cache.get(key)
+        if data is not None:
+            return pickle.loads(data)
+        stylesheet = parse(*args)
+        self.cache.put(key, pickle.dumps(stylesheet, pickle.HIGHEST_PROTOCOL))
+        return stylesheet
+
+
+def _parser_key(parser):
+    """Return the class and configuration of a parser, as a key that is the
+    same in every process.
+
+    Pickling the parser is not enough: the order of ``raw_at_keywords``,
+    a frozenset, depends on the hash seed of the process.
+
+    """
+    names = set(vars(parser)) | set([
+        'raw_at_keywords', 'share_values', 'error_mode', 'first_errors',
+        'limits'])
+    return (
+        tuple('{0}.{1}'.format(
+            cls.__module__, getattr(cls, '__qualname__', cls.__name__))
+            for cls in type(parser).__mro__),
+        tuple((name, _canonical(getattr(parser, name)))
+              for name in sorted(names)))
+
+
+def _canonical(value):
+    """Return a value of a parser attribute for :func:`_parser_key`."""
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    elif isinstance(value, ParseLimits):
+        return tuple(getattr(value, name) for name in LIMITS)
+    return value
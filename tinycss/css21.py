@@ -12,14 +12,17 @@
 
 from __future__ import unicode_literals
 
+import threading
+from bisect import bisect_left
 from itertools import chain, islice
 
 from .decoding import decode
 from .parsing import (
-    ParseError, remove_whitespace, split_on_comma, strip_whitespace,
+    ERROR_MODES, ErrorList, ParseBudget, ParseError, ParseLimitError,
+    _strip_whitespace, remove_whitespace, split_on_comma, strip_whitespace,
     validate_any, validate_value)
-from .token_data import TokenList
-from .tokenizer import tokenize_grouped
+from .token_data import TokenList, TokenSlice, intern_lower
+from .tokenizer import advance_position, split_statements, tokenize_grouped
 
 
 #  stylesheet  : [ CDO | CDC | S | statement ]*;
@@ -61,15 +64,72 @@ class Stylesheet(object):
         from bytes, or ``None`` for Unicode stylesheets.
 
     """
+    __slots__ = 'rules', 'errors', 'encoding', '__dict__'
+
     def __init__(self, rules, errors, encoding):
         self.rules = rules
         self.errors = errors
         self.encoding = encoding
 
+    def __getattr__(self, name):
+        # The rules and errors of CSS21Parser.reparse_stylesheet() are only
+        # moved to their new positions when they are needed.
+        if name not in ('rules', 'errors') or '_unplaced' not in self.__dict__:
+            raise AttributeError(name)
+        statements, errors = self.__dict__.pop('_unplaced')
+        rules = []
+        for statement in statements:
+            statement.place()
+            rules.extend(statement.rules)
+            errors.extend(statement.errors)
+        self.rules = rules
+        self.errors = errors
+        return getattr(self, name)
+
     def __repr__(self):
         return '<{0.__class__.__name__} {1} rules {2} errors>'.format(
             self, len(self.rules), len(self.errors))
 
+    def __reduce__(self):
+        return _reduce(self, (self.rules, self.errors, self.encoding))
+
+    def dumps(self):
+        """Serialize the stylesheet in a compact binary format.
+
+        See :func:`tinycss.serialize.dumps`.
+
+        :return:
+            A byte string.
+
+        """
+        from .serialize import dumps
+        return dumps(self)
+
+    def freeze(self):
+        """Make an immutable, hashable snapshot of the stylesheet.
+
+        See :func:`tinycss.frozen.freeze`.
+
+        :return:
+            A :class:`~tinycss.frozen.FrozenStylesheet`.
+
+        """
+        from .frozen import freeze
+        return freeze(self)
+
+    @staticmethod
+    def loads(data, lazy=False):
+        """Load a stylesheet serialized by :meth:`dumps`.
+
+        See :func:`tinycss.serialize.loads`.
+
+        :return:
+            A new :class:`Stylesheet`.
+
+        """
+        from .serialize import loads
+        return loads(data, lazy)
+
 
 class AtRule(object):
     """
@@ -101,6 +161,8 @@ class AtRule(object):
     the user API.
 
     """
+    __slots__ = 'at_keyword', 'head', 'body', 'line', 'column', '__dict__'
+
     def __init__(self, at_keyword, head, body, line, column):
         self.at_keyword = at_keyword
         self.head = TokenList(head)
@@ -112,6 +174,10 @@ class AtRule(object):
         return ('<{0.__class__.__name__} {0.line}:{0.column} {0.at_keyword}>'
                 .format(self))
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.at_keyword, self.head, self.body, self.line, self.column))
+
 
 class RuleSet(object):
     """A ruleset.
@@ -136,6 +202,8 @@ class RuleSet(object):
 
     at_keyword = None
 
+    __slots__ = 'selector', 'declarations', 'line', 'column', '__dict__'
+
     def __init__(self, selector, declarations, line, column):
         self.selector = TokenList(selector)
         self.declarations = declarations
@@ -146,6 +214,10 @@ class RuleSet(object):
         return ('<{0.__class__.__name__} at {0.line}:{0.column} {1}>'
                 .format(self, self.selector.as_css()))
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.selector, self.declarations, self.line, self.column))
+
 
 class Declaration(object):
     """A property declaration.
@@ -172,6 +244,8 @@ class Declaration(object):
         Either the string ``'important'`` or ``None``.
 
     """
+    __slots__ = 'name', 'value', 'priority', 'line', 'column', '__dict__'
+
     def __init__(self, name, value, priority, line, column):
         self.name = name
         self.value = TokenList(value)
@@ -185,6 +259,48 @@ class Declaration(object):
                 ' {0.name}: {1}{2}>'.format(
                     self, self.value.as_css(), priority))
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.name, self.value, self.priority, self.line, self.column))
+
+
+class RawAtRule(object):
+    """An at-rule that was not tokenized nor parsed.
+
+    These are at-rules whose at-keyword was given to the parser in
+    ``raw_at_keywords``. See :class:`CSS21Parser`.
+
+    .. attribute:: at_keyword
+
+        The normalized (lower-case) at-keyword as a string.
+        Eg: ``'@keyframes'``
+
+    .. attribute:: source
+
+        The whole CSS source of the at-rule as a string, from the at-keyword
+        to the final ``}`` or ``;`` included.
+
+    """
+    __slots__ = 'at_keyword', 'source', 'line', 'column', '__dict__'
+
+    def __init__(self, at_keyword, source, line, column):
+        self.at_keyword = at_keyword
+        self.source = source
+        self.line = line
+        self.column = column
+
+    def as_css(self):
+        """Return the CSS source of the at-rule, as parsed in the source."""
+        return self.source
+
+    def __repr__(self):
+        return ('<{0.__class__.__name__} {0.line}:{0.column} {0.at_keyword}>'
+                .format(self))
+
+    def __reduce__(self):
+        return _reduce(self, (
+            self.at_keyword, self.source, self.line, self.column))
+
 
 class PageRule(object):
     """A parsed CSS 2.1 @page rule.
@@ -217,6 +333,9 @@ class PageRule(object):
     """
     at_keyword = '@page'
 
+    __slots__ = ('selector', 'specificity', 'declarations', 'at_rules',
+                 'line', 'column', '__dict__')
+
     def __init__(self, selector, specificity, declarations, at_rules,
                  line, column):
         self.selector = selector
@@ -230,6 +349,11 @@ class PageRule(object):
         return ('<{0.__class__.__name__} {0.line}:{0.column}'
                 ' {0.selector}>'.format(self))
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.selector, self.specificity, self.declarations, self.at_rules,
+            self.line, self.column))
+
 
 class MediaRule(object):
     """A parsed @media rule.
@@ -251,6 +375,8 @@ class MediaRule(object):
     """
     at_keyword = '@media'
 
+    __slots__ = 'media', 'rules', 'line', 'column', '__dict__'
+
     def __init__(self, media, rules, line, column):
         self.media = media
         self.rules = rules
@@ -261,6 +387,9 @@ class MediaRule(object):
         return ('<{0.__class__.__name__} {0.line}:{0.column}'
                 ' {0.media}>'.format(self))
 
+    def __reduce__(self):
+        return _reduce(self, (self.media, self.rules, self.line, self.column))
+
 
 class ImportRule(object):
     """A parsed @import rule.
@@ -284,6 +413,8 @@ class ImportRule(object):
     """
     at_keyword = '@import'
 
+    __slots__ = 'uri', 'media', 'line', 'column', '__dict__'
+
     def __init__(self, uri, media, line, column):
         self.uri = uri
         self.media = media
@@ -294,6 +425,48 @@ class ImportRule(object):
         return ('<{0.__class__.__name__} {0.line}:{0.column}'
                 ' {0.uri}>'.format(self))
 
+    def __reduce__(self):
+        return _reduce(self, (self.uri, self.media, self.line, self.column))
+
+
+def _reduce(obj, args):
+    """Pickle an object as a call of its class with ``args``.
+
+    Other attributes, set after the object was made, are pickled too.
+
+    """
+    added = _added_attributes(obj)
+    if not added:
+        return type(obj), args
+    return type(obj), args, added
+
+
+def _added_attributes(obj):
+    """Return the dict of attributes set outside of the slots of a rule.
+
+    Reading ``__dict__`` makes a new dict when the rule has none, so an
+    empty dict is removed again to keep rules small.
+
+    """
+    added = obj.__dict__
+    if not added:
+        try:
+            del obj.__dict__
+        except (AttributeError, TypeError):
+            pass  # Not a slot
+    return added
+
+
+def _attributes(obj):
+    """Return a dict of all attributes of a rule, in slots or not."""
+    attributes = {}
+    for cls in reversed(type(obj).__mro__):
+        for name in cls.__dict__.get('__slots__', ()):
+            if name != '__dict__' and hasattr(obj, name):
+                attributes[name] = getattr(obj, name)
+    attributes.update(_added_attributes(obj))
+    return attributes
+
 
 def _remove_at_charset(tokens):
     """Remove any valid @charset at the beggining of a token stream.
@@ -315,6 +488,380 @@ def _remove_at_charset(tokens):
     return chain(header, tokens)
 
 
+class _Statements(object):
+    """The parsed rules and errors of a slice of a stylesheet, as recorded
+    by :meth:`CSS21Parser.reparse_stylesheet`.
+
+    ``line`` and ``column`` are the position of the slice. Rules and errors
+    were parsed at ``placed_line`` and ``placed_column``, and are only moved
+    from there by :meth:`place`. ``at_keyword`` is that of the statement
+    in the slice, as found by :func:`~.tokenizer.split_statements`.
+
+    """
+    __slots__ = ('line', 'column', 'placed_line', 'placed_column', 'rules',
+                 'errors', 'at_keyword')
+
+    def __init__(self, line, column, rules, errors, at_keyword=None):
+        self.line = self.placed_line = line
+        self.column = self.placed_column = column
+        self.rules = rules
+        self.errors = errors
+        self.at_keyword = at_keyword
+
+    def place(self):
+        """Move rules and errors to the position of the slice, in place."""
+        lines = self.line - self.placed_line
+        columns = self.column - self.placed_column
+        if lines or columns:
+            # Only what is on the first line of the slice changes columns.
+            _move_objects(self.rules, self.placed_line, lines, columns)
+            _move_objects(self.errors, self.placed_line, lines, columns)
+            self.placed_line = self.line
+            self.placed_column = self.column
+
+
+def _move_objects(objects, first_line, lines, columns):
+    """Update the position of rules, declarations and tokens, in place."""
+    for obj in objects:
+        if isinstance(obj, list):  # eg. a TokenList
+            _move_objects(obj, first_line, lines, columns)
+            continue
+        if not hasattr(obj, 'line'):
+            continue  # eg. the media types of a MediaRule
+        if obj.line == first_line:
+            obj.column += columns
+        obj.line += lines
+        if hasattr(obj, 'content'):  # ContainerToken
+            _move_objects(obj.content, first_line, lines, columns)
+        elif hasattr(obj, '__dict__') and not isinstance(obj, ParseError):
+            _move_objects(
+                [value for value in _attributes(obj).values()
+                 if isinstance(value, list)],
+                first_line, lines, columns)
+
+
+_SEGMENT_SIZE = 64
+
+
+class _Segment(object):
+    """Consecutive :class:`_Statements` of a :class:`_StatementList`, and
+    the indexes where they end in the source.
+
+    After an edit before them, only ``offset``, ``lines`` and ``columns``
+    change until :meth:`flush`: the statements end at ``ends[i] + offset``,
+    are ``lines`` lines after their ``line``, and those on the same line
+    as the first one are also ``columns`` columns after their ``column``.
+
+    """
+    __slots__ = 'statements', 'ends', 'offset', 'lines', 'columns', 'imports'
+
+    def __init__(self, statements, ends):
+        self.statements = statements
+        self.ends = ends
+        self.offset = self.lines = self.columns = 0
+        # @import statements are parsed again after edits before them.
+        self.imports = sum(
+            statement.at_keyword == '@import' for statement in statements)
+
+    def move(self, offset, lines, columns, first_line):
+        """Move the statements by ``offset`` characters and ``lines``
+        lines, and those on ``first_line`` by ``columns`` columns.
+
+        """
+        if self.statements[0].line + self.lines == first_line:
+            self.columns += columns
+        self.lines += lines
+        self.offset += offset
+
+    def flush(self):
+        """Apply pending moves to the statements and their ends."""
+        if self.lines or self.columns:
+            first_line = self.statements[0].line
+            for statement in self.statements:
+                if statement.line == first_line:
+                    statement.column += self.columns
+                statement.line += self.lines
+            self.lines = self.columns = 0
+        if self.offset:
+            self.ends = [end + self.offset for end in self.ends]
+            self.offset = 0
+
+
+class _StatementList(object):
+    """The :class:`_Statements` of a stylesheet and where each of them
+    ends in the source, as recorded by :meth:`CSS21Parser.reparse_stylesheet`.
+
+    Statements are kept in :class:`_Segment` objects of about the square
+    root of their number, so that an edit only copies the segments it
+    touches and moves the following segments as a whole. Statements are
+    located by ``(segment, index)`` tuples.
+
+    """
+    def __init__(self, statements, ends):
+        self.segments = self._split(statements, ends, len(statements))
+
+    def __iter__(self):
+        for segment in self.segments:
+            segment.flush()
+            for statement in segment.statements:
+                yield statement
+
+    @staticmethod
+    def _split(statements, ends, total):
+        """Cut statements into segments, for a list of ``total``
+        statements.
+
+        """
+        size = max(_SEGMENT_SIZE, int(total ** 0.5))
+        count = -(-len(statements) // size)
+        limits = [len(statements) * part // count
+                  for part in range(count + 1)] if count else []
+        return [_Segment(statements[start:stop], ends[start:stop])
+                for start, stop in zip(limits, limits[1:])]
+
+    def find(self, index):
+        """Locate the first statement that ends at or after ``index``
+        in the source, or the last statement.
+
+        """
+        segments = self.segments
+        low, high = 0, len(segments) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if segments[middle].ends[-1] + segments[middle].offset < index:
+                low = middle + 1
+            else:
+                high = middle
+        segment = segments[low]
+        return low, min(bisect_left(segment.ends, index - segment.offset),
+                        len(segment.ends) - 1)
+
+    def start(self, location):
+        """Return the index where a statement starts in the source."""
+        segment_index, index = location
+        if index:
+            segment = self.segments[segment_index]
+        elif segment_index:
+            segment = self.segments[segment_index - 1]
+            index = len(segment.ends)
+        else:
+            return 0
+        return segment.ends[index - 1] + segment.offset
+
+    def end(self, location):
+        """Return the index where a statement ends in the source."""
+        segment = self.segments[location[0]]
+        return segment.ends[location[1]] + segment.offset
+
+    def next(self, location):
+        """Locate the statement after another, or return ``None``."""
+        segment_index, index = location
+        if index + 1 < len(self.segments[segment_index].statements):
+            return segment_index, index + 1
+        if segment_index + 1 < len(self.segments):
+            return segment_index + 1, 0
+        return None
+
+    def items(self, location, imports=False):
+        """Yield ``(location, statement)`` tuples from ``location``,
+        only for @import statements if ``imports`` is true.
+
+        """
+        first_segment, first_index = location
+        for segment_index in range(first_segment, len(self.segments)):
+            segment = self.segments[segment_index]
+            start = first_index if segment_index == first_segment else 0
+            if imports and not segment.imports:
+                continue
+            segment.flush()
+            for index in range(start, len(segment.statements)):
+                statement = segment.statements[index]
+                if not imports or statement.at_keyword == '@import':
+                    yield (segment_index, index), statement
+
+    def replace(self, first, reused, statements, ends, offset, line,
+                column):
+        """Replace the statements from ``first`` to before ``reused`` (to
+        the end if ``reused`` is ``None``) with new ``statements`` that end
+        at ``ends``.
+
+        Reused statements move by ``offset`` characters, the first of them
+        to ``line`` and ``column``.
+
+        :return:
+            The new location of the first reused statement, or ``None``.
+
+        """
+        segments = self.segments
+        first_segment, index = first
+        segment = segments[first_segment]
+        segment.flush()
+        statements = segment.statements[:index] + statements
+        ends = segment.ends[:index] + ends
+        reused_index = len(statements)
+        if reused is None:
+            last_segment = len(segments) - 1
+        else:
+            last_segment, index = reused
+            segment = segments[last_segment]
+            segment.flush()
+            first_line = segment.statements[index].line
+            lines = line - first_line
+            columns = column - segment.statements[index].column
+            for statement in segment.statements[index:]:
+                if statement.line == first_line:
+                    statement.column += columns
+                statement.line += lines
+                statements.append(statement)
+            ends.extend(end + offset for end in segment.ends[index:])
+            for segment in islice(segments, last_segment + 1, None):
+                segment.move(offset, lines, columns, first_line)
+
+        total = sum(len(segment.statements) for segment in segments) + len(
+            statements) - sum(
+            len(segment.statements)
+            for segment in segments[first_segment:last_segment + 1])
+        size = max(_SEGMENT_SIZE, int(total ** 0.5))
+        while len(statements) < size // 2:
+            # Merge small segments with their neighbours.
+            if last_segment + 1 < len(segments):
+                last_segment += 1
+                segment = segments[last_segment]
+                segment.flush()
+                statements.extend(segment.statements)
+                ends.extend(segment.ends)
+            elif first_segment:
+                first_segment -= 1
+                segment = segments[first_segment]
+                segment.flush()
+                statements[:0] = segment.statements
+                ends[:0] = segment.ends
+                reused_index += len(segment.statements)
+            else:
+                break
+        new_segments = self._split(statements, ends, total)
+        segments[first_segment:last_segment + 1] = new_segments
+        if reused is None:
+            return None
+        segment_index = first_segment
+        for segment in new_segments:
+            if reused_index < len(segment.statements):
+                break
+            reused_index -= len(segment.statements)
+            segment_index += 1
+        return segment_index, reused_index
+
+
+def _add_leading_rules(leading, rules):
+    """Add ``rules`` to the rules that can be before an @import rule, up to
+    the first one that can not. Return whether it was found.
+
+    """
+    for rule in rules:
+        leading.append(rule)
+        if rule.at_keyword not in ('@charset', '@import'):
+            return True
+    return False
+
+
+class _SharedValues(object):
+    """Share equal declaration values, blocks and tokens with content.
+
+    Values are equal when they have the same tokens, regardless of their
+    positions.
+
+    """
+    def __init__(self):
+        self.containers = {}
+        self.values = {}
+        self.declarations = {}
+        self.blocks = {}
+
+    def share_rules(self, rules):
+        """Share values in rules and their nested rules, in place."""
+        for rule in rules:
+            declarations = getattr(rule, 'declarations', None)
+            if declarations is not None:
+                rule.declarations = self.share_block(declarations)
+            for name in ('rules', 'at_rules'):
+                nested_rules = getattr(rule, name, None)
+                if nested_rules:
+                    self.share_rules(nested_rules)
+
+    def share_block(self, declarations):
+        for i, declaration in enumerate(declarations):
+            declaration.value = value = self.share_tokens(declaration.value)
+            if _added_attributes(declaration):
+                continue  # Eg. set by a parser subclass, not shared
+            key = declaration.name, declaration.priority, id(value)
+            declarations[i] = self.declarations.setdefault(key, declaration)
+        key = tuple(map(id, declarations))
+        return self.blocks.setdefault(key, declarations)
+
+    def share_tokens(self, tokens):
+        """Return a shared list of tokens equal to ``tokens``."""
+        key = [type(tokens)]
+        for i, token in enumerate(tokens):
+            if token.is_container:
+                token = tokens[i] = self.share_container(token)
+                key.append(id(token))
+            else:
+                key.append((token.type, token.as_css()))
+        return self.values.setdefault(tuple(key), tokens)
+
+    def share_container(self, token):
+        token.content = content = self.share_tokens(token.content)
+        key = token.type, token.as_css(), id(content)
+        return self.containers.setdefault(key, token)
+
+
+# The ParseBudget of the parse running in each thread, if any
+_CURRENT = threading.local()
+
+
+class _Budget(object):
+    """Context manager giving the :class:`~.parsing.ParseBudget` of the
+    current parse in this thread, starting one for ``limits`` if needed,
+    or ``None`` for no limit.
+
+    """
+    __slots__ = 'limits', 'started'
+
+    def __init__(self, limits):
+        self.limits = limits
+
+    def __enter__(self):
+        budget = getattr(_CURRENT, 'budget', None)
+        self.started = budget is None and self.limits is not None
+        if self.started:
+            budget = _CURRENT.budget = ParseBudget(self.limits)
+        return budget
+
+    def __exit__(self, *exc_info):
+        if self.started:
+            _CURRENT.budget = None
+
+
+def _at_rule_handlers(parser_class):
+    """Return the ``{at_keyword: {context: method}}`` dict resolved from
+    the :attr:`~CSS21Parser.AT_RULES` of ``parser_class`` and its bases.
+
+    The dict is computed on first use and kept on the class. Racing threads
+    may both compute it, with equal results.
+
+    """
+    handlers = parser_class.__dict__.get('_at_rule_handlers')
+    if handlers is None:
+        handlers = {}
+        for cls in reversed(parser_class.__mro__):
+            for (at_keyword, context), name in (
+                    cls.__dict__.get('AT_RULES', {}).items()):
+                handlers.setdefault(at_keyword, {})[context] = getattr(
+                    parser_class, name)
+        parser_class._at_rule_handlers = handlers
+    return handlers
+
+
 class CSS21Parser(object):
     """Parser for CSS 2.1
 
@@ -324,11 +871,114 @@ class CSS21Parser(object):
     Note that property values are still not parsed, as UAs using this
     parser may only support some properties or some values.
 
-    Currently the parser holds no state. It being a class only allows
-    subclassing and overriding its methods.
+    The parser holds no state other than its configuration. It being a class
+    mostly allows subclassing and overriding its methods.
+
+    :param raw_at_keywords:
+        An iterable of at-keywords, eg. ``['@keyframes', '@supports']``.
+        Top-level at-rules with these keywords are kept as
+        :class:`RawAtRule` objects, without even tokenizing their content.
+        This is much cheaper than parsing unknown at-rules only to ignore
+        them with an error.
+    :param share_values:
+        If true, equal declaration values, blocks and tokens with content
+        are shared in each stylesheet returned by :meth:`parse_stylesheet`,
+        so that memory grows with the number of different values rather
+        than with the number of declarations. Shared objects must not be
+        modified, and they keep the position of their first occurrence.
+        With this option, :meth:`reparse_stylesheet` parses the whole
+        stylesheet again.
+    :param error_mode:
+        What to do with :class:`~.parsing.ParseError` objects:
+        ``'collect'`` (the default) keeps them all in lists, other modes
+        keep some of them in :class:`~.parsing.ErrorList` objects, to save
+        time and memory on stylesheets with many errors:
+        ``'count'`` only counts them by reason, ``'first'`` keeps the first
+        ``first_errors`` ones, and ``'ignore'`` keeps none.
+    :param first_errors:
+        The number of errors kept in the ``'first'`` error mode.
+    :param limits:
+        A :class:`~.parsing.ParseLimits` object for untrusted input, or
+        ``None`` for no limit. Limits apply to each call of the parsing
+        methods, or to each chunk of :mod:`tinycss.parallel` and
+        :mod:`tinycss.aio`. When parsing again after an edit, they only
+        apply to what is parsed again.
 
     """
 
+    #: The at-rules known by :meth:`parse_at_rule`: a dict mapping
+    #: ``(at_keyword, context)`` tuples to the name of the method that
+    #: parses them. At-keywords are lower-case, and a ``None`` context
+    #: allows the at-rule in any context. The dicts of all the classes in
+    #: the MRO are merged, subclasses winning, once per class: subclasses
+    #: only give their new at-rules.
+    AT_RULES = {
+        ('@page', 'stylesheet'): 'parse_page_rule',
+        ('@media', 'stylesheet'): 'parse_media_rule',
+        ('@import', 'stylesheet'): 'parse_import_rule',
+        ('@charset', None): 'parse_charset_rule',
+    }
+
+    raw_at_keywords = frozenset()
+    share_values = False
+    error_mode = 'collect'
+    first_errors = 100
+    limits = None
+
+    def __init__(self, raw_at_keywords=(), share_values=False,
+                 error_mode='collect', first_errors=100, limits=None):
+        if raw_at_keywords:
+            self.raw_at_keywords = frozenset(
+                at_keyword.lower() for at_keyword in raw_at_keywords)
+        if share_values:
+            self.share_values = True
+        if error_mode != 'collect':
+            if error_mode not in ERROR_MODES:
+                raise ValueError(
+                    'Unknown error mode: {0!r}'.format(error_mode))
+            self.error_mode = error_mode
+            self.first_errors = first_errors
+        if limits is not None:
+            self.limits = limits
+
+    def new_error_list(self, errors=()):
+        """Make an empty list for :class:`~.parsing.ParseError` objects.
+
+        :meth:`parse_rules` and methods that return errors of whole
+        stylesheets use this, so that errors are kept depending on the
+        ``error_mode`` of the parser. Errors of a single rule are kept in
+        a list until they are added to such a list.
+
+        :param errors:
+            An iterable of errors to add to the list.
+        :return:
+            A :class:`list`, or an :class:`~.parsing.ErrorList`.
+
+        """
+        if self.error_mode == 'collect':
+            return list(errors)
+        return ErrorList(self.error_mode, self.first_errors, errors)
+
+    def _length_errors(self, length):
+        """Return the errors for a source of ``length`` bytes or characters
+        if it exceeds the ``max_bytes`` limit, or ``None``.
+
+        """
+        if self.limits is not None:
+            try:
+                ParseBudget(self.limits).check_length(length)
+            except ParseLimitError as exc:
+                return self._limit_errors(exc)
+
+    def _limit_errors(self, error):
+        """Make an error list with a :class:`~.parsing.ParseLimitError`,
+        kept whatever the error mode.
+
+        """
+        errors = self.new_error_list()
+        list.append(errors, error)
+        return errors
+
     # User API:
 
     def parse_stylesheet_file(self, css_file, protocol_encoding=None,
@@ -376,9 +1026,15 @@ class CSS21Parser(object):
             A :class:`Stylesheet`.
 
         """
-        css_unicode, encoding = decode(css_bytes, protocol_encoding,
-                                       linking_encoding, document_encoding)
-        return self.parse_stylesheet(css_unicode, encoding=encoding)
+        with _Budget(self.limits) as budget:
+            if budget is not None:
+                try:
+                    budget.check_length(len(css_bytes))
+                except ParseLimitError as exc:
+                    return Stylesheet([], self._limit_errors(exc), None)
+            css_unicode, encoding = decode(css_bytes, protocol_encoding,
+                                           linking_encoding, document_encoding)
+            return self.parse_stylesheet(css_unicode, encoding=encoding)
 
     def parse_stylesheet(self, css_unicode, encoding=None):
         """Parse a stylesheet from an Unicode string.
@@ -392,10 +1048,21 @@ class CSS21Parser(object):
             A :class:`Stylesheet`.
 
         """
-        tokens = tokenize_grouped(css_unicode)
-        if encoding:
-            tokens = _remove_at_charset(tokens)
-        rules, errors = self.parse_rules(tokens, context='stylesheet')
+        with _Budget(self.limits) as budget:
+            try:
+                if budget is not None:
+                    budget.check_length(len(css_unicode))
+                tokens = tokenize_grouped(
+                    css_unicode, raw_at_keywords=self.raw_at_keywords,
+                    validate=True, budget=budget)
+                if encoding:
+                    tokens = _remove_at_charset(tokens)
+                rules, errors = self.parse_rules(tokens, context='stylesheet')
+            except ParseLimitError as exc:
+                # Exceeded before parse_rules() could catch it.
+                return Stylesheet([], self._limit_errors(exc), encoding)
+        if self.share_values:
+            _SharedValues().share_rules(rules)
         return Stylesheet(rules, errors, encoding)
 
     def parse_style_attr(self, css_source):
@@ -410,7 +1077,285 @@ class CSS21Parser(object):
             A tuple of the list of valid :class:`Declaration` and
             a list of :class:`~.parsing.ParseError`.
         """
-        return self.parse_declaration_list(tokenize_grouped(css_source))
+        with _Budget(self.limits) as budget:
+            try:
+                if budget is not None:
+                    budget.check_length(len(css_source))
+                declarations, errors = self.parse_declaration_list(
+                    tokenize_grouped(css_source, validate=True, budget=budget))
+            except ParseLimitError as exc:
+                return [], self._limit_errors(exc)
+        return declarations, self.new_error_list(errors)
+
+    def parse_selectors(self, css_unicode):
+        """Parse only the selectors of the rulesets in a stylesheet.
+
+        This is much cheaper than :meth:`parse_stylesheet` when only
+        selectors are needed: declaration blocks are skipped without being
+        tokenized. Rulesets in @media rules are included, other at-rules
+        are skipped.
+
+        :param css_unicode:
+            A CSS stylesheet as an unicode string.
+        :return:
+            A tuple of a list of selectors, in source order, and a list of
+            :class:`~.parsing.ParseError` for invalid selectors and @media
+            rules. Selectors are :class:`~.token_data.TokenList` objects,
+            the same as the :attr:`~RuleSet.selector` attribute of
+            :class:`RuleSet`.
+
+        """
+        selectors = []
+        errors = self.new_error_list()
+        with _Budget(self.limits) as budget:
+            try:
+                if budget is not None:
+                    budget.check_length(len(css_unicode))
+                self._parse_selectors(css_unicode, 0, len(css_unicode), 1, 1,
+                                      'stylesheet', selectors, errors)
+            except ParseLimitError as exc:
+                list.append(errors, exc)
+        return selectors, errors
+
+    def _parse_selectors(self, css_unicode, start, end, line, column,
+                         context, selectors, errors):
+        """Add to ``selectors`` and ``errors`` for a slice of the source."""
+        budget = getattr(_CURRENT, 'budget', None)
+        position = start
+        for start, end, at_keyword, block_start, block_end in (
+                split_statements(css_unicode, start, end)):
+            if budget is not None and budget.error is not None:
+                return
+            line, column = advance_position(
+                css_unicode, position, start, line, column)
+            position = start
+            # Only tokenize up to the opening { of the block, included.
+            head_end = end if block_start is None else block_start + 1
+            if at_keyword is None:
+                tokens = tokenize_grouped(
+                    css_unicode[start:head_end], line=line, column=column,
+                    budget=budget)
+                rules, rule_errors = self.parse_rules(tokens, context)
+                selectors.extend(rule.selector for rule in rules)
+                errors.extend(rule_errors)
+            elif (at_keyword == '@media' and context == 'stylesheet' and
+                    block_start is not None):
+                tokens = tokenize_grouped(
+                    css_unicode[start:head_end], line=line, column=column,
+                    budget=budget)
+                for token in tokens:
+                    if token.type not in ('S', 'CDO', 'CDC'):
+                        break
+                try:
+                    rule = self.read_at_rule(token, tokens)
+                    if not rule.head:
+                        raise ParseError(
+                            rule, 'expected media types for @media')
+                    self.parse_media(rule.head)
+                except ParseLimitError:
+                    raise
+                except ParseError as exc:
+                    errors.append(exc)
+                    continue
+                body_line, body_column = advance_position(
+                    css_unicode, start, block_start + 1, line, column)
+                self._parse_selectors(
+                    css_unicode, block_start + 1, block_end,
+                    body_line, body_column, '@media', selectors, errors)
+
+    def reparse_stylesheet(self, stylesheet, css_unicode, start, end):
+        """Parse a stylesheet again after an edit of its source.
+
+        Only the statements touched by the edit and the ``@import`` rules
+        after it are parsed again, other rules are reused from
+        ``stylesheet``. The first call on a result of
+        :meth:`parse_stylesheet` still parses everything, in order to
+        record where each statement is. After that, the cost of an edit
+        barely depends on the size of the stylesheet.
+
+        The result is the same as :meth:`parse_stylesheet` on the new
+        source, but reused rules have their ``line`` and ``column``
+        attributes (and those of their declarations and tokens) updated
+        in place when the ``rules`` or ``errors`` of the result are first
+        accessed: ``stylesheet`` should not be used anymore, and passing
+        it again to this method parses everything.
+
+        :param stylesheet:
+            The :class:`Stylesheet` for the source before the edit,
+            as returned by :meth:`parse_stylesheet` or by this method.
+        :param css_unicode:
+            The whole stylesheet after the edit, as an unicode string.
+        :param start:
+            The index in the previous source where the edit starts.
+        :param end:
+            The index in the previous source where the edit ends.
+            ``previous[start:end]`` was replaced by
+            ``css_unicode[start:end + len(css_unicode) - len(previous)]``,
+            where ``previous`` is the source before the edit.
+        :return:
+            A :class:`Stylesheet`.
+
+        """
+        encoding = stylesheet.encoding
+        if self.share_values:
+            # Moving shared objects would move other occurrences too.
+            return self.parse_stylesheet(css_unicode, encoding)
+        # Statements are updated in place, they can only be reused once.
+        previous = stylesheet.__dict__.pop('_statements', None)
+        with _Budget(self.limits) as budget:
+            if budget is not None:
+                try:
+                    budget.check_length(len(css_unicode))
+                except ParseLimitError as exc:
+                    return Stylesheet([], self._limit_errors(exc), encoding)
+            if previous is None:
+                statements = _StatementList([], [])
+                offset = 0
+            else:
+                source_length, statements = previous
+                offset = len(css_unicode) - source_length
+            self._reparse_statements(
+                statements, css_unicode, start, end, offset, encoding)
+        stylesheet = Stylesheet.__new__(Stylesheet)
+        stylesheet.encoding = encoding
+        stylesheet._unplaced = statements, self.new_error_list()
+        if budget is None or budget.error is None:
+            # Partial results can not be parsed again incrementally.
+            stylesheet._statements = len(css_unicode), statements
+        return stylesheet
+
+    def _reparse_statements(self, statements, css_unicode, start, end,
+                            offset, encoding):
+        """Update a :class:`_StatementList` in place after an edit.
+        An empty list is parsed from the start.
+
+        """
+        budget = getattr(_CURRENT, 'budget', None)
+        # Whether an @import rule is valid depends on the rules before it,
+        # up to the first rule that is not an @charset or @import rule.
+        leading = []
+        found = False
+        if statements.segments:
+            # The statement just before the edit is parsed again too,
+            # as its last token might continue after it.
+            first = statements.find(start)
+            for location, statement in statements.items((0, 0)):
+                if found or location == first:
+                    break
+                statement.place()
+                found = _add_leading_rules(leading, statement.rules)
+            segment = statements.segments[first[0]]
+            segment.flush()
+            statement = segment.statements[first[1]]
+            line, column = statement.line, statement.column
+            parse_start = statements.start(first)
+        else:
+            first = None
+            line, column, parse_start = 1, 1, 0
+
+        new_statements = []
+        new_ends = []
+        reused = None
+        for statement_start, statement_end, at_keyword, _, _ in (
+                split_statements(css_unicode, parse_start)):
+            statement = self._parse_statement(
+                css_unicode, statement_start, statement_end, line, column,
+                encoding if statement_start == 0 else None,
+                leading if at_keyword == '@import' else None, at_keyword)
+            new_statements.append(statement)
+            new_ends.append(statement_end)
+            if budget is not None and budget.error is not None:
+                break
+            if not found:
+                found = _add_leading_rules(leading, statement.rules)
+            line, column = advance_position(
+                css_unicode, statement_start, statement_end, line, column)
+            # Previous statements are unchanged after a statement boundary
+            # that is both in the old and new sources, after the edit.
+            old_end = statement_end - offset
+            if first is not None and old_end >= end:
+                location = statements.find(old_end)
+                if statements.end(location) == old_end:
+                    reused = statements.next(location)
+                    break
+
+        if first is None:
+            statements.segments = statements._split(
+                new_statements, new_ends, len(new_statements))
+            return
+        # Reused rules and errors are only moved by Stylesheet.__getattr__.
+        location = statements.replace(
+            first, reused, new_statements, new_ends, offset, line, column)
+        if location is None:
+            return
+        # Reused @import statements are parsed again, as the rules before
+        # them might have changed or moved.
+        if not found:
+            for location, statement in statements.items(location):
+                if statement.at_keyword == '@import':
+                    statement = self._reparse_import(
+                        statements, location, css_unicode, leading)
+                    if statement is None:
+                        return
+                statement.place()
+                if _add_leading_rules(leading, statement.rules):
+                    break
+            else:
+                return
+        for location, statement in statements.items(location, imports=True):
+            if self._reparse_import(
+                    statements, location, css_unicode, leading) is None:
+                return
+
+    def _reparse_import(self, statements, location, css_unicode, leading):
+        """Parse again the @import statement at ``location`` in
+        a :class:`_StatementList`, after ``leading`` rules.
+
+        :return:
+            The new :class:`_Statements`, or ``None`` if a limit is
+            exceeded and the following statements are dropped.
+
+        """
+        segment_index, index = location
+        segment = statements.segments[segment_index]
+        previous = segment.statements[index]
+        statement = segment.statements[index] = self._parse_statement(
+            css_unicode, statements.start(location), segment.ends[index],
+            previous.line, previous.column, None, leading, '@import')
+        budget = getattr(_CURRENT, 'budget', None)
+        if budget is not None and budget.error is not None:
+            statements.replace(
+                location, None, [statement], [segment.ends[index]], 0, 0, 0)
+            return None
+        return statement
+
+    def _parse_statement(self, css_unicode, start, end, line, column,
+                         encoding=None, previous_rules=None,
+                         at_keyword=None):
+        """Parse a slice of a stylesheet as :class:`_Statements`.
+
+        ``previous_rules`` are the rules before the slice, as seen by
+        :meth:`parse_at_rule`.
+
+        """
+        with _Budget(self.limits) as budget:
+            tokens = tokenize_grouped(
+                css_unicode[start:end], line=line, column=column,
+                raw_at_keywords=self.raw_at_keywords, validate=True,
+                budget=budget)
+            try:
+                if budget is not None:
+                    # The whole stylesheet counts, not only the slice.
+                    budget.check_length(len(css_unicode))
+                if encoding:
+                    tokens = _remove_at_charset(tokens)
+                _CURRENT.previous_rules = previous_rules
+                rules, errors = self.parse_rules(tokens, context='stylesheet')
+            except ParseLimitError as exc:
+                rules, errors = [], self._limit_errors(exc)
+            finally:
+                _CURRENT.previous_rules = None
+        return _Statements(line, column, rules, errors, at_keyword)
 
     # API for subclasses:
 
@@ -426,26 +1371,72 @@ class CSS21Parser(object):
             A tuple of a list of parsed rules and a list of
             :class:`~.parsing.ParseError`.
 
+        With :class:`~.parsing.ParseLimits`, rules are counted here and
+        errors are checked before each rule. The outermost call stops at
+        the first exceeded limit: it returns the rules parsed before and
+        a :class:`~.parsing.ParseLimitError` at the end of the errors.
+
         """
         rules = []
-        errors = []
+        previous_rules = getattr(_CURRENT, 'previous_rules', None)
+        if previous_rules:
+            # Rules of previous statements, set by _parse_statement().
+            _CURRENT.previous_rules = None
+            rules.extend(previous_rules)
+        errors = self.new_error_list()
+        budget = getattr(_CURRENT, 'budget', None)
+        if budget is None:
+            self._parse_rules(tokens, context, rules, errors, budget)
+        elif budget.parsing_rules:
+            budget.error_lists.append(errors)
+            try:
+                self._parse_rules(tokens, context, rules, errors, budget)
+            finally:
+                budget.error_lists.pop()
+        else:
+            budget.parsing_rules = True
+            budget.error_lists.append(errors)
+            try:
+                self._parse_rules(tokens, context, rules, errors, budget)
+            except ParseLimitError as exc:
+                list.append(errors, exc)
+            finally:
+                budget.parsing_rules = False
+                budget.error_lists.pop()
+                budget.errors += len(errors) + getattr(errors, 'dropped', 0)
+        if previous_rules:
+            del rules[:len(previous_rules)]
+        return rules, errors
+
+    def _parse_rules(self, tokens, context, rules, errors, budget):
+        """Implement :meth:`parse_rules`, adding to ``rules`` and
+        ``errors``.
+
+        """
         tokens = iter(tokens)
         for token in tokens:
             if token.type not in ('S', 'CDO', 'CDC'):
+                if budget is not None:
+                    budget.count_rule(token)
                 try:
                     if token.type == 'ATKEYWORD':
                         rule = self.read_at_rule(token, tokens)
                         result = self.parse_at_rule(
                             rule, rules, errors, context)
                         rules.append(result)
+                    elif token.type == 'RAW_AT_RULE':
+                        rules.append(RawAtRule(
+                            token.value, token.as_css(),
+                            token.line, token.column))
                     else:
                         rule, rule_errors = self.parse_ruleset(token, tokens)
                         rules.append(rule)
                         errors.extend(rule_errors)
+                except ParseLimitError:
+                    raise
                 except ParseError as exc:
                     errors.append(exc)
                     # Skip the entire rule
-        return rules, errors
 
     def read_at_rule(self, at_keyword_token, tokens):
         """Read an at-rule from a token stream.
@@ -465,7 +1456,7 @@ class CSS21Parser(object):
 
         """
         # CSS syntax is case-insensitive
-        at_keyword = at_keyword_token.value.lower()
+        at_keyword = intern_lower(at_keyword_token.value)
         head = []
         # For the ParseError in case `tokens` is empty:
         token = at_keyword_token
@@ -486,8 +1477,10 @@ class CSS21Parser(object):
     def parse_at_rule(self, rule, previous_rules, errors, context):
         """Parse an at-rule.
 
-        Subclasses that override this method must use ``super()`` and
-        pass its return value for at-rules they do not know.
+        The at-rule is parsed by the method that :attr:`AT_RULES` gives
+        for its at-keyword and context. Subclasses can add at-rules there,
+        or override this method. Overriding methods must use ``super()``
+        and pass its return value for at-rules they do not know.
 
         In CSS 2.1, this method handles @charset, @import, @media and @page
         rules.
@@ -508,70 +1501,74 @@ class CSS21Parser(object):
             A parsed at-rule
 
         """
-        if rule.at_keyword == '@page':
-            if context != 'stylesheet':
-                raise ParseError(rule, '@page rule not allowed in ' + context)
-            selector, specificity = self.parse_page_selector(rule.head)
-            if rule.body is None:
-                raise ParseError(
-                    rule, 'invalid {0} rule: missing block'.format(
-                        rule.at_keyword))
-            declarations, at_rules, rule_errors = \
-                self.parse_declarations_and_at_rules(rule.body, '@page')
-            errors.extend(rule_errors)
-            return PageRule(selector, specificity, declarations, at_rules,
-                            rule.line, rule.column)
-
-        elif rule.at_keyword == '@media':
-            if context != 'stylesheet':
-                raise ParseError(rule, '@media rule not allowed in ' + context)
-            if not rule.head:
-                raise ParseError(rule, 'expected media types for @media')
-            media = self.parse_media(rule.head)
-            if rule.body is None:
-                raise ParseError(
-                    rule, 'invalid {0} rule: missing block'.format(
-                        rule.at_keyword))
-            rules, rule_errors = self.parse_rules(rule.body, '@media')
-            errors.extend(rule_errors)
-            return MediaRule(media, rules, rule.line, rule.column)
-
-        elif rule.at_keyword == '@import':
-            if context != 'stylesheet':
-                raise ParseError(
-                    rule, '@import rule not allowed in ' + context)
-            for previous_rule in previous_rules:
-                if previous_rule.at_keyword not in ('@charset', '@import'):
-                    if previous_rule.at_keyword:
-                        type_ = 'an {0} rule'.format(previous_rule.at_keyword)
-                    else:
-                        type_ = 'a ruleset'
-                    raise ParseError(
-                        previous_rule,
-                        '@import rule not allowed after ' + type_)
-            head = rule.head
-            if not head:
-                raise ParseError(
-                    rule, 'expected URI or STRING for @import rule')
-            if head[0].type not in ('URI', 'STRING'):
-                raise ParseError(
-                    rule, 'expected URI or STRING for @import rule, got ' +
-                    head[0].type)
-            uri = head[0].value
-            media = self.parse_media(strip_whitespace(head[1:]))
-            if rule.body is not None:
-                # The position of the ';' token would be best, but we don’t
-                # have it anymore here.
-                raise ParseError(head[-1], "expected ';', got a block")
-            return ImportRule(uri, media, rule.line, rule.column)
-
-        elif rule.at_keyword == '@charset':
-            raise ParseError(rule, 'mis-placed or malformed @charset rule')
+        contexts = _at_rule_handlers(type(self)).get(rule.at_keyword)
+        if contexts is None:
+            raise ParseError(
+                rule, 'unknown at-rule in {0} context: {1}', context,
+                rule.at_keyword)
+        handler = contexts.get(context) or contexts.get(None)
+        if handler is None:
+            raise ParseError(
+                rule, '{0} rule not allowed in {1}', rule.at_keyword, context)
+        return handler(self, rule, previous_rules, errors, context)
 
-        else:
+    def parse_page_rule(self, rule, previous_rules, errors, context):
+        """Parse an @page rule. See :meth:`parse_at_rule`."""
+        selector, specificity = self.parse_page_selector(rule.head)
+        if rule.body is None:
             raise ParseError(
-                rule, 'unknown at-rule in {0} context: {1}'.format(
-                    context, rule.at_keyword))
+                rule, 'invalid {0} rule: missing block', rule.at_keyword)
+        declarations, at_rules, rule_errors = \
+            self.parse_declarations_and_at_rules(rule.body, '@page')
+        errors.extend(rule_errors)
+        return PageRule(selector, specificity, declarations, at_rules,
+                        rule.line, rule.column)
+
+    def parse_media_rule(self, rule, previous_rules, errors, context):
+        """Parse an @media rule. See :meth:`parse_at_rule`."""
+        if not rule.head:
+            raise ParseError(rule, 'expected media types for @media')
+        media = self.parse_media(rule.head)
+        if rule.body is None:
+            raise ParseError(
+                rule, 'invalid {0} rule: missing block', rule.at_keyword)
+        rules, rule_errors = self.parse_rules(rule.body, '@media')
+        errors.extend(rule_errors)
+        return MediaRule(media, rules, rule.line, rule.column)
+
+    def parse_import_rule(self, rule, previous_rules, errors, context):
+        """Parse an @import rule. See :meth:`parse_at_rule`."""
+        for previous_rule in previous_rules:
+            if previous_rule.at_keyword not in ('@charset', '@import'):
+                if previous_rule.at_keyword:
+                    type_ = 'an {0} rule'.format(previous_rule.at_keyword)
+                else:
+                    type_ = 'a ruleset'
+                raise ParseError(
+                    previous_rule, '@import rule not allowed after {0}',
+                    type_)
+        head = rule.head
+        if not head:
+            raise ParseError(
+                rule, 'expected URI or STRING for @import rule')
+        if head[0].type not in ('URI', 'STRING'):
+            raise ParseError(
+                rule, 'expected URI or STRING for @import rule, got {0}',
+                head[0].type)
+        uri = head[0].value
+        media = self.parse_media(strip_whitespace(head[1:]))
+        if rule.body is not None:
+            # The position of the ';' token would be best, but we don’t
+            # have it anymore here.
+            raise ParseError(head[-1], "expected ';', got a block")
+        return ImportRule(uri, media, rule.line, rule.column)
+
+    def parse_charset_rule(self, rule, previous_rules, errors, context):
+        """Reject an @charset rule: valid ones are removed before parsing
+        rules. See :meth:`parse_at_rule`.
+
+        """
+        raise ParseError(rule, 'mis-placed or malformed @charset rule')
 
     def parse_media(self, tokens):
         """For CSS 2.1, parse a list of media types.
@@ -648,27 +1645,40 @@ class CSS21Parser(object):
         at_rules = []
         declarations = []
         errors = []
-        tokens = iter(tokens)
-        for token in tokens:
-            if token.type == 'ATKEYWORD':
-                try:
-                    rule = self.read_at_rule(token, tokens)
-                    result = self.parse_at_rule(
-                        rule, at_rules, errors, context)
-                    at_rules.append(result)
-                except ParseError as err:
-                    errors.append(err)
-            elif token.type != 'S':
-                declaration_tokens = []
-                while token and token.type != ';':
-                    declaration_tokens.append(token)
-                    token = next(tokens, None)
-                if declaration_tokens:
+        budget = getattr(_CURRENT, 'budget', None)
+        if budget is not None:
+            budget.error_lists.append(errors)
+        try:
+            tokens = iter(tokens)
+            for token in tokens:
+                if token.type == 'ATKEYWORD':
+                    if budget is not None:
+                        budget.count_rule(token)
                     try:
-                        declarations.append(
-                            self.parse_declaration(declaration_tokens))
+                        rule = self.read_at_rule(token, tokens)
+                        result = self.parse_at_rule(
+                            rule, at_rules, errors, context)
+                        at_rules.append(result)
+                    except ParseLimitError:
+                        raise
                     except ParseError as err:
                         errors.append(err)
+                elif token.type != 'S':
+                    if budget is not None:
+                        budget.check_errors(token)
+                    declaration_tokens = []
+                    while token and token.type != ';':
+                        declaration_tokens.append(token)
+                        token = next(tokens, None)
+                    if declaration_tokens:
+                        try:
+                            declarations.append(
+                                self.parse_declaration(declaration_tokens))
+                        except ParseError as err:
+                            errors.append(err)
+        finally:
+            if budget is not None:
+                budget.error_lists.pop()
         return declarations, at_rules, errors
 
     def parse_ruleset(self, first_token, tokens):
@@ -726,27 +1736,36 @@ class CSS21Parser(object):
             of :class:`~.parsing.ParseError`
 
         """
-        # split at ';'
-        parts = []
-        this_part = []
-        for token in tokens:
-            if token.type == ';':
-                parts.append(this_part)
-                this_part = []
-            else:
-                this_part.append(token)
-        parts.append(this_part)
-
+        # Split at ';', with views of the token list
+        if isinstance(tokens, list):
+            backing, start, end = tokens, 0, len(tokens)
+        else:
+            if type(tokens) is not TokenSlice:
+                tokens = TokenSlice(tokens)
+            backing, start, end = tokens.tokens, tokens.start, tokens.stop
         declarations = []
         errors = []
-        for tokens in parts:
-            tokens = strip_whitespace(tokens)
-            if tokens:
-                try:
-                    declarations.append(self.parse_declaration(tokens))
-                except ParseError as exc:
-                    errors.append(exc)
-                    # Skip the entire declaration
+        budget = getattr(_CURRENT, 'budget', None)
+        if budget is not None:
+            budget.error_lists.append(errors)
+        try:
+            for stop in range(start, end + 1):
+                if stop < end and backing[stop].type != ';':
+                    continue
+                first, last = _strip_whitespace(backing, start, stop)
+                start = stop + 1
+                if first < last:
+                    if budget is not None:
+                        budget.check_errors(backing[first])
+                    try:
+                        declarations.append(self.parse_declaration(
+                            TokenSlice(backing, first, last)))
+                    except ParseError as exc:
+                        errors.append(exc)
+                        # Skip the entire declaration
+        finally:
+            if budget is not None:
+                budget.error_lists.pop()
         return declarations, errors
 
     def parse_declaration(self, tokens):
@@ -765,32 +1784,36 @@ class CSS21Parser(object):
             'declaration' production of the core grammar.
 
         """
-        tokens = iter(tokens)
+        if type(tokens) is not TokenSlice:
+            tokens = TokenSlice(tokens)
+        backing, start, stop = tokens.tokens, tokens.start, tokens.stop
 
-        name_token = next(tokens)  # assume there is at least one
+        name_token = backing[start]  # assume there is at least one
         if name_token.type == 'IDENT':
             # CSS syntax is case-insensitive
-            property_name = name_token.value.lower()
+            property_name = intern_lower(name_token.value)
         else:
             raise ParseError(
-                name_token, 'expected a property name, got {0}'.format(
-                    name_token.type))
+                name_token, 'expected a property name, got {0}',
+                name_token.type)
 
         token = name_token  # In case ``tokens`` is now empty
-        for token in tokens:
+        for index in range(start + 1, stop):
+            token = backing[index]
             if token.type == ':':
                 break
             elif token.type != 'S':
-                raise ParseError(
-                    token, "expected ':', got {0}".format(token.type))
+                raise ParseError(token, "expected ':', got {0}", token.type)
         else:
             raise ParseError(token, "expected ':'")
 
-        value = strip_whitespace(list(tokens))
-        if not value:
+        start, stop = _strip_whitespace(backing, index + 1, stop)
+        if start == stop:
             raise ParseError(token, 'expected a property value')
+        value = TokenSlice(backing, start, stop)
         validate_value(value)
         value, priority = self.parse_value_priority(value)
+        # Only copy the tokens once, for the declaration
         return Declaration(
             property_name, value, priority, name_token.line, name_token.column)
 
@@ -798,25 +1821,33 @@ class CSS21Parser(object):
         """Separate any ``!important`` marker at the end of a property value.
 
         :param tokens:
-            A list of tokens for the property value.
+            A list of tokens for the property value, or a
+            :class:`~.token_data.TokenSlice` of such a list.
         :returns:
-            A tuple of the actual property value (a list of tokens)
+            A tuple of the actual property value (``tokens``, or a
+            :class:`~.token_data.TokenSlice` view of it without the marker)
             and the :attr:`~Declaration.priority`.
         """
-        value = list(tokens)
+        value = tokens
+        if type(value) is not TokenSlice:
+            value = TokenSlice(value)
+        backing = value.tokens
+        start = value.start
         # Walk the token list from the end
-        token = value.pop()
+        stop = value.stop - 1
+        token = backing[stop]
         if token.type == 'IDENT' and token.value.lower() == 'important':
-            while value:
-                token = value.pop()
+            while stop > start:
+                stop -= 1
+                token = backing[stop]
                 if token.type == 'DELIM' and token.value == '!':
                     # Skip any white space before the '!'
-                    while value and value[-1].type == 'S':
-                        value.pop()
-                    if not value:
+                    while stop > start and backing[stop - 1].type == 'S':
+                        stop -= 1
+                    if stop == start:
                         raise ParseError(
                             token, 'expected a value before !important')
-                    return value, 'important'
+                    return TokenSlice(backing, start, stop), 'important'
                 # Skip white space between '!' and 'important'
                 elif token.type != 'S':
                     break
@@ -95,6 +95,14 @@ def try_encoding(css_bytes, encoding, fallback=True):
     return css_unicode
 
 
+def _read(css_file):
+    """Read bytes from a file or filename."""
+    if hasattr(css_file, 'read'):
+        return css_file.read()
+    with open(css_file, 'rb') as fd:
+        return fd.read()
+
+
 def hex2re(hex_data):
     return re.escape(unhexlify(hex_data.replace(' ', '').encode('ascii')))
 
@@ -14,7 +14,7 @@
 
 from __future__ import division, unicode_literals
 
-from .css21 import CSS21Parser, ParseError
+from .css21 import CSS21Parser, ParseError, _reduce
 
 
 class FontFaceRule(object):
@@ -38,6 +38,8 @@ class FontFaceRule(object):
 
     """
 
+    __slots__ = 'at_keyword', 'declarations', 'line', 'column', '__dict__'
+
     def __init__(self, at_keyword, declarations, line, column):
         assert at_keyword == '@font-face'
         self.at_keyword = at_keyword
@@ -45,6 +47,10 @@ class FontFaceRule(object):
         self.line = line
         self.column = column
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.at_keyword, self.declarations, self.line, self.column))
+
 
 class FontFeatureValuesRule(object):
     """A parsed at-rule for font feature values.
@@ -72,6 +78,9 @@ class FontFeatureValuesRule(object):
 
     """
 
+    __slots__ = ('at_keyword', 'at_rules', 'family_names', 'line',
+                 'column', '__dict__')
+
     def __init__(self, at_keyword, at_rules, family_names, line, column):
         assert at_keyword == '@font-feature-values'
         self.at_keyword = at_keyword
@@ -80,6 +89,11 @@ class FontFeatureValuesRule(object):
         self.line = line
         self.column = column
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.at_keyword, self.at_rules, self.family_names, self.line,
+            self.column))
+
 
 class FontFeatureRule(object):
     """A parsed at-rule for font features.
@@ -109,12 +123,18 @@ class FontFeatureRule(object):
 
     """
 
+    __slots__ = 'at_keyword', 'declarations', 'line', 'column', '__dict__'
+
     def __init__(self, at_keyword, declarations, line, column):
         self.at_keyword = at_keyword
         self.declarations = declarations
         self.line = line
         self.column = column
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.at_keyword, self.declarations, self.line, self.column))
+
 
 class CSSFonts3Parser(CSS21Parser):
     """Extend :class:`~.css21.CSS21Parser` for `CSS 3 Fonts`_ syntax.
@@ -132,37 +152,51 @@ class CSSFonts3Parser(CSS21Parser):
         '@annotation',
     ]
 
-    def parse_at_rule(self, rule, previous_rules, errors, context):
-        if rule.at_keyword == '@font-face':
-            if rule.head:
-                raise ParseError(
-                    rule.head[0],
-                    'unexpected {0} token in {1} rule header'.format(
-                        rule.head[0].type, rule.at_keyword))
-            declarations, body_errors = self.parse_declaration_list(rule.body)
-            errors.extend(body_errors)
-            return FontFaceRule(
-                rule.at_keyword, declarations, rule.line, rule.column)
-        elif rule.at_keyword == '@font-feature-values':
-            family_names = tuple(
-                self.parse_font_feature_values_family_names(rule.head))
-            at_rules, body_errors = (
-                self.parse_rules(rule.body or [], '@font-feature-values'))
-            errors.extend(body_errors)
-            return FontFeatureValuesRule(
-                rule.at_keyword, at_rules, family_names,
-                rule.line, rule.column)
-        elif rule.at_keyword in self.FONT_FEATURE_VALUES_AT_KEYWORDS:
-            if context != '@font-feature-values':
-                raise ParseError(
-                    rule, '{0} rule not allowed in {1}'.format(
-                        rule.at_keyword, context))
-            declarations, body_errors = self.parse_declaration_list(rule.body)
-            errors.extend(body_errors)
-            return FontFeatureRule(
-                rule.at_keyword, declarations, rule.line, rule.column)
-        return super(CSSFonts3Parser, self).parse_at_rule(
-            rule, previous_rules, errors, context)
+    AT_RULES = dict(
+        [(('@font-face', None), 'parse_font_face_rule'),
+         (('@font-feature-values', None),
+          'parse_font_feature_values_rule')] +
+        [((at_keyword, '@font-feature-values'), 'parse_font_feature_rule')
+         for at_keyword in FONT_FEATURE_VALUES_AT_KEYWORDS])
+
+    def parse_font_face_rule(self, rule, previous_rules, errors, context):
+        """Parse an @font-face rule.
+        See :meth:`~.css21.CSS21Parser.parse_at_rule`.
+
+        """
+        if rule.head:
+            raise ParseError(
+                rule.head[0], 'unexpected {0} token in {1} rule header',
+                rule.head[0].type, rule.at_keyword)
+        declarations, body_errors = self.parse_declaration_list(rule.body)
+        errors.extend(body_errors)
+        return FontFaceRule(
+            rule.at_keyword, declarations, rule.line, rule.column)
+
+    def parse_font_feature_values_rule(self, rule, previous_rules, errors,
+                                       context):
+        """Parse an @font-feature-values rule.
+        See :meth:`~.css21.CSS21Parser.parse_at_rule`.
+
+        """
+        family_names = tuple(
+            self.parse_font_feature_values_family_names(rule.head))
+        at_rules, body_errors = (
+            self.parse_rules(rule.body or [], '@font-feature-values'))
+        errors.extend(body_errors)
+        return FontFeatureValuesRule(
+            rule.at_keyword, at_rules, family_names, rule.line, rule.column)
+
+    def parse_font_feature_rule(self, rule, previous_rules, errors,
+                                context):
+        """Parse a rule such as @swash in an @font-feature-values rule.
+        See :meth:`~.css21.CSS21Parser.parse_at_rule`.
+
+        """
+        declarations, body_errors = self.parse_declaration_list(rule.body)
+        errors.extend(body_errors)
+        return FontFeatureRule(
+            rule.at_keyword, declarations, rule.line, rule.column)
 
     def parse_font_feature_values_family_names(self, tokens):
         """Parse an @font-feature-values selector.
@@ -0,0 +1,235 @@
+# coding: utf-8
+"""
+    tinycss.frozen
+    --------------
+
+    Immutable snapshots of parsed stylesheets, keeping the CSS text of
+    selectors and values instead of their tokens.
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import sys
+
+from .css21 import Stylesheet, _attributes
+from .parsing import (
+    _error_fields, _error_list_fields, _make_error, _make_error_list)
+from .token_data import TokenList
+from .tokenizer import tokenize_grouped
+
+# How attributes are kept in frozen rules
+VALUE, TOKENS, LIST = range(3)
+
+if sys.version_info[0] >= 3:
+    _string_types = str
+    _number_types = (int, float)
+else:
+    _string_types = basestring  # noqa
+    _number_types = (int, long, float)  # noqa
+
+# Layouts of frozen rules, shared by all snapshots
+_LAYOUTS = {}
+
+_MISSING = object()
+
+
+def freeze(stylesheet):
+    """Make an immutable snapshot of a stylesheet.
+
+    Rules and declarations become :class:`FrozenRule` objects, and lists
+    become tuples. Token lists, such as selectors and declaration values,
+    are kept as their CSS text and position, and are tokenized again when
+    read. Equal strings and integers are only kept once in a snapshot.
+
+    The snapshot is hashable, and can be shared by threads. As tokens are
+    made again from their CSS text, comments between tokens are lost and
+    may change the tokens and their positions, eg. ``a/**/b`` gives a single
+    ``ab`` identifier.
+
+    :param stylesheet:
+        A :class:`~.css21.Stylesheet`.
+    :raises:
+        :exc:`TypeError` for values that can not be frozen, such as
+        tokens outside of token lists.
+    :return:
+        A :class:`FrozenStylesheet`.
+
+    """
+    freezer = _Freezer()
+    string = freezer.string
+    errors = []
+    for error in stylesheet.errors:
+        line, column, reason, reason_format, limit = _error_fields(error)
+        errors.append((line, column, string(reason), string(reason_format),
+                       limit))
+    return FrozenStylesheet((
+        tuple(map(freezer.value, stylesheet.rules)), tuple(errors),
+        stylesheet.encoding, _error_list_fields(stylesheet.errors)))
+
+
+class FrozenStylesheet(tuple):
+    """An immutable snapshot of a :class:`~.css21.Stylesheet`, returned by
+    :meth:`~.css21.Stylesheet.freeze`.
+
+    It has the same attributes as :class:`~.css21.Stylesheet`, but
+    :attr:`rules` is a tuple of :class:`FrozenRule` objects and
+    :attr:`errors` is a tuple: the counts of an :class:`~.parsing.ErrorList`
+    are kept, but only given back by :meth:`thaw`.
+
+    """
+    __slots__ = ()
+
+    @property
+    def rules(self):
+        return self[0]
+
+    @property
+    def errors(self):
+        return tuple(_make_error(*error) for error in self[1])
+
+    @property
+    def encoding(self):
+        return self[2]
+
+    def thaw(self):
+        """Return a new, mutable :class:`~.css21.Stylesheet`."""
+        return Stylesheet(
+            [rule.thaw() for rule in self.rules],
+            _make_error_list(self[3], self.errors), self.encoding)
+
+    def __repr__(self):
+        return '<{0.__class__.__name__} {1} rules {2} errors>'.format(
+            self, len(self[0]), len(self[1]))
+
+
+class FrozenRule(tuple):
+    """An immutable snapshot of a rule or a declaration.
+
+    It has the same attributes as the original object, but lists are tuples,
+    rules and declarations in these tuples are :class:`FrozenRule` objects,
+    and a new :class:`~.token_data.TokenList` is made from the CSS text each
+    time a token list is read. It does not have the methods of the original
+    object: use :meth:`thaw` to get them.
+
+    """
+    __slots__ = ()
+
+    @property
+    def rule_class(self):
+        """The class of the original object, eg. :class:`~.css21.RuleSet`."""
+        return self[0].rule_class
+
+    def thaw(self):
+        """Return a new, mutable rule or declaration."""
+        layout = self[0]
+        rule = layout.rule_class.__new__(layout.rule_class)
+        for name in layout.names:
+            value = getattr(self, name)
+            if isinstance(value, tuple) and layout.indexes[name][1] == LIST:
+                value = [item.thaw() if isinstance(item, FrozenRule) else item
+                         for item in value]
+            setattr(rule, name, value)
+        return rule
+
+    def __getattr__(self, name):
+        try:
+            index, kind = self[0].indexes[name]
+        except KeyError:
+            # Class attributes, eg. at_keyword for RuleSet, but not methods
+            # or descriptors such as slots.
+            value = getattr(self[0].rule_class, name, _MISSING)
+            if (name.startswith('_') or value is _MISSING or callable(value)
+                    or hasattr(value, '__get__')):
+                raise AttributeError(name)
+            return value
+        if kind == TOKENS:
+            css, line, column = self[index:index + 3]
+            return TokenList(
+                tokenize_grouped(css, line=line, column=column) if css
+                else ())
+        return self[index]
+
+    def __repr__(self):
+        return '<Frozen {0} {1}:{2}>'.format(
+            self.rule_class.__name__, getattr(self, 'line', None),
+            getattr(self, 'column', None))
+
+
+class _Layout(object):
+    """The class and attributes of frozen rules, and where attributes are
+    kept in the tuples.
+
+    """
+    __slots__ = 'rule_class', 'names', 'kinds', 'indexes'
+
+    def __init__(self, rule_class, names, kinds):
+        self.rule_class = rule_class
+        self.names = names
+        self.kinds = kinds
+        self.indexes = {}
+        index = 1
+        for name, kind in zip(names, kinds):
+            self.indexes[name] = index, kind
+            index += 3 if kind == TOKENS else 1
+
+    def __reduce__(self):
+        return _layout, (self.rule_class, self.names, self.kinds)
+
+
+def _layout(rule_class, names, kinds):
+    """Return the shared layout for these attributes."""
+    key = rule_class, names, kinds
+    layout = _LAYOUTS.get(key)
+    if layout is None:
+        layout = _LAYOUTS.setdefault(key, _Layout(rule_class, names, kinds))
+    return layout
+
+
+class _Freezer(object):
+    """Freeze values, keeping equal strings and integers once."""
+    def __init__(self):
+        self.strings = {}
+        self.integers = {}
+
+    def string(self, string):
+        return self.strings.setdefault(string, string)
+
+    def value(self, value):
+        if type(value) is int:  # Mostly lines and columns
+            return self.integers.setdefault(value, value)
+        elif value is None or isinstance(value, (bool,) + _number_types):
+            return value
+        elif isinstance(value, _string_types):
+            return self.string(value)
+        elif isinstance(value, tuple):
+            return tuple(map(self.value, value))
+        elif isinstance(value, list) or hasattr(value, 'is_container'):
+            raise TypeError('Can not freeze {0!r}'.format(value))
+        try:
+            attributes = _attributes(value)
+        except AttributeError:  # No __dict__
+            raise TypeError('Can not freeze {0!r}'.format(value))
+        names = []
+        kinds = []
+        items = []
+        for name, item in sorted(attributes.items()):
+            names.append(name)
+            if isinstance(item, TokenList):
+                kinds.append(TOKENS)
+                if item:
+                    items.extend((
+                        self.string(item.as_css()), self.value(item.line),
+                        self.value(item.column)))
+                else:
+                    items.extend(('', None, None))
+            elif isinstance(item, list):
+                kinds.append(LIST)
+                items.append(tuple(map(self.value, item)))
+            else:
+                kinds.append(VALUE)
+                items.append(self.value(item))
+        items.insert(0, _layout(type(value), tuple(names), tuple(kinds)))
+        return FrozenRule(items)
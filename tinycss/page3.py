@@ -14,7 +14,7 @@
 
 from __future__ import division, unicode_literals
 
-from .css21 import CSS21Parser, ParseError
+from .css21 import CSS21Parser, ParseError, _reduce
 
 
 class MarginRule(object):
@@ -55,12 +55,18 @@ class MarginRule(object):
 
     """
 
+    __slots__ = 'at_keyword', 'declarations', 'line', 'column', '__dict__'
+
     def __init__(self, at_keyword, declarations, line, column):
         self.at_keyword = at_keyword
         self.declarations = declarations
         self.line = line
         self.column = column
 
+    def __reduce__(self):
+        return _reduce(self, (
+            self.at_keyword, self.declarations, self.line, self.column))
+
 
 class CSSPage3Parser(CSS21Parser):
     """Extend :class:`~.css21.CSS21Parser` for `CSS 3 Paged Media`_ syntax.
@@ -108,23 +114,23 @@ class CSSPage3Parser(CSS21Parser):
         '@right-bottom',
     ]
 
-    def parse_at_rule(self, rule, previous_rules, errors, context):
-        if rule.at_keyword in self.PAGE_MARGIN_AT_KEYWORDS:
-            if context != '@page':
-                raise ParseError(
-                    rule, '{0} rule not allowed in {1}'.format(
-                        rule.at_keyword, context))
-            if rule.head:
-                raise ParseError(
-                    rule.head[0],
-                    'unexpected {0} token in {1} rule header'.format(
-                        rule.head[0].type, rule.at_keyword))
-            declarations, body_errors = self.parse_declaration_list(rule.body)
-            errors.extend(body_errors)
-            return MarginRule(
-                rule.at_keyword, declarations, rule.line, rule.column)
-        return super(CSSPage3Parser, self).parse_at_rule(
-            rule, previous_rules, errors, context)
+    AT_RULES = dict(
+        ((at_keyword, '@page'), 'parse_margin_rule')
+        for at_keyword in PAGE_MARGIN_AT_KEYWORDS)
+
+    def parse_margin_rule(self, rule, previous_rules, errors, context):
+        """Parse a margin rule such as @top-left in an @page rule.
+        See :meth:`~.css21.CSS21Parser.parse_at_rule`.
+
+        """
+        if rule.head:
+            raise ParseError(
+                rule.head[0], 'unexpected {0} token in {1} rule header',
+                rule.head[0].type, rule.at_keyword)
+        declarations, body_errors = self.parse_declaration_list(rule.body)
+        errors.extend(body_errors)
+        return MarginRule(
+            rule.at_keyword, declarations, rule.line, rule.column)
 
     def parse_page_selector(self, head):
         """Parse an @page selector.
@@ -0,0 +1,351 @@
+# coding: utf-8
+"""
+    tinycss.parallel
+    ----------------
+
+    Parse stylesheets in multiple processes.
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import threading
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
+from timeit import default_timer
+
+from . import make_parser
+from .css21 import (
+    CSS21Parser, Stylesheet, _remove_at_charset, _SharedValues)
+from .decoding import _read, decode
+from .tokenizer import advance_position, split_statements, tokenize_grouped
+
+try:
+    from queue import Full, Queue
+except ImportError:  # Python 2
+    from Queue import Full, Queue
+
+
+def split_chunks(css_unicode, chunk_size):
+    """Cut a stylesheet into chunks of whole top-level statements.
+
+    Statements up to the last top-level ``@import`` rule are kept in the first
+    chunk, as whether an ``@import`` rule is valid depends on all previous
+    rules.
+
+    :param css_unicode:
+        A CSS stylesheet as an unicode string.
+    :param chunk_size:
+        The approximate length of each chunk, in characters.
+    :return:
+        A list of ``(start, end, line, column)`` tuples: the limits of each
+        chunk in ``css_unicode`` and the position of ``start``.
+
+    """
+    statements = list(split_statements(css_unicode))
+    first_cut = 0
+    for index, (_, _, at_keyword, _, _) in enumerate(statements):
+        if at_keyword == '@import':
+            first_cut = index
+    chunks = []
+    start, line, column = 0, 1, 1
+    for _, end, _, _, _ in statements[first_cut:]:
+        if end - start >= chunk_size:
+            chunks.append((start, end, line, column))
+            line, column = advance_position(
+                css_unicode, start, end, line, column)
+            start = end
+    if not chunks:
+        chunks.append((start, len(css_unicode), line, column))
+    elif start < len(css_unicode):
+        # Make the last chunk longer rather than adding a small one.
+        start, _, line, column = chunks.pop()
+        chunks.append((start, len(css_unicode), line, column))
+    return chunks
+
+
+def parse_stylesheet(parser, css_unicode, encoding=None, workers=None,
+                     chunk_size=1 << 20):
+    """Parse a stylesheet from an Unicode string, in multiple processes.
+
+    The stylesheet is cut into chunks with :func:`split_chunks`, chunks are
+    parsed in parallel with :meth:`~.css21.CSS21Parser.parse_rules` and the
+    results are put back together. The result is the same as
+    ``parser.parse_stylesheet(css_unicode, encoding)``, but stylesheets
+    smaller than two chunks are not worth the overhead and are parsed
+    in the current process. So are stylesheets parsed by a parser with
+    ``limits``, as the limits apply to the whole stylesheet.
+
+    :param parser:
+        A :class:`~.css21.CSS21Parser` or a parser returned by
+        :func:`~tinycss.make_parser`. It is pickled and sent to
+        the worker processes.
+    :param css_unicode:
+        A CSS stylesheet as an unicode string.
+    :param encoding:
+        The character encoding used to decode the stylesheet from bytes,
+        if any.
+    :param workers:
+        The maximum number of worker processes. Defaults to the number
+        of processors.
+    :param chunk_size:
+        The approximate length of each chunk, in characters.
+    :return:
+        A :class:`~.css21.Stylesheet`.
+
+    """
+    if len(css_unicode) < 2 * chunk_size or parser.limits is not None:
+        return parser.parse_stylesheet(css_unicode, encoding)
+    chunks = split_chunks(css_unicode, chunk_size)
+    if len(chunks) < 2:
+        return parser.parse_stylesheet(css_unicode, encoding)
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(
+            _parse_chunk,
+            [(parser, css_unicode[start:end], line, column,
+              encoding if index == 0 else None)
+             for index, (start, end, line, column) in enumerate(chunks)])
+        rules = []
+        errors = parser.new_error_list()
+        for chunk_rules, chunk_errors in results:
+            rules.extend(chunk_rules)
+            errors.extend(chunk_errors)
+    if parser.share_values:
+        _SharedValues().share_rules(rules)
+    return Stylesheet(rules, errors, encoding)
+
+
+def _parse_chunk(args):
+    """Parse a chunk in a worker process."""
+    parser, css_unicode, line, column, encoding = args
+    statements = parser._parse_statement(
+        css_unicode, 0, len(css_unicode), line, column, encoding)
+    return statements.rules, statements.errors
+
+
+def parse_stylesheet_files(paths, workers=None, parser_features=(),
+                           parser_kwargs=None, ordered=True, batch_size=16):
+    """Parse many stylesheet files in multiple processes.
+
+    Each worker process makes its parser once with
+    :func:`~tinycss.make_parser` and reuses it for all its files. Files are
+    sent to workers in batches, to reduce the overhead of communication
+    between processes.
+
+    :param paths:
+        An iterable of filenames.
+    :param workers:
+        The maximum number of worker processes. Defaults to the number
+        of processors.
+    :param parser_features:
+        A sequence of features for :func:`~tinycss.make_parser`,
+        eg. ``['page3']``. Classes must be importable by the workers.
+    :param parser_kwargs:
+        A dict of keyword arguments for :func:`~tinycss.make_parser`.
+    :param ordered:
+        If true (the default), results are in the same order as ``paths``.
+        Otherwise, batches of results are yielded as soon as they are parsed.
+    :param batch_size:
+        The number of files in each batch.
+    :return:
+        An iterator of ``(path, stylesheet)`` tuples, where ``stylesheet``
+        is the :class:`~.css21.Stylesheet` returned by
+        :meth:`~.css21.CSS21Parser.parse_stylesheet_file`.
+
+    """
+    paths = list(paths)
+    parser_features = tuple(parser_features)
+    parser_kwargs = tuple(sorted((parser_kwargs or {}).items()))
+    batches = [
+        (parser_features, parser_kwargs, paths[start:start + batch_size])
+        for start in range(0, len(paths), batch_size)]
+    with ProcessPoolExecutor(workers) as executor:
+        if ordered:
+            results = executor.map(_parse_files, batches)
+        else:
+            results = (future.result() for future in as_completed(
+                [executor.submit(_parse_files, batch) for batch in batches]))
+        for result in results:
+            for path_result in result:
+                yield path_result
+
+
+# The features and keyword arguments of the last parser made by the current
+# worker process, and that parser.
+_worker_parser = [None, None]
+
+
+def _parse_files(batch):
+    """Parse a batch of files in a worker process."""
+    parser_features, parser_kwargs, paths = batch
+    key = parser_features, parser_kwargs
+    if _worker_parser[0] != key:
+        _worker_parser[:] = key, make_parser(
+            *parser_features, **dict(parser_kwargs))
+    parser = _worker_parser[1]
+    return [(path, parser.parse_stylesheet_file(path)) for path in paths]
+
+
+def parse_many(paths, parser=None, threads=4, queue_size=16, timings=None):
+    """Parse many stylesheet files, overlapping I/O and parsing with threads.
+
+    Each file goes through a pipeline of stages running at the same time:
+    reading (in ``threads`` threads), decoding, tokenizing (each in its own
+    thread) and parsing (in the calling thread). Stages are connected by
+    queues of at most ``queue_size`` files.
+
+    With a parser that has ``limits``, files are decoded, tokenized and
+    parsed together by :meth:`~.css21.CSS21Parser.parse_stylesheet_bytes`
+    in the calling thread, so that the limits apply to all of it.
+
+    :param paths:
+        An iterable of filenames.
+    :param parser:
+        A :class:`~.css21.CSS21Parser` or a parser returned by
+        :func:`~tinycss.make_parser`. Defaults to a new
+        :class:`~.css21.CSS21Parser`.
+    :param threads:
+        The number of threads reading files.
+    :param queue_size:
+        The maximum number of files waiting between two stages.
+    :param timings:
+        A dict, or ``None``. The time spent in each stage, in seconds, is
+        added to its ``'read'``, ``'decode'``, ``'tokenize'`` and
+        ``'parse'`` keys. Reading time is summed over all reading threads.
+        Compare with the total time to see which stage is the bottleneck.
+    :return:
+        An iterator of ``(path, stylesheet)`` tuples, in the same order as
+        ``paths``, where ``stylesheet`` is the :class:`~.css21.Stylesheet`
+        that :meth:`~.css21.CSS21Parser.parse_stylesheet_file` would return.
+
+    """
+    if parser is None:
+        parser = CSS21Parser()
+    if timings is None:
+        timings = {}
+    for stage in ('read', 'decode', 'tokenize', 'parse'):
+        timings.setdefault(stage, 0)
+    limited = parser.limits is not None
+    stop = threading.Event()
+    decode_queue = Queue(queue_size)
+    tokenize_queue = Queue(queue_size)
+    parse_queue = Queue(queue_size)
+
+    def read(paths):
+        try:
+            with ThreadPoolExecutor(threads) as executor:
+                pending = collections.deque()
+                for path in paths:
+                    pending.append(
+                        (path, executor.submit(_timed, _read, path)))
+                    if len(pending) >= queue_size:
+                        if not _put(decode_queue, pending.popleft(), stop):
+                            return
+                while pending:
+                    if not _put(decode_queue, pending.popleft(), stop):
+                        return
+        except Exception as exc:
+            _put(decode_queue, exc, stop)
+        else:
+            _put(decode_queue, _DONE, stop)
+
+    def decode_file(future):
+        seconds, css_bytes = future.result()
+        timings['read'] += seconds
+        if limited:
+            return css_bytes
+        return decode(css_bytes)
+
+    def tokenize(decoded):
+        if limited:
+            return decoded
+        css_unicode, encoding = decoded
+        tokens = tokenize_grouped(
+            css_unicode, raw_at_keywords=parser.raw_at_keywords,
+            validate=True)
+        if encoding:
+            tokens = _remove_at_charset(tokens)
+        return list(tokens), encoding
+
+    stages = [
+        threading.Thread(target=read, args=(paths,)),
+        threading.Thread(target=_run_stage, args=(
+            decode_file, 'decode', decode_queue, tokenize_queue,
+            timings, stop)),
+        threading.Thread(target=_run_stage, args=(
+            tokenize, 'tokenize', tokenize_queue, parse_queue,
+            timings, stop)),
+    ]
+    for thread in stages:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            item = parse_queue.get()
+            if item is _DONE:
+                break
+            elif isinstance(item, BaseException):
+                raise item
+            path, value = item
+            start = default_timer()
+            if limited:
+                stylesheet = parser.parse_stylesheet_bytes(value)
+            else:
+                tokens, encoding = value
+                rules, errors = parser.parse_rules(
+                    tokens, context='stylesheet')
+                if parser.share_values:
+                    _SharedValues().share_rules(rules)
+                stylesheet = Stylesheet(rules, errors, encoding)
+            timings['parse'] += default_timer() - start
+            yield path, stylesheet
+    finally:
+        stop.set()
+
+
+# Marks the end of the items in a queue of parse_many.
+_DONE = object()
+
+
+def _run_stage(function, stage, input_queue, output_queue, timings, stop):
+    """Process items from a queue of :func:`parse_many`."""
+    while True:
+        item = input_queue.get()
+        if item is _DONE or isinstance(item, BaseException):
+            _put(output_queue, item, stop)
+            return
+        path, value = item
+        start = default_timer()
+        try:
+            value = function(value)
+        except Exception as exc:
+            _put(output_queue, exc, stop)
+            return
+        timings[stage] += default_timer() - start
+        if not _put(output_queue, (path, value), stop):
+            return
+
+
+def _put(queue, item, stop):
+    """Put an item in a queue, unless the pipeline stops.
+
+    Return whether the item was put.
+
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _timed(function, *args):
+    """Call a function, and return its duration in seconds and result."""
+    start = default_timer()
+    result = function(*args)
+    return default_timer() - start, result
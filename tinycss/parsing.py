@@ -11,6 +11,15 @@
 
 from __future__ import unicode_literals
 
+import sys
+import time
+from itertools import islice
+
+from .token_data import TokenSlice
+
+# time.clock on Python 2
+_process_time = getattr(time, 'process_time', None) or time.clock
+
 
 # TODO: unit tests
 
@@ -46,20 +55,28 @@ def strip_whitespace(tokens):
 
     :param tokens:
         A list of :class:`~.token_data.Token` or
-        :class:`~.token_data.ContainerToken`.
+        :class:`~.token_data.ContainerToken`, or a
+        :class:`~.token_data.TokenSlice` of such a list.
     :return:
         A new sub-sequence of the list.
 
     """
-    for i, token in enumerate(tokens):
-        if token.type != 'S':
-            break
-    else:
-        return []  # only whitespace
-    tokens = tokens[i:]
-    while tokens and tokens[-1].type == 'S':
-        tokens.pop()
-    return tokens
+    if type(tokens) is not TokenSlice:
+        tokens = TokenSlice(tokens)
+    start, stop = _strip_whitespace(tokens.tokens, tokens.start, tokens.stop)
+    return list(tokens.tokens[start:stop])
+
+
+def _strip_whitespace(tokens, start, stop):
+    """Return the ``start, stop`` indexes of ``tokens[start:stop]``
+    without whitespace at the beggining and end.
+
+    """
+    while start < stop and tokens[start].type == 'S':
+        start += 1
+    while stop > start and tokens[stop - 1].type == 'S':
+        stop -= 1
+    return start, stop
 
 
 def remove_whitespace(tokens):
@@ -78,6 +95,18 @@ def remove_whitespace(tokens):
     return [token for token in tokens if token.type != 'S']
 
 
+# Token types allowed by the 'any' production of the core grammar
+_ANY_TYPES = frozenset([
+    'S', 'IDENT', 'DIMENSION', 'PERCENTAGE', 'NUMBER', 'INTEGER', 'URI',
+    'DELIM', 'STRING', 'HASH', ':', 'UNICODE-RANGE'])
+_ANY_CONTAINER_TYPES = frozenset(['FUNCTION', '(', '['])
+# Token types allowed in the content of containers
+_ANY_CONTENT_TYPES = _ANY_TYPES | _ANY_CONTAINER_TYPES
+_BLOCK_CONTENT_TYPES = _ANY_CONTENT_TYPES | frozenset(['{', ';', 'ATKEYWORD'])
+# Containers not validated yet
+_UNKNOWN = object()
+
+
 def validate_value(tokens):
     """Validate a property value.
 
@@ -91,7 +120,10 @@ def validate_value(tokens):
     for token in tokens:
         type_ = token.type
         if type_ == '{':
-            validate_block(token.content, 'property value')
+            invalid = find_invalid_token(token)
+            if invalid is not None:
+                raise _invalid_token_error(
+                    invalid[0], invalid[1] or 'property value')
         else:
             validate_any(token, 'property value')
 
@@ -108,7 +140,10 @@ def validate_block(tokens, context):
     for token in tokens:
         type_ = token.type
         if type_ == '{':
-            validate_block(token.content, context)
+            invalid = find_invalid_token(token)
+            if invalid is not None:
+                raise _invalid_token_error(
+                    invalid[0], invalid[1] or context)
         elif type_ not in (';', 'ATKEYWORD'):
             validate_any(token, context)
 
@@ -123,18 +158,63 @@ def validate_any(token, context):
 
     """
     type_ = token.type
-    if type_ in ('FUNCTION', '(', '['):
-        for token in token.content:
-            validate_any(token, type_)
-    elif type_ not in ('S', 'IDENT', 'DIMENSION', 'PERCENTAGE', 'NUMBER',
-                       'INTEGER', 'URI', 'DELIM', 'STRING', 'HASH', ':',
-                       'UNICODE-RANGE'):
-        if type_ in ('}', ')', ']'):
-            adjective = 'unmatched'
-        else:
-            adjective = 'unexpected'
-        raise ParseError(
-            token, '{0} {1} token in {2}'.format(adjective, type_, context))
+    if type_ in _ANY_CONTAINER_TYPES:
+        invalid = find_invalid_token(token)
+        if invalid is not None:
+            raise _invalid_token_error(*invalid)
+    elif type_ not in _ANY_TYPES:
+        raise _invalid_token_error(token, context)
+
+
+def find_invalid_token(container):
+    """Find the first invalid token in a container token.
+
+    The result is recorded on the container, so that each container is
+    only walked once: by :func:`~.tokenizer.regroup` with
+    ``validate=True``, or by the first validation function using it.
+    The content of the container must not be changed afterwards.
+
+    :param container:
+        A :class:`~.token_data.ContainerToken`. The content of ``{``
+        containers is validated for the 'block' production, other contents
+        for the 'any' production of the core grammar.
+    :return:
+        ``None`` if the content is valid, or a ``(token, context)`` tuple
+        of the first invalid token and the type of the container it is
+        in. ``context`` is ``None`` when the token is only in ``{`` blocks:
+        the error message then uses the context of the outer block.
+
+    """
+    invalid = getattr(container, '_invalid_token', _UNKNOWN)
+    if invalid is _UNKNOWN:
+        invalid = container._invalid_token = _find_invalid_token(container)
+    return invalid
+
+
+def _find_invalid_token(container):
+    """Find the first invalid token in a container, without recording it."""
+    if container.type == '{':
+        allowed, context = _BLOCK_CONTENT_TYPES, None
+    else:
+        allowed, context = _ANY_CONTENT_TYPES, container.type
+    for token in container.content:
+        type_ = token.type
+        if type_ not in allowed:
+            return token, context
+        elif type_ == '{' or type_ in _ANY_CONTAINER_TYPES:
+            invalid = find_invalid_token(token)
+            if invalid is not None:
+                return invalid
+
+
+def _invalid_token_error(token, context):
+    type_ = token.type
+    if type_ in ('}', ')', ']'):
+        adjective = 'unmatched'
+    else:
+        adjective = 'unexpected'
+    return ParseError(
+        token, '{0} {1} token in {2}', adjective, type_, context)
 
 
 class ParseError(ValueError):
@@ -145,6 +225,10 @@ class ParseError(ValueError):
     This exception is typically logged in a list rather than being propagated
     to the user API.
 
+    The reason can be given as a format string and its arguments, as for
+    :meth:`str.format`. It is only formatted when it is read, so that errors
+    that are never read cost little.
+
     .. attribute:: line
 
         Source line where the error occured.
@@ -155,12 +239,415 @@ class ParseError(ValueError):
 
     .. attribute:: reason
 
-        What happend (a string).
+        What happend (a string). Setting it also sets :attr:`reason_format`.
+
+    .. attribute:: reason_format
+
+        The reason before formatting, eg. ``'expected ':', got {0}'``.
 
     """
-    def __init__(self, subject, reason):
+    def __init__(self, subject, reason, *reason_args):
         self.line = subject.line
         self.column = subject.column
-        self.reason = reason
-        super(ParseError, self).__init__(
-            'Parse error at {0.line}:{0.column}, {0.reason}'.format(self))
+        self.reason_format = reason
+        self._reason_args = reason_args
+        self._reason = None if reason_args else reason
+        # Do not keep the subject in args
+        super(ParseError, self).__init__()
+
+    @property
+    def reason(self):
+        if self._reason is None:
+            self._reason = self.reason_format.format(*self._reason_args)
+        return self._reason
+
+    @reason.setter
+    def reason(self, reason):
+        # As if the error was made again with this reason and no argument.
+        self.reason_format = reason
+        self._reason_args = ()
+        self._reason = reason
+
+    @property
+    def message(self):
+        """The formatted message, with the position and the reason."""
+        return 'Parse error at {0.line}:{0.column}, {0.reason}'.format(self)
+
+    @property
+    def args(self):
+        return (self.message,)
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.message)
+
+    def __reduce__(self):
+        # The subject is not kept, only its position.
+        return _unpickle_parse_error, (
+            type(self), self.line, self.column, self.reason,
+            self.reason_format)
+
+
+def _unpickle_parse_error(cls, line, column, reason, reason_format=None):
+    error = cls.__new__(cls)
+    error.line = line
+    error.column = column
+    ParseError.__init__(error, error, reason)
+    if reason_format is not None:
+        error.reason_format = reason_format
+    return error
+
+
+def _error_fields(error):
+    """Return ``(line, column, reason, reason_format, limit)`` for an
+    error, as kept by :mod:`tinycss.serialize` and :mod:`tinycss.frozen`.
+    ``limit`` is ``None`` for errors other than :class:`ParseLimitError`.
+
+    """
+    return (error.line, error.column, error.reason, error.reason_format,
+            getattr(error, 'limit', None))
+
+
+def _make_error(line, column, reason, reason_format, limit):
+    """Make an error again from :func:`_error_fields`."""
+    if limit is None:
+        return _unpickle_parse_error(
+            ParseError, line, column, reason, reason_format)
+    return _unpickle_parse_limit_error(
+        ParseLimitError, line, column, reason, limit, reason_format)
+
+
+class ErrorList(list):
+    """A list of :class:`ParseError` that only keeps some errors,
+    depending on the ``error_mode`` of a parser.
+
+    :param mode:
+        One of:
+
+        * ``'collect'``: keep all errors, as a list would.
+        * ``'count'``: keep no error, only count them in :attr:`counts`.
+        * ``'first'``: keep the first ``first_errors`` errors.
+        * ``'ignore'``: keep no error.
+    :param first_errors:
+        The number of errors kept in the ``'first'`` mode.
+    :param errors:
+        An iterable of errors to add.
+
+    A :class:`ParseLimitError` is kept in all modes.
+
+    .. attribute:: counts
+
+        In the ``'count'`` mode, a dict of the number of errors for each
+        :attr:`~ParseError.reason_format`.
+
+    .. attribute:: dropped
+
+        The number of errors that were not kept.
+
+    """
+    def __init__(self, mode='collect', first_errors=100, errors=()):
+        if mode not in ERROR_MODES:
+            raise ValueError('Unknown error mode: {0!r}'.format(mode))
+        super(ErrorList, self).__init__()
+        self.mode = mode
+        self.first_errors = first_errors
+        self.counts = {}
+        self.dropped = 0
+        self.extend(errors)
+
+    def append(self, error):
+        mode = self.mode
+        if mode == 'collect' or (
+                mode == 'first' and len(self) < self.first_errors):
+            list.append(self, error)
+        elif isinstance(error, ParseLimitError):
+            list.append(self, error)
+        else:
+            self.dropped += 1
+            if mode == 'count':
+                reason = error.reason_format
+                self.counts[reason] = self.counts.get(reason, 0) + 1
+
+    def extend(self, errors):
+        mode = self.mode
+        if mode == 'collect':
+            list.extend(self, errors)
+        elif mode == 'first':
+            iterator = iter(errors)
+            list.extend(self, islice(
+                iterator, max(0, self.first_errors - len(self))))
+            self._drop(iterator)
+        elif mode == 'count':
+            counts = self.counts
+            for error in errors:
+                if isinstance(error, ParseLimitError):
+                    list.append(self, error)
+                    continue
+                reason = error.reason_format
+                counts[reason] = counts.get(reason, 0) + 1
+                self.dropped += 1
+        else:
+            self._drop(errors)
+        if isinstance(errors, ErrorList):
+            # Include errors that the other list did not keep.
+            self.dropped += errors.dropped
+            for reason, count in errors.counts.items():
+                self.counts[reason] = self.counts.get(reason, 0) + count
+
+    def _drop(self, errors):
+        """Drop errors other than :class:`ParseLimitError`."""
+        for error in errors:
+            if isinstance(error, ParseLimitError):
+                list.append(self, error)
+            else:
+                self.dropped += 1
+
+    def __reduce__(self):
+        return _unpickle_error_list, (
+            self.mode, self.first_errors, list(self), self.counts,
+            self.dropped)
+
+
+def _unpickle_error_list(mode, first_errors, errors, counts, dropped):
+    error_list = ErrorList(mode, first_errors)
+    list.extend(error_list, errors)
+    error_list.counts = counts
+    error_list.dropped = dropped
+    return error_list
+
+
+def _error_list_fields(errors):
+    """Return ``(mode, first_errors, counts, dropped)`` for an
+    :class:`ErrorList`, with ``counts`` as sorted items, or ``None`` for
+    other lists.
+
+    """
+    if isinstance(errors, ErrorList):
+        return (errors.mode, errors.first_errors,
+                tuple(sorted(errors.counts.items())), errors.dropped)
+
+
+def _make_error_list(fields, errors):
+    """Make a list of errors again from :func:`_error_list_fields`."""
+    if fields is None:
+        return list(errors)
+    mode, first_errors, counts, dropped = fields
+    return _unpickle_error_list(
+        mode, first_errors, errors, dict(counts), dropped)
+
+
+#: The values of the ``error_mode`` parameter of parsers.
+ERROR_MODES = 'collect', 'count', 'first', 'ignore'
+
+
+class ParseLimits(object):
+    """Limits on the resources used to parse a stylesheet, for untrusted
+    input. Pass it as the ``limits`` parameter of parsers.
+
+    Each limit is ``None`` (the default) for no limit, and applies to each
+    call of a parsing method. When a limit is exceeded, parsing stops:
+    the result has the rules parsed before, and a :class:`ParseLimitError`
+    at the end of its errors.
+
+    :param max_bytes:
+        The maximum length of the source: in bytes for
+        :meth:`~.css21.CSS21Parser.parse_stylesheet_bytes`, in characters
+        for Unicode sources.
+    :param max_tokens:
+        The maximum number of tokens, not counting ignored comments.
+        The tokenizer stops there, so that hostile input can not make
+        huge token lists.
+    :param max_depth:
+        The maximum nesting depth of blocks, functions, parentheses and
+        brackets.
+    :param max_rules:
+        The maximum number of rules and at-rules, including nested and
+        invalid ones.
+    :param max_errors:
+        The maximum number of :class:`ParseError`, including the errors
+        that the ``error_mode`` of the parser does not keep.
+    :param cpu_time:
+        The maximum CPU time, in seconds. It is only checked every few
+        tokens and rules.
+
+    """
+    def __init__(self, max_bytes=None, max_tokens=None, max_depth=None,
+                 max_rules=None, max_errors=None, cpu_time=None):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
+        self.max_rules = max_rules
+        self.max_errors = max_errors
+        self.cpu_time = cpu_time
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(type(self).__name__, ' '.join(
+            '{0}={1}'.format(name, getattr(self, name))
+            for name in LIMITS if getattr(self, name) is not None))
+
+
+#: The names of the :class:`ParseLimits` limits.
+LIMITS = ('max_bytes', 'max_tokens', 'max_depth', 'max_rules',
+          'max_errors', 'cpu_time')
+
+
+class ParseLimitError(ParseError):
+    """The :class:`ParseError` for an exceeded :class:`ParseLimits` limit.
+
+    It is raised inside the parser and stops it, methods catching
+    :class:`ParseError` must let it propagate. It is kept in the errors of
+    the result whatever the ``error_mode`` of the parser.
+
+    .. attribute:: limit
+
+        The name of the limit, eg. ``'max_tokens'``.
+
+    """
+    def __init__(self, subject, limit, value):
+        super(ParseLimitError, self).__init__(
+            subject, '{0} limit exceeded ({1})', limit, value)
+        self.limit = limit
+
+    def __reduce__(self):
+        return _unpickle_parse_limit_error, (
+            type(self), self.line, self.column, self.reason, self.limit,
+            self.reason_format)
+
+
+def _unpickle_parse_limit_error(cls, line, column, reason, limit,
+                                reason_format=None):
+    error = _unpickle_parse_error(cls, line, column, reason, reason_format)
+    error.limit = limit
+    return error
+
+
+class _Position(object):
+    __slots__ = 'line', 'column'
+
+    def __init__(self, line, column):
+        self.line = line
+        self.column = column
+
+
+_START = _Position(1, 1)
+
+
+class ParseBudget(object):
+    """What is left of some :class:`ParseLimits` during a parse.
+
+    Parsers make one for each call of their parsing methods. The
+    tokenizer and the methods parsing lists of rules and declarations
+    count what they parse in it, and raise :class:`ParseLimitError` when
+    a limit is exceeded.
+
+    .. attribute:: error
+
+        ``None``, or the :class:`ParseLimitError` once a limit is
+        exceeded. Later checks raise it again.
+
+    """
+    def __init__(self, limits):
+        self.limits = limits
+        self.tokens = 0
+        self.rules = 0
+        # Errors of previous parse_rules() calls
+        self.errors = 0
+        # Error lists of the running parse_rules() calls and declaration
+        # lists, that will be added to the outermost list when complete
+        self.error_lists = []
+        self.error = None
+        # Whether an outer parse_rules() call catches limit errors
+        self.parsing_rules = False
+        cpu_time = limits.cpu_time
+        self.deadline = (
+            None if cpu_time is None else _process_time() + cpu_time)
+
+    def exceed(self, subject, limit):
+        """Raise a :class:`ParseLimitError` for ``limit`` at ``subject``,
+        or the first one raised if any.
+
+        """
+        if self.error is None:
+            self.error = ParseLimitError(
+                subject, limit, getattr(self.limits, limit))
+        raise self.error
+
+    def check_length(self, length):
+        """Check the length of a source for ``max_bytes``."""
+        max_bytes = self.limits.max_bytes
+        if max_bytes is not None and length > max_bytes:
+            self.exceed(_START, 'max_bytes')
+
+    def tokens_left(self):
+        """Return how many tokens are left until ``max_tokens``, or
+        ``None`` for no limit.
+
+        """
+        max_tokens = self.limits.max_tokens
+        if max_tokens is not None:
+            return max(0, max_tokens - self.tokens)
+
+    def time_left(self):
+        """Return how much CPU time in seconds is left until
+        ``cpu_time``, or ``None`` for no limit.
+
+        """
+        if self.deadline is not None:
+            return max(0, self.deadline - _process_time())
+
+    def count_tokens(self, tokens):
+        """Iterate over ``tokens``, counting them for ``max_tokens``
+        and checking ``cpu_time`` every 1024 tokens and at the end, as
+        the tokenizer may have stopped there.
+
+        """
+        max_tokens = self.limits.max_tokens
+        if max_tokens is None:
+            max_tokens = sys.maxsize
+        deadline = self.deadline
+        count = self.tokens
+        try:
+            for token in tokens:
+                count += 1
+                if count > max_tokens:
+                    self.exceed(token, 'max_tokens')
+                if deadline is not None and not count & 1023 and (
+                        _process_time() > deadline):
+                    self.exceed(token, 'cpu_time')
+                yield token
+            if deadline is not None and count > self.tokens and (
+                    _process_time() > deadline):
+                self.exceed(token, 'cpu_time')
+        finally:
+            self.tokens = count
+
+    def count_rule(self, subject):
+        """Count a rule starting at ``subject`` for ``max_rules``, check
+        the errors for ``max_errors`` and ``cpu_time`` every 64 rules.
+
+        """
+        if self.error is not None:
+            raise self.error
+        self.rules += 1
+        limits = self.limits
+        if limits.max_rules is not None and self.rules > limits.max_rules:
+            self.exceed(subject, 'max_rules')
+        self.check_errors(subject)
+        if self.deadline is not None and not self.rules & 63 and (
+                _process_time() > self.deadline):
+            self.exceed(subject, 'cpu_time')
+
+    def check_errors(self, subject):
+        """Check the errors counted before and the errors of the lists
+        being filled for ``max_errors``.
+
+        """
+        max_errors = self.limits.max_errors
+        if max_errors is not None:
+            count = self.errors
+            for errors in self.error_lists:
+                count += len(errors) + getattr(errors, 'dropped', 0)
+            if count > max_errors:
+                self.exceed(subject, 'max_errors')
@@ -0,0 +1,629 @@
+# coding: utf-8
+"""
+    tinycss.serialize
+    -----------------
+
+    A compact binary format for parsed stylesheets, much faster to load
+    than parsing again.
+
+    Values are stored in separate sections, so that each section can be
+    decoded at once when loading:
+
+    * the string table: each distinct string once, as UTF-8;
+    * the token table: each distinct combination of type, CSS
+      representation, value and unit once;
+    * the tokens: the index of each token in the token table, and
+      the positions of tokens;
+    * the type codes: one byte for each other value, such as a rule,
+      a list of tokens or a string;
+    * the integers: indexes in the string table, lengths of lists, and
+      integer values;
+    * the floating point values, as little-endian doubles;
+    * the positions of rules and container tokens;
+    * the index: where the data of each top-level rule is in each section.
+
+    Integers are unsigned LEB128 varints. Positions are a line and a column,
+    where lines are given as the zigzag-encoded difference with the
+    previous line so that they stay small. All tokens are made at once when
+    loading, and lists of tokens only take the next tokens. With lazy
+    loading, the data of each top-level rule is decoded when the rule is
+    read, so that data in a :class:`~mmap.mmap` or in shared memory is not
+    copied for other rules.
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import operator
+import re
+import struct
+import sys
+from itertools import chain, islice
+
+from .css21 import (
+    AtRule, Declaration, ImportRule, MediaRule, PageRule, RawAtRule, RuleSet,
+    Stylesheet)
+from .fonts3 import FontFaceRule, FontFeatureRule, FontFeatureValuesRule
+from .page3 import MarginRule
+from .parsing import (
+    _error_fields, _error_list_fields, _make_error, _make_error_list)
+from .token_data import ContainerToken, FunctionToken, Token, TokenList
+
+MAGIC = b'TCSS'
+FORMAT_VERSION = 3
+
+# Type codes
+(NONE, FALSE, TRUE, INTEGER, NEGATIVE_INTEGER, FLOAT, STRING, TUPLE, LIST,
+ TOKEN_LIST, FLAT_LIST, FLAT_TOKEN_LIST, TOKEN, CONTAINER_TOKEN,
+ FUNCTION_TOKEN) = range(15)
+
+# Rule classes, with their attributes other than line and column.
+# Add new classes at the end, to keep the codes of existing classes.
+RULE_CLASSES = (
+    (RuleSet, ('selector', 'declarations')),
+    (Declaration, ('name', 'value', 'priority')),
+    (AtRule, ('at_keyword', 'head', 'body')),
+    (RawAtRule, ('at_keyword', 'source')),
+    (PageRule, ('selector', 'specificity', 'declarations', 'at_rules')),
+    (MediaRule, ('media', 'rules')),
+    (ImportRule, ('uri', 'media')),
+    (MarginRule, ('at_keyword', 'declarations')),
+    (FontFaceRule, ('at_keyword', 'declarations')),
+    (FontFeatureValuesRule, ('at_keyword', 'at_rules', 'family_names')),
+    (FontFeatureRule, ('at_keyword', 'declarations')),
+)
+FIRST_RULE_CODE = 32
+_RULE_CODES = dict(
+    (rule_class, (FIRST_RULE_CODE + index, attributes))
+    for index, (rule_class, attributes) in enumerate(RULE_CLASSES))
+
+# Kinds of token values in the token table
+VALUE_CSS, VALUE_STRING, VALUE_INTEGER, VALUE_FLOAT, VALUE_NONE = range(5)
+
+# Split varints data, keeping multi-byte varints at odd indexes.
+_SPLIT_VARINTS = re.compile(b'([\x80-\xff]+[\x00-\x7f])').split
+
+if sys.version_info[0] >= 3:
+    from itertools import accumulate
+
+    _buffer = memoryview
+    _integer_types = int
+    _string_types = str
+    _next_method = operator.attrgetter('__next__')
+else:  # Python 2: memoryview items are byte strings
+    _buffer = bytearray
+    _integer_types = (int, long)  # noqa
+    _string_types = basestring  # noqa
+    _next_method = operator.attrgetter('next')
+
+    def accumulate(values):
+        total = 0
+        for value in values:
+            total += value
+            yield total
+
+
+def dumps(stylesheet):
+    """Serialize a stylesheet.
+
+    The data starts with the ``TCSS`` magic bytes, the version of the format
+    and the length of each section, as varints. Then come the sections: the
+    lengths of strings in characters, the strings, the token table, the
+    tokens, the positions of tokens, the type codes, the integers, the
+    floats, the positions and the index. For the stylesheet itself and for
+    each top-level rule, the index gives the length in bytes of its data in
+    each section, and the last lines of token positions and positions
+    before it.
+
+    :param stylesheet:
+        A :class:`~.css21.Stylesheet`, as returned by the parsers of tinycss.
+    :raises:
+        :exc:`TypeError` for objects that can not be serialized, such as
+        rules made by parser subclasses other than those of tinycss.
+    :return:
+        A byte string.
+
+    """
+    writer = _Writer()
+    ints = writer.ints
+    ints.append(writer.string(stylesheet.encoding))
+    error_list = _error_list_fields(stylesheet.errors)
+    if error_list is None:
+        ints.append(writer.string(None))  # Not an ErrorList
+    else:
+        mode, first_errors, counts, dropped = error_list
+        ints.extend((writer.string(mode), first_errors, dropped, len(counts)))
+        for reason_format, count in counts:
+            ints.extend((writer.string(reason_format), count))
+    ints.append(len(stylesheet.errors))
+    for error in stylesheet.errors:
+        line, column, reason, reason_format, limit = _error_fields(error)
+        ints.extend((line, column, writer.string(reason),
+                     writer.string(reason_format), writer.string(limit)))
+    ints.append(len(stylesheet.rules))
+    # Where the stylesheet and each rule start in each section, and the
+    # last line in positions and token positions before them.
+    starts = [(0, 0, 0, 0, 0, 0)]
+    lines = [(0, 0)]
+    for rule in stylesheet.rules:
+        starts.append(writer.counts())
+        lines.append(writer.lines())
+        writer.write_value(rule)
+    starts.append(writer.counts())
+
+    parts = [
+        _encode_parts(writer.tokens, starts, 0),
+        _encode_parts(writer.token_positions, starts, 1),
+        [bytes(writer.codes[start[2]:end[2]])
+         for start, end in zip(starts, starts[1:])],
+        _encode_parts(ints, starts, 3),
+        [struct.pack('<%id' % (end[4] - start[4]),
+                     *writer.floats[start[4]:end[4]])
+         for start, end in zip(starts, starts[1:])],
+        _encode_parts(writer.positions, starts, 5),
+    ]
+    index = []
+    for i, part_lines in enumerate(lines):
+        index.extend(len(section_parts[i]) for section_parts in parts)
+        index.extend(part_lines)
+    sections = [
+        _encode_varints(len(string) for string in writer.strings),
+        ''.join(writer.strings).encode('utf8', 'surrogatepass'),
+        _encode_varints(writer.token_table),
+    ]
+    sections.extend(b''.join(section_parts) for section_parts in parts)
+    sections.append(_encode_varints(index))
+    header = [FORMAT_VERSION]
+    header.extend(len(section) for section in sections)
+    return b''.join([MAGIC, _encode_varints(header)] + sections)
+
+
+def loads(data, lazy=False):
+    """Load a stylesheet serialized by :func:`dumps`.
+
+    :param data:
+        A byte string, or any object supporting the buffer protocol such
+        as a :class:`~mmap.mmap`.
+    :param lazy:
+        If true, each top-level rule is only built when first accessed,
+        and :attr:`~.css21.Stylesheet.rules` is a read-only sequence rather
+        than a list.
+    :raises:
+        :exc:`ValueError` for data in an unknown format.
+    :return:
+        A :class:`~.css21.Stylesheet`.
+
+    """
+    data = _buffer(data)
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError('Not a serialized stylesheet')
+    version, position = _read_varint(data, len(MAGIC))
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported format version: {0}'.format(version))
+    lengths = []
+    for _ in range(10):
+        length, position = _read_varint(data, position)
+        lengths.append(length)
+    sections = []
+    for length in lengths:
+        sections.append(data[position:position + length])
+        position += length
+    (lengths, strings, token_table, tokens, token_positions, codes, ints,
+     floats, positions, index) = sections
+
+    text = bytes(strings).decode('utf8', 'surrogatepass')
+    strings = [None]
+    start = 0
+    for length in _decode_varints(lengths):
+        strings.append(text[start:start + length])
+        start += length
+    token_table = _load_token_table(_decode_varints(token_table), strings)
+    index = _decode_varints(index)
+    sections = tokens, token_positions, codes, ints, floats, positions
+    if lazy:
+        # Only decode the stylesheet part, rules are decoded when read.
+        reader = _Reader(_decode_sections(
+            [section[:length] for section, length in zip(sections, index)]),
+            strings, token_table)
+    else:
+        reader = _Reader(_decode_sections(sections), strings, token_table)
+    next_int = reader.next_int
+    encoding = strings[next_int()]
+    mode = strings[next_int()]
+    error_list = None
+    if mode is not None:
+        first_errors = next_int()
+        dropped = next_int()
+        counts = [(strings[next_int()], next_int())
+                  for _ in range(next_int())]
+        error_list = mode, first_errors, counts, dropped
+    errors = []
+    for _ in range(next_int()):
+        line = next_int()
+        column = next_int()
+        errors.append(_make_error(
+            line, column, strings[next_int()], strings[next_int()],
+            strings[next_int()]))
+    errors = _make_error_list(error_list, errors)
+    count = next_int()
+    if lazy:
+        rules = _LazyRules(sections, strings, token_table, index)
+    else:
+        rules = [reader.read_value() for _ in range(count)]
+    return Stylesheet(rules, errors, encoding)
+
+
+def _encode_varints(values):
+    data = bytearray()
+    for value in values:
+        while value >= 0x80:
+            data.append((value & 0x7f) | 0x80)
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def _encode_parts(values, starts, section):
+    """Encode the values of each part separately, as given by ``starts``."""
+    return [_encode_varints(values[start[section]:end[section]])
+            for start, end in zip(starts, starts[1:])]
+
+
+def _decode_varints(data):
+    parts = _SPLIT_VARINTS(data)
+    values = list(bytearray(parts[0]))
+    for i in range(1, len(parts), 2):
+        value = 0
+        for shift, byte in enumerate(bytearray(parts[i])):
+            value |= (byte & 0x7f) << (7 * shift)
+        values.append(value)
+        values.extend(bytearray(parts[i + 1]))
+    return values
+
+
+def _decode_positions(data, line=0):
+    """Decode positions, where ``line`` is the line before the first one."""
+    positions = _decode_varints(data)
+    deltas = positions[::2]
+    if any(delta & 1 for delta in deltas):
+        deltas = [(delta >> 1) ^ -(delta & 1) for delta in deltas]
+    else:  # Only positive deltas, the usual case
+        deltas = (delta >> 1 for delta in deltas)
+    if line:
+        deltas = chain([line], deltas)
+        positions[::2] = islice(accumulate(deltas), 1, None)
+    else:
+        positions[::2] = accumulate(deltas)
+    return positions
+
+
+def _read_varint(data, position):
+    """Return a varint read at ``position`` and the position after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+
+def _decode_sections(sections, lines=(0, 0)):
+    """Decode the sections of values, given the lines before positions."""
+    tokens, token_positions, codes, ints, floats, positions = sections
+    return (
+        _decode_varints(tokens),
+        _decode_positions(token_positions, lines[0]),
+        list(bytearray(codes)),
+        _decode_varints(ints),
+        list(struct.unpack('<%id' % (len(floats) // 8), floats)),
+        _decode_positions(positions, lines[1]))
+
+
+def _load_token_table(table, strings):
+    """Return lists of types, CSS representations, values and units."""
+    types = []
+    css_values = []
+    values = []
+    units = []
+    for i in range(0, len(table), 5):
+        type_, css, unit, value_kind, value = table[i:i + 5]
+        css = strings[css]
+        types.append(strings[type_])
+        css_values.append(css)
+        units.append(strings[unit])
+        if value_kind == VALUE_CSS:
+            values.append(css)
+        elif value_kind == VALUE_STRING:
+            values.append(strings[value])
+        elif value_kind == VALUE_INTEGER:
+            values.append(int(strings[value]))
+        elif value_kind == VALUE_FLOAT:
+            values.append(float(strings[value]))
+        else:
+            values.append(None)
+    return types, css_values, values, units
+
+
+class _Writer(object):
+    """Write values to separate sections, collecting strings and tokens."""
+    def __init__(self):
+        self.codes = bytearray()
+        self.ints = []
+        self.floats = []
+        self.positions = []
+        self.strings = []
+        self.string_indexes = {}
+        self.token_table = []
+        self.token_indexes = {}
+        self.tokens = []
+        self.token_positions = []
+        # The last line in positions and token positions
+        self.last_lines = {}
+
+    def counts(self):
+        """Return the number of items in the sections used by rules."""
+        return (len(self.tokens), len(self.token_positions), len(self.codes),
+                len(self.ints), len(self.floats), len(self.positions))
+
+    def string(self, string):
+        """Return the index of a string in the table, plus one."""
+        if string is None:
+            return 0
+        index = self.string_indexes.get(string)
+        if index is None:
+            self.strings.append(string)
+            index = self.string_indexes[string] = len(self.strings)
+        return index
+
+    def lines(self):
+        """Return the last line in token positions and positions."""
+        return (self.last_lines.get(id(self.token_positions), 0),
+                self.last_lines.get(id(self.positions), 0))
+
+    def position(self, obj, positions):
+        delta = obj.line - self.last_lines.get(id(positions), 0)
+        positions.append(delta * 2 if delta >= 0 else -delta * 2 - 1)
+        positions.append(obj.column)
+        self.last_lines[id(positions)] = obj.line
+
+    def token(self, token):
+        """Write a token without nested tokens."""
+        self.position(token, self.token_positions)
+        css = token.as_css()
+        value = token.value
+        if value == css and type(value) is type(css):
+            value_kind = VALUE_CSS
+        elif value is None:
+            value_kind = VALUE_NONE
+        elif isinstance(value, _string_types):
+            value_kind = VALUE_STRING
+        elif isinstance(value, bool):
+            raise TypeError('Can not serialize {0!r}'.format(token))
+        elif isinstance(value, _integer_types):
+            value_kind = VALUE_INTEGER
+            value = '%i' % value
+        elif isinstance(value, float):
+            value_kind = VALUE_FLOAT
+            value = repr(value)
+        else:
+            raise TypeError('Can not serialize {0!r}'.format(token))
+        key = token.type, css, token.unit, value_kind, value
+        index = self.token_indexes.get(key)
+        if index is None:
+            index = self.token_indexes[key] = len(self.token_indexes)
+            self.token_table.extend((
+                self.string(token.type), self.string(css),
+                self.string(token.unit), value_kind,
+                0 if value_kind == VALUE_CSS else self.string(value)))
+        self.tokens.append(index)
+
+    def write_value(self, value):
+        codes = self.codes
+        ints = self.ints
+        if value is None:
+            codes.append(NONE)
+        elif value is False:
+            codes.append(FALSE)
+        elif value is True:
+            codes.append(TRUE)
+        elif isinstance(value, _integer_types):
+            codes.append(INTEGER if value >= 0 else NEGATIVE_INTEGER)
+            ints.append(abs(value))
+        elif isinstance(value, float):
+            codes.append(FLOAT)
+            self.floats.append(value)
+        elif isinstance(value, _string_types):
+            codes.append(STRING)
+            ints.append(self.string(value))
+        elif isinstance(value, tuple):
+            codes.append(TUPLE)
+            ints.append(len(value))
+            for item in value:
+                self.write_value(item)
+        elif isinstance(value, list):
+            is_token_list = isinstance(value, TokenList)
+            if all(getattr(item, 'is_container', None) is False
+                   for item in value):
+                # Only tokens without nested tokens: Token, or CToken from
+                # the speedups.
+                codes.append(FLAT_TOKEN_LIST if is_token_list else FLAT_LIST)
+                ints.append(len(value))
+                for token in value:
+                    self.token(token)
+            else:
+                codes.append(TOKEN_LIST if is_token_list else LIST)
+                ints.append(len(value))
+                for item in value:
+                    self.write_value(item)
+        elif getattr(value, 'is_container', None) is False:
+            codes.append(TOKEN)
+            self.token(value)
+        elif getattr(value, 'is_container', None) is True:
+            if isinstance(value, FunctionToken):
+                codes.append(FUNCTION_TOKEN)
+                ints.append(self.string(value.function_name))
+            else:
+                codes.append(CONTAINER_TOKEN)
+            self.position(value, self.positions)
+            ints.extend((
+                self.string(value.type), self.string(value._css_start),
+                self.string(value._css_end)))
+            self.write_value(value.content)
+        elif type(value) in _RULE_CODES:
+            code, attributes = _RULE_CODES[type(value)]
+            codes.append(code)
+            self.position(value, self.positions)
+            for name in attributes:
+                self.write_value(getattr(value, name))
+        else:
+            raise TypeError('Can not serialize {0!r}'.format(value))
+
+
+class _Reader(object):
+    """Read values from decoded sections, in order."""
+    def __init__(self, sections, strings, token_table):
+        tokens, token_positions, codes, ints, floats, positions = sections
+        types, css_values, values, units = token_table
+        self.tokens = iter(list(map(
+            Token, map(types.__getitem__, tokens),
+            map(css_values.__getitem__, tokens),
+            map(values.__getitem__, tokens), map(units.__getitem__, tokens),
+            token_positions[::2], token_positions[1::2])))
+        self.next_code = _next_method(iter(codes))
+        self.next_int = _next_method(iter(ints))
+        self.next_float = _next_method(iter(floats))
+        self.next_position = _next_method(iter(positions))
+        self.strings = strings
+
+    def read_value(self):
+        return self.read_code(self.next_code())
+
+    def read_code(self, code):
+        """Read a value, whose type code is already read."""
+        next_int = self.next_int
+        next_position = self.next_position
+        strings = self.strings
+        # Most common codes first
+        if code == FLAT_TOKEN_LIST:
+            return TokenList(islice(self.tokens, next_int()))
+        elif code >= FIRST_RULE_CODE:
+            rule_class, attributes = RULE_CLASSES[code - FIRST_RULE_CODE]
+            rule = rule_class.__new__(rule_class)
+            rule.line = next_position()
+            rule.column = next_position()
+            next_code = self.next_code
+            read_code = self.read_code
+            for name in attributes:
+                code = next_code()
+                if code == FLAT_TOKEN_LIST:
+                    value = TokenList(islice(self.tokens, next_int()))
+                elif code == STRING:
+                    value = strings[next_int()]
+                elif code == NONE:
+                    value = None
+                else:
+                    value = read_code(code)
+                setattr(rule, name, value)
+            return rule
+        elif code == STRING:
+            return strings[next_int()]
+        elif code == NONE:
+            return None
+        elif code == TOKEN_LIST or code == LIST:
+            read_value = self.read_value
+            values = [read_value() for _ in range(next_int())]
+            return TokenList(values) if code == TOKEN_LIST else values
+        elif code == FLAT_LIST:
+            return list(islice(self.tokens, next_int()))
+        elif code == TOKEN:
+            return next(self.tokens)
+        elif code == CONTAINER_TOKEN or code == FUNCTION_TOKEN:
+            if code == FUNCTION_TOKEN:
+                token = FunctionToken.__new__(FunctionToken)
+                token.function_name = strings[next_int()]
+            else:
+                token = ContainerToken.__new__(ContainerToken)
+            token.line = next_position()
+            token.column = next_position()
+            token.type = strings[next_int()]
+            token._css_start = strings[next_int()]
+            token._css_end = strings[next_int()]
+            token.content = self.read_value()
+            return token
+        elif code == TUPLE:
+            read_value = self.read_value
+            return tuple([read_value() for _ in range(next_int())])
+        elif code == INTEGER:
+            return next_int()
+        elif code == NEGATIVE_INTEGER:
+            return -next_int()
+        elif code == FLOAT:
+            return self.next_float()
+        elif code == FALSE:
+            return False
+        elif code == TRUE:
+            return True
+        else:
+            raise ValueError('Unknown type code: {0}'.format(code))
+
+
+class _LazyRules(object):
+    """A read-only sequence of top-level rules, built when accessed.
+
+    The data of each rule is only decoded when the rule is first accessed,
+    so the data of other rules is not copied.
+
+    """
+    def __init__(self, sections, strings, token_table, index):
+        self._sections = sections
+        self._strings = strings
+        self._token_table = token_table
+        # Start of each rule in each section, and the lines before it
+        self._starts = []
+        self._lines = []
+        starts = index[:6]
+        for i in range(8, len(index), 8):
+            self._starts.append(starts)
+            self._lines.append(index[i + 6:i + 8])
+            starts = [start + length for start, length in zip(
+                starts, index[i:i + 6])]
+        self._starts.append(starts)
+        self._rules = [None] * len(self._lines)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        rule = self._rules[index]
+        if rule is None:
+            if self._sections is None:
+                raise ValueError('The serialized data is released')
+            if index < 0:
+                index += len(self._rules)
+            sections = _decode_sections([
+                section[start:end] for section, start, end in zip(
+                    self._sections, self._starts[index],
+                    self._starts[index + 1])], self._lines[index])
+            reader = _Reader(sections, self._strings, self._token_table)
+            rule = self._rules[index] = reader.read_value()
+        return rule
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return '<{0} {1} rules>'.format(type(self).__name__, len(self))
+
+    def _release(self):
+        """Release the serialized data, so that it can be closed."""
+        for section in self._sections or ():
+            getattr(section, 'release', int)()  # No memoryview on Python 2
+        self._sections = None
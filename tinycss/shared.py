@@ -0,0 +1,106 @@
+# coding: utf-8
+"""
+    tinycss.shared
+    --------------
+
+    Share a parsed stylesheet between processes, in shared memory.
+    This module requires Python 3.8 or later.
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from multiprocessing import shared_memory
+
+from .serialize import dumps, loads
+
+
+class SharedStylesheet(object):
+    """A parsed stylesheet in a block of :mod:`multiprocessing.shared_memory`,
+    that many processes can read without parsing or unpickling it.
+
+    The stylesheet is kept in the format of :mod:`tinycss.serialize`. Each
+    process attaching to the block only builds the top-level rules it reads,
+    from the data in shared memory: the data of other rules is not copied,
+    and pages of shared memory are not written to.
+
+    Make the block with :meth:`create` in one process, then attach to it by
+    name in other processes::
+
+        shared = SharedStylesheet.create(stylesheet)
+        # In workers:
+        with SharedStylesheet(name) as shared:
+            for rule in shared.stylesheet.rules:
+                ...
+        # In the first process, when workers are done:
+        shared.close()
+        shared.unlink()
+
+    :param name:
+        The name of a block made by :meth:`create`.
+
+    .. attribute:: stylesheet
+
+        A :class:`~.css21.Stylesheet` whose :attr:`~.css21.Stylesheet.rules`
+        is a read-only sequence, as returned by
+        :func:`~tinycss.serialize.loads` with ``lazy=True``.
+
+    """
+    def __init__(self, name, _memory=None):
+        if _memory is None:
+            try:
+                # The process that made the block removes it.
+                _memory = shared_memory.SharedMemory(name, track=False)
+            except TypeError:  # Python < 3.13
+                _memory = shared_memory.SharedMemory(name)
+        self._memory = _memory
+        self.stylesheet = loads(_memory.buf, lazy=True)
+
+    @classmethod
+    def create(cls, stylesheet, name=None):
+        """Copy a stylesheet into a new shared memory block.
+
+        :param stylesheet:
+            A :class:`~.css21.Stylesheet`, as accepted by
+            :func:`~tinycss.serialize.dumps`.
+        :param name:
+            The name of the new block, or ``None`` (the default) for a
+            random name.
+        :return:
+            A new :class:`SharedStylesheet`.
+
+        """
+        data = dumps(stylesheet)
+        memory = shared_memory.SharedMemory(
+            name, create=True, size=max(len(data), 1))
+        memory.buf[:len(data)] = data
+        return cls(memory.name, memory)
+
+    @property
+    def name(self):
+        """The name of the shared memory block."""
+        return self._memory.name
+
+    def close(self):
+        """Stop using the shared memory block in this process.
+
+        Rules already read stay available, but other rules can not be read
+        anymore.
+
+        """
+        self.stylesheet.rules._release()
+        self._memory.close()
+
+    def unlink(self):
+        """Remove the shared memory block, once all processes closed it.
+
+        Call this once, in the process that made the block.
+
+        """
+        self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
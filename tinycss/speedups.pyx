@@ -1,4 +1,5 @@
 # coding: utf-8
+# cython: freethreading_compatible=True
 """
     tinycss.speedups
     ----------------
@@ -6,6 +7,12 @@
     Cython module for speeding up inner loops.
 
     Right now only :func:`tokenize_flat` has a second implementation.
+    It works in two phases: the source is first scanned without the GIL,
+    recording the kind and limits of each token in a C array. Python token
+    objects are then made from this array, with the GIL.
+
+    The module has no mutable global state, and declares that it can run
+    without the GIL on free-threaded builds of CPython.
 
     :copyright: (c) 2010 by Simon Sapin.
     :license: BSD, see LICENSE for more details.
@@ -13,13 +20,394 @@
 
 from __future__ import unicode_literals
 
+from cpython.unicode cimport PyUnicode_DATA, PyUnicode_KIND
+from libc.stdlib cimport free, realloc
+from libc.time cimport CLOCKS_PER_SEC, clock, clock_t
+
+cdef extern from "Python.h":
+    ctypedef unsigned char Py_UCS1
+    ctypedef unsigned short Py_UCS2
+
 from .token_data import (
-    COMPILED_TOKEN_REGEXPS, UNICODE_UNESCAPE, NEWLINE_UNESCAPE,
-    SIMPLE_UNESCAPE, FIND_NEWLINES, TOKEN_DISPATCH)
+    INTERNED, INTERNED_LOWER, MAX_INTEGER_LENGTH, NEWLINE_UNESCAPE,
+    SIMPLE_UNESCAPE, UNICODE_UNESCAPE, intern_lower, intern_name)
+
+
+# Token kinds found by the scanner. The scanner implements the regexps of
+# TOKENS and MACROS in token_data, in the same order: the first token that
+# matches wins, as in TOKEN_DISPATCH.
+cdef enum Kind:
+    K_S, K_URI, K_BAD_URI, K_FUNCTION, K_UNICODE_RANGE, K_IDENT,
+    K_ATKEYWORD, K_HASH, K_DIMENSION, K_PERCENTAGE, K_NUMBER, K_STRING,
+    K_BAD_STRING, K_COMMENT, K_BAD_COMMENT, K_COLON, K_SEMICOLON,
+    K_LEFT_BRACE, K_RIGHT_BRACE, K_LEFT_PAREN, K_RIGHT_PAREN,
+    K_LEFT_BRACKET, K_RIGHT_BRACKET, K_CDO, K_CDC, K_DELIM
+
+# Token types, indexed by kind.
+TYPE_NAMES = (
+    'S', 'URI', 'BAD_URI', 'FUNCTION', 'UNICODE-RANGE', 'IDENT',
+    'ATKEYWORD', 'HASH', 'DIMENSION', 'PERCENTAGE', 'NUMBER', 'STRING',
+    'BAD_STRING', 'COMMENT', 'BAD_COMMENT', ':', ';', '{', '}', '(', ')',
+    '[', ']', 'CDO', 'CDC', 'DELIM')
+
+
+cdef struct Scanned:
+    Kind kind
+    # Whether the token contains a backslash, ie. may need unescaping
+    bint has_backslash
+    Py_ssize_t start, end
+    # The numeric part of DIMENSION and the content of URI
+    Py_ssize_t group_start, group_end
+    Py_ssize_t line, column
+
+
+cdef struct Source:
+    const void *data
+    unsigned int kind
+    Py_ssize_t length
+
+
+cdef enum:
+    # Returned by peek() after the end of the source: not a codepoint.
+    EOF = 0x110000
+
+
+cdef inline Py_UCS4 peek(const Source *source, Py_ssize_t i) noexcept nogil:
+    if i >= source.length:
+        return EOF
+    if source.kind == 1:
+        return (<const Py_UCS1 *>source.data)[i]
+    elif source.kind == 2:
+        return (<const Py_UCS2 *>source.data)[i]
+    else:
+        return (<const Py_UCS4 *>source.data)[i]
+
+
+cdef inline bint is_hex(Py_UCS4 c) noexcept nogil:
+    return (c'0' <= c <= c'9') or (c'a' <= c <= c'f') or (c'A' <= c <= c'F')
+
+
+cdef inline bint is_digit(Py_UCS4 c) noexcept nogil:
+    return c'0' <= c <= c'9'
+
+
+cdef inline bint is_space(Py_UCS4 c) noexcept nogil:
+    # [ \t\r\n\f]
+    return c == c' ' or c == c'\t' or c == c'\r' or c == c'\n' or c == 12
+
+
+cdef inline bint is_newline(Py_UCS4 c) noexcept nogil:
+    return c == c'\n' or c == c'\r' or c == 12
+
+
+cdef inline bint is_letter(Py_UCS4 c) noexcept nogil:
+    return (c'a' <= c <= c'z') or (c'A' <= c <= c'Z')
+
+
+cdef Py_ssize_t scan_escape(const Source *s, Py_ssize_t i) noexcept nogil:
+    """{escape}, from a backslash at i. Return the end, or -1."""
+    cdef Py_UCS4 c = peek(s, i + 1)
+    cdef Py_ssize_t j
+    if is_hex(c):
+        # {unicode}: \\([0-9a-f]{1,6})(\r\n|[ \n\r\t\f])?
+        j = i + 1
+        while j < i + 7 and is_hex(peek(s, j)):
+            j += 1
+        if peek(s, j) == c'\r' and peek(s, j + 1) == c'\n':
+            return j + 2
+        elif is_space(peek(s, j)):
+            return j + 1
+        return j
+    elif c == EOF or is_newline(c):
+        return -1
+    return i + 2  # \\{simple_escape}
+
+
+cdef inline Py_ssize_t scan_nmstart(const Source *s,
+                                    Py_ssize_t i) noexcept nogil:
+    cdef Py_UCS4 c = peek(s, i)
+    if is_letter(c) or c == c'_' or (160 <= c < EOF):
+        return i + 1
+    elif c == c'\\':
+        return scan_escape(s, i)
+    return -1
+
+
+cdef inline Py_ssize_t scan_nmchar(const Source *s,
+                                   Py_ssize_t i) noexcept nogil:
+    cdef Py_UCS4 c = peek(s, i)
+    if (is_letter(c) or is_digit(c) or c == c'_' or c == c'-' or
+            (160 <= c < EOF)):
+        return i + 1
+    elif c == c'\\':
+        return scan_escape(s, i)
+    return -1
+
+
+cdef Py_ssize_t scan_names(const Source *s, Py_ssize_t i) noexcept nogil:
+    """{nmchar}*"""
+    cdef Py_ssize_t j
+    while True:
+        j = scan_nmchar(s, i)
+        if j < 0:
+            return i
+        i = j
+
+
+cdef Py_ssize_t scan_ident(const Source *s, Py_ssize_t i) noexcept nogil:
+    """{ident}: [-]?{nmstart}{nmchar}*. Return the end, or -1."""
+    if peek(s, i) == c'-':
+        i += 1
+    i = scan_nmstart(s, i)
+    if i < 0:
+        return -1
+    return scan_names(s, i)
+
+
+cdef Py_ssize_t scan_num(const Source *s, Py_ssize_t i) noexcept nogil:
+    """{num}: [-+]?(?:[0-9]*\.[0-9]+|[0-9]+). Return the end, or -1."""
+    cdef Py_UCS4 c = peek(s, i)
+    cdef Py_ssize_t j
+    if c == c'-' or c == c'+':
+        i += 1
+    j = i
+    while is_digit(peek(s, j)):
+        j += 1
+    if peek(s, j) == c'.' and is_digit(peek(s, j + 1)):
+        j += 2
+        while is_digit(peek(s, j)):
+            j += 1
+        return j
+    elif j > i:
+        return j
+    return -1
+
+
+cdef Py_ssize_t scan_spaces(const Source *s, Py_ssize_t i) noexcept nogil:
+    """{w}"""
+    while is_space(peek(s, i)):
+        i += 1
+    return i
+
+
+cdef Py_ssize_t scan_string(const Source *s, Py_ssize_t i,
+                            bint *closed) noexcept nogil:
+    """{string} or {badstring}, from a quote at i. Return the end."""
+    cdef Py_UCS4 quote = peek(s, i)
+    cdef Py_UCS4 c
+    cdef Py_ssize_t j
+    i += 1
+    while True:
+        c = peek(s, i)
+        if c == quote:
+            closed[0] = True
+            return i + 1
+        elif c == EOF or is_newline(c):
+            break
+        elif c == c'\\':
+            c = peek(s, i + 1)
+            if c == c'\n' or c == 12:  # \\{nl}
+                i += 2
+            elif c == c'\r':
+                i += 3 if peek(s, i + 2) == c'\n' else 2
+            else:
+                j = scan_escape(s, i)
+                if j < 0:  # Backslash at EOF
+                    break
+                i = j
+        else:
+            i += 1
+    closed[0] = False
+    if peek(s, i) == c'\\':  # \\? at the end of {badstring}
+        i += 1
+    return i
+
+
+cdef inline bint is_url_char(Py_UCS4 c) noexcept nogil:
+    """[!#$%&*-\[\]-~]|{nonascii}"""
+    return (c == c'!' or (c'#' <= c <= c'&') or (c'*' <= c <= c'[') or
+            (c']' <= c <= c'~') or (160 <= c < EOF))
+
+
+cdef inline bint is_bad_url_char(Py_UCS4 c) noexcept nogil:
+    """[!#$%&*-~]|{nonascii}"""
+    return (c == c'!' or (c'#' <= c <= c'&') or (c'*' <= c <= c'~') or
+            (160 <= c < EOF))
+
+
+cdef Kind scan_uri(const Source *s, Py_ssize_t i,
+                   Scanned *token) noexcept nogil:
+    """URI or BAD_URI, after url( at i."""
+    cdef Py_ssize_t j, start
+    cdef Py_UCS4 c
+    cdef bint closed
+    start = i = scan_spaces(s, i)
+    c = peek(s, i)
+    if c == c'"' or c == c"'":
+        j = scan_string(s, i, &closed)
+        if not closed:
+            j = -1
+    else:
+        j = i
+        while True:
+            c = peek(s, j)
+            if is_url_char(c):
+                j += 1
+            elif c == c'\\':
+                i = scan_escape(s, j)
+                if i < 0:
+                    break
+                j = i
+            else:
+                break
+    if j >= 0:
+        token.group_start = start
+        token.group_end = j
+        j = scan_spaces(s, j)
+        if peek(s, j) == c')':
+            token.end = j + 1
+            return K_URI
+    # {baduri1}: the first alternative of {baduri} always matches.
+    j = start
+    while is_bad_url_char(peek(s, j)):
+        j += 1
+    token.end = scan_spaces(s, j)
+    return K_BAD_URI
+
+
+cdef Kind scan_name_token(const Source *s, Py_ssize_t i,
+                          Scanned *token) noexcept nogil:
+    """FUNCTION or IDENT at i, or K_DELIM if neither matches."""
+    cdef Py_ssize_t j = scan_ident(s, i)
+    if j < 0:
+        return K_DELIM
+    if peek(s, j) == c'(':
+        token.end = j + 1
+        return K_FUNCTION
+    token.end = j
+    return K_IDENT
+
+
+cdef Kind scan_number_token(const Source *s, Py_ssize_t i,
+                            Scanned *token) noexcept nogil:
+    """DIMENSION, PERCENTAGE or NUMBER at i, or K_DELIM."""
+    cdef Py_ssize_t j = scan_num(s, i)
+    cdef Py_ssize_t k
+    if j < 0:
+        return K_DELIM
+    token.group_end = j
+    k = scan_ident(s, j)
+    if k >= 0:
+        token.end = k
+        return K_DIMENSION
+    elif peek(s, j) == c'%':
+        token.end = j + 1
+        return K_PERCENTAGE
+    token.end = j
+    return K_NUMBER
 
 
-COMPILED_TOKEN_INDEXES = dict(
-    (name, i) for i, (name, regexp) in enumerate(COMPILED_TOKEN_REGEXPS))
+cdef Kind scan_token(const Source *s, Py_ssize_t i,
+                     Scanned *token) noexcept nogil:
+    """Find the token at i, set its end and return its kind."""
+    cdef Py_UCS4 c = peek(s, i)
+    cdef Py_UCS4 c2
+    cdef Py_ssize_t j, last_star
+    cdef Kind kind
+    cdef bint closed
+    token.end = i + 1
+    if c == c':':
+        return K_COLON
+    elif c == c';':
+        return K_SEMICOLON
+    elif c == c'{':
+        return K_LEFT_BRACE
+    elif c == c'}':
+        return K_RIGHT_BRACE
+    elif c == c'(':
+        return K_LEFT_PAREN
+    elif c == c')':
+        return K_RIGHT_PAREN
+    elif c == c'[':
+        return K_LEFT_BRACKET
+    elif c == c']':
+        return K_RIGHT_BRACKET
+    elif is_space(c):
+        token.end = scan_spaces(s, i)
+        return K_S
+    elif c == c'u' or c == c'U':
+        c2 = peek(s, i + 1)
+        if ((c2 == c'r' or c2 == c'R') and
+                (peek(s, i + 2) == c'l' or peek(s, i + 2) == c'L') and
+                peek(s, i + 3) == c'('):
+            return scan_uri(s, i + 4, token)
+        elif c2 == c'+':
+            # u\+[0-9a-f?]{1,6}(-[0-9a-f]{1,6})?
+            j = i + 2
+            while j < i + 8 and (is_hex(peek(s, j)) or peek(s, j) == c'?'):
+                j += 1
+            if j > i + 2:
+                if peek(s, j) == c'-' and is_hex(peek(s, j + 1)):
+                    i = j + 1
+                    while i < j + 7 and is_hex(peek(s, i)):
+                        i += 1
+                    j = i
+                token.end = j
+                return K_UNICODE_RANGE
+        return scan_name_token(s, i, token)
+    elif is_letter(c) or c == c'_' or c == c'\\' or (160 <= c < EOF):
+        return scan_name_token(s, i, token)
+    elif c == c'-':
+        kind = scan_name_token(s, i, token)
+        if kind != K_DELIM:
+            return kind
+        kind = scan_number_token(s, i, token)
+        if kind != K_DELIM:
+            return kind
+        if peek(s, i + 1) == c'-' and peek(s, i + 2) == c'>':
+            token.end = i + 3
+            return K_CDC
+        token.end = i + 1
+        return K_DELIM
+    elif is_digit(c) or c == c'.' or c == c'+':
+        kind = scan_number_token(s, i, token)
+        if kind == K_DELIM:
+            token.end = i + 1
+        return kind
+    elif c == c'@':
+        j = scan_ident(s, i + 1)
+        if j >= 0:
+            token.end = j
+            return K_ATKEYWORD
+    elif c == c'#':
+        j = scan_names(s, i + 1)
+        if j > i + 1:
+            token.end = j
+            return K_HASH
+    elif c == c'"' or c == c"'":
+        token.end = scan_string(s, i, &closed)
+        return K_STRING if closed else K_BAD_STRING
+    elif c == c'/':
+        if peek(s, i + 1) == c'*':
+            # The first */ ends a COMMENT. Without one, BAD_COMMENT ends
+            # after the last * ({badcomment1}) or at EOF ({badcomment2}).
+            last_star = -1
+            j = i + 2
+            while j < s.length:
+                if peek(s, j) == c'*':
+                    if peek(s, j + 1) == c'/':
+                        token.end = j + 2
+                        return K_COMMENT
+                    last_star = j
+                j += 1
+            token.end = last_star + 1 if last_star >= 0 else s.length
+            return K_BAD_COMMENT
+    elif c == c'<':
+        if (peek(s, i + 1) == c'!' and peek(s, i + 2) == c'-' and
+                peek(s, i + 3) == c'-'):
+            token.end = i + 4
+            return K_CDO
+    return K_DELIM
 
 
 cdef class CToken:
@@ -51,114 +439,188 @@ cdef class CToken:
         return ('<Token {0.type} at {0.line}:{0.column} {0.value!r}{1}>'
                 .format(self, self.unit or ''))
 
+    def __reduce__(self):
+        return CToken, (self.type, self._as_css, self.value, self.unit,
+                        self.line, self.column)
+
+
+cdef Py_ssize_t scan(const Source *s, bint ignore_comments,
+                     Py_ssize_t line, Py_ssize_t column,
+                     Py_ssize_t stop_at, clock_t deadline,
+                     Scanned **tokens_pointer) noexcept nogil:
+    """Scan the whole source, or up to ``stop_at`` tokens if not -1,
+    or until ``deadline`` in :func:`clock` ticks if not -1, return the
+    number of tokens or -1 on memory errors.
+    ``tokens_pointer[0]`` must be freed by the caller.
+
+    """
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t n_tokens = 0
+    cdef Py_ssize_t allocated = 0
+    cdef Py_ssize_t j
+    cdef Py_UCS4 c
+    cdef Scanned token
+    cdef Scanned *tokens = NULL
+    cdef Scanned *new_tokens
+    while pos < s.length:
+        token.start = pos
+        token.line = line
+        token.column = column
+        token.kind = scan_token(s, pos, &token)
+        if token.kind == K_DIMENSION:
+            token.group_start = pos
+
+        # Count newlines and backslashes, and update the position.
+        token.has_backslash = False
+        column += token.end - pos
+        j = pos
+        while j < token.end:
+            c = peek(s, j)
+            if c == c'\\':
+                token.has_backslash = True
+            elif c == c'\n' or c == 12 or (
+                    c == c'\r' and not (j + 1 < token.end and
+                                        peek(s, j + 1) == c'\n')):
+                line += 1
+                # Add 1 to have lines start at column 1, not 0
+                column = token.end - j
+            j += 1
+        pos = token.end
+
+        # A BAD_COMMENT is a comment at EOF. Ignore it too.
+        if ignore_comments and (token.kind == K_COMMENT or
+                                token.kind == K_BAD_COMMENT):
+            continue
+        if n_tokens == allocated:
+            allocated = allocated * 2 + 64
+            new_tokens = <Scanned *>realloc(
+                tokens, allocated * sizeof(Scanned))
+            if new_tokens == NULL:
+                tokens_pointer[0] = tokens
+                return -1
+            tokens = new_tokens
+        tokens[n_tokens] = token
+        n_tokens += 1
+        if n_tokens == stop_at:
+            break
+        if deadline != -1 and not n_tokens & 1023 and clock() > deadline:
+            break
+    tokens_pointer[0] = tokens
+    return n_tokens
 
-def tokenize_flat(css_source, int ignore_comments=1):
+
+def tokenize_flat(str css_source not None, int ignore_comments=1,
+                  Py_ssize_t line=1, Py_ssize_t column=1, max_tokens=None,
+                  cpu_time=None):
     """
     :param css_source:
         CSS as an unicode string
     :param ignore_comments:
         if true (the default) comments will not be included in the
         return value
+    :param line:
+        The line number of the start of ``css_source``, when it is
+        a fragment of a larger stylesheet.
+    :param column:
+        The column number of the start of ``css_source``.
+    :param max_tokens:
+        If not ``None``, stop after ``max_tokens + 1`` tokens: when the
+        source has more than ``max_tokens`` tokens, the last token returned
+        is the first one over the limit.
+    :param cpu_time:
+        If not ``None``, stop when this CPU time in seconds is exceeded.
+        It is checked every 1024 tokens.
     :return:
         An iterator of :class:`Token`
 
     """
     # Make these local variable to avoid global lookups in the loop
-    tokens_dispatch = TOKEN_DISPATCH
-    compiled_token_indexes = COMPILED_TOKEN_INDEXES
-    compiled_tokens = COMPILED_TOKEN_REGEXPS
     unicode_unescape = UNICODE_UNESCAPE
     newline_unescape = NEWLINE_UNESCAPE
     simple_unescape = SIMPLE_UNESCAPE
-    find_newlines = FIND_NEWLINES
-
-    # Use the integer indexes instead of string markers
-    cdef Py_ssize_t BAD_COMMENT = compiled_token_indexes['BAD_COMMENT']
-    cdef Py_ssize_t BAD_STRING = compiled_token_indexes['BAD_STRING']
-    cdef Py_ssize_t PERCENTAGE = compiled_token_indexes['PERCENTAGE']
-    cdef Py_ssize_t DIMENSION = compiled_token_indexes['DIMENSION']
-    cdef Py_ssize_t ATKEYWORD = compiled_token_indexes['ATKEYWORD']
-    cdef Py_ssize_t FUNCTION = compiled_token_indexes['FUNCTION']
-    cdef Py_ssize_t COMMENT = compiled_token_indexes['COMMENT']
-    cdef Py_ssize_t NUMBER = compiled_token_indexes['NUMBER']
-    cdef Py_ssize_t STRING = compiled_token_indexes['STRING']
-    cdef Py_ssize_t IDENT = compiled_token_indexes['IDENT']
-    cdef Py_ssize_t HASH = compiled_token_indexes['HASH']
-    cdef Py_ssize_t URI = compiled_token_indexes['URI']
-    cdef Py_ssize_t DELIM = -1
+    type_names = TYPE_NAMES
+    interned = INTERNED.get
+    interned_lower = INTERNED_LOWER.get
+    max_integer_length = MAX_INTEGER_LENGTH
 
-    cdef Py_ssize_t pos = 0
-    cdef Py_ssize_t line = 1
-    cdef Py_ssize_t column = 1
-    cdef Py_ssize_t source_len = len(css_source)
-    cdef Py_ssize_t n_tokens = len(compiled_tokens)
-    cdef Py_ssize_t length, next_pos, type_
-    cdef CToken token
-
-    tokens = []
-    while pos < source_len:
-        char = css_source[pos]
-        if char in ':;{}()[]':
-            type_ = -1  # not parsed further anyway
-            type_name = char
-            css_value = char
-        else:
-            codepoint = min(ord(char), 160)
-            for type_, type_name, regexp in tokens_dispatch[codepoint]:
-                match = regexp(css_source, pos)
-                if match:
-                    # First match is the longest. See comments on TOKENS above.
-                    css_value = match.group()
-                    break
-            else:
-                # No match.
-                # "Any other character not matched by the above rules,
-                #  and neither a single nor a double quote."
-                # ... but quotes at the start of a token are always matched
-                # by STRING or BAD_STRING. So DELIM is any single character.
-                type_ = DELIM
-                type_name = 'DELIM'
-                css_value = char
-        length = len(css_value)
-        next_pos = pos + length
+    cdef Source source
+    source.data = PyUnicode_DATA(css_source)
+    source.kind = PyUnicode_KIND(css_source)
+    source.length = len(css_source)
+    cdef Scanned *scanned = NULL
+    cdef Scanned *token
+    cdef Py_ssize_t n_tokens, i
+    cdef Kind kind
+    cdef Py_ssize_t stop_at = -1 if max_tokens is None else max_tokens + 1
+    cdef clock_t deadline = -1
+    if cpu_time is not None:
+        deadline = clock() + <clock_t>(cpu_time * CLOCKS_PER_SEC)
 
-        # A BAD_COMMENT is a comment at EOF. Ignore it too.
-        if not (ignore_comments and type_ in (COMMENT, BAD_COMMENT)):
+    # The source is immutable, and kept alive by this function.
+    with nogil:
+        n_tokens = scan(&source, ignore_comments, line, column, stop_at,
+                        deadline, &scanned)
+    try:
+        if n_tokens < 0:
+            raise MemoryError()
+        tokens = []
+        for i in range(n_tokens):
+            token = &scanned[i]
+            kind = token.kind
+            type_name = type_names[kind]
+            css_value = css_source[token.start:token.end]
             # Parse numbers, extract strings and URIs, unescape
             unit = None
-            if type_ == DIMENSION:
-                value = match.group(1)
-                value = float(value) if '.' in value else int(value)
-                unit = match.group(2)
-                unit = simple_unescape(unit)
-                unit = unicode_unescape(unit)
-                unit = unit.lower()  # normalize
-            elif type_ == PERCENTAGE:
+            if kind == K_DIMENSION:
+                value = css_source[token.group_start:token.group_end]
+                if '.' in value or len(value) > max_integer_length:
+                    value = float(value)
+                else:
+                    value = int(value)
+                unit = css_source[token.group_end:token.end]
+                if token.has_backslash:
+                    unit = simple_unescape(unit)
+                    unit = unicode_unescape(unit)
+                # Normalize, and intern
+                unit = interned_lower(unit) or intern_lower(unit)
+            elif kind == K_PERCENTAGE:
                 value = css_value[:-1]
-                value = float(value) if '.' in value else int(value)
+                if '.' in value or len(value) > max_integer_length:
+                    value = float(value)
+                else:
+                    value = int(value)
                 unit = '%'
-            elif type_ == NUMBER:
+            elif kind == K_NUMBER:
                 value = css_value
-                if '.' in value:
+                if '.' in value or len(value) > max_integer_length:
                     value = float(value)
                 else:
                     value = int(value)
                     type_name = 'INTEGER'
-            elif type_ in (IDENT, ATKEYWORD, HASH, FUNCTION):
-                value = simple_unescape(css_value)
-                value = unicode_unescape(value)
-            elif type_ == URI:
-                value = match.group(1)
+            elif (kind == K_IDENT or kind == K_ATKEYWORD or
+                    kind == K_HASH or kind == K_FUNCTION):
+                value = css_value
+                if token.has_backslash:
+                    value = simple_unescape(value)
+                    value = unicode_unescape(value)
+                elif kind != K_HASH:
+                    css_value = value = (
+                        interned(value) or intern_name(value))
+            elif kind == K_URI:
+                value = css_source[token.group_start:token.group_end]
                 if value and value[0] in '"\'':
                     value = value[1:-1]  # Remove quotes
-                    value = newline_unescape(value)
-                value = simple_unescape(value)
-                value = unicode_unescape(value)
-            elif type_ == STRING:
+                    if token.has_backslash:
+                        value = newline_unescape(value)
+                if token.has_backslash:
+                    value = simple_unescape(value)
+                    value = unicode_unescape(value)
+            elif kind == K_STRING:
                 value = css_value[1:-1]  # Remove quotes
-                value = newline_unescape(value)
-                value = simple_unescape(value)
-                value = unicode_unescape(value)
+                if token.has_backslash:
+                    value = newline_unescape(value)
+                    value = simple_unescape(value)
+                    value = unicode_unescape(value)
             # BAD_STRING can only be one of:
             # * Unclosed string at the end of the stylesheet:
             #   Close the string, but this is not an error.
@@ -167,23 +629,17 @@ def tokenize_flat(css_source, int ignore_comments=1):
             #   Close the string, but this is an error.
             #   Leave it as a BAD_STRING, don’t bother parsing it.
             # See http://www.w3.org/TR/CSS21/syndata.html#parsing-errors
-            elif type_ == BAD_STRING and next_pos == source_len:
+            elif kind == K_BAD_STRING and token.end == source.length:
                 type_name = 'STRING'
                 value = css_value[1:]  # Remove quote
-                value = newline_unescape(value)
-                value = simple_unescape(value)
-                value = unicode_unescape(value)
+                if token.has_backslash:
+                    value = newline_unescape(value)
+                    value = simple_unescape(value)
+                    value = unicode_unescape(value)
             else:
                 value = css_value
-            token = CToken(type_name, css_value, value, unit, line, column)
-            tokens.append(token)
-
-        pos = next_pos
-        newlines = list(find_newlines(css_value))
-        if newlines:
-            line += len(newlines)
-            # Add 1 to have lines start at column 1, not 0
-            column = length - newlines[-1].end() + 1
-        else:
-            column += length
-    return tokens
+            tokens.append(CToken(
+                type_name, css_value, value, unit, token.line, token.column))
+        return tokens
+    finally:
+        free(scanned)
@@ -10,8 +10,12 @@
 
 from __future__ import unicode_literals
 
+import contextlib
+import random
 import sys
 
+from .. import tokenizer
+
 
 # Awful workaround to fix isort's "sys.setdefaultencoding('utf-8')".
 if sys.version_info[0] == 2:
@@ -24,3 +28,31 @@ def assert_errors(errors, expected_errors):
     assert len(errors) == len(expected_errors)
     for error, expected in zip(errors, expected_errors):
         assert expected in str(error)
+
+
+@contextlib.contextmanager
+def install_tokenizer(name):
+    """Make the parsers use ``tinycss.tokenizer.<name>`` for a while."""
+    original = tokenizer.tokenize_flat
+    try:
+        tokenizer.tokenize_flat = getattr(tokenizer, name)
+        yield
+    finally:
+        tokenizer.tokenize_flat = original
+
+
+# Pieces of CSS that delimit tokens and statements in tricky ways.
+FRAGMENTS = [
+    '{', '}', '(', ')', '[', ']', ';', '"', "'", '\\', '\\\n', '\\7b',
+    '\\}', '\\(', '\\url(', 'url(', 'URL(', 'u+', 'U+1?', '/*', '*/',
+    '<!--', '-->', '<', '>', '@', '@a', '@media', '#', '-', '--', ':', '.',
+    '.5', '1', '1e', '%', '!', '*', 'a', '\xe9', ' ', '\n', '\r', '\f']
+
+
+def random_stylesheets(count, seed=0, length=20):
+    """Generate ``count`` short stylesheets made of random fragments."""
+    generator = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(
+            generator.choice(FRAGMENTS)
+            for _ in range(generator.randint(1, length)))
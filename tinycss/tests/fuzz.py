@@ -0,0 +1,418 @@
+# coding: utf-8
+"""
+    Performance fuzzer
+    ------------------
+
+    Search for inputs that are unusually slow or memory-hungry to
+    tokenize or parse, relative to their size.
+
+    Inputs are a prefix followed by a repeated unit, so that a slow path
+    found on a few kilobytes can be checked for super-linear behaviour
+    at any size. Seeds come from the strings in the test suite, the
+    documentation stylesheet and the regression corpus. Mutated inputs
+    are measured with each target and compared with the documentation
+    stylesheet, and with the other backend. Flagged inputs are minimized
+    and saved in ``perf_corpus.json``, checked by ``test_perf_corpus``.
+
+    Note: this file is not named test_*.py as it is not part of the
+    test suite ran by pytest::
+
+        python -m tinycss.tests.fuzz [seconds] [random_seed]
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+from __future__ import division, print_function, unicode_literals
+
+import ast
+import glob
+import io
+import json
+import os.path
+import random
+import sys
+import timeit
+
+from ..css21 import CSS21Parser
+from ..tokenizer import cython_tokenize_flat, python_tokenize_flat, regroup
+from . import install_tokenizer
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), 'perf_corpus.json')
+
+#: Approximate size of the measured inputs, in characters.
+SIZE = 4096
+#: An input is flagged when its cost per character is this many times
+#: the cost of the reference stylesheet, for any target and metric.
+FLAG_RATIO = 10
+#: An input is flagged when it is this many times more costly, relative
+#: to the reference stylesheet, with a backend than with the other, and
+#: at least MIN_BACKEND_COST times the reference with the slower one.
+BACKEND_RATIO = 5
+MIN_BACKEND_COST = 2
+#: An input is flagged when it costs this many times more per character
+#: at 8 times its size (ie. when it is super-linear).
+GROWTH_RATIO = 3
+POPULATION = 32
+TIMEIT_REPEAT = 3
+
+#: Fragments inserted by mutations, most of them starting or ending
+#: tokens that may need backtracking.
+ALPHABET = [
+    '\\', '\\a', '\\aaaaaa', '\\\n', '"', "'", '(', ')', '[', ']', '{', '}',
+    'url(', 'u+', '?', '/*', '*/', '*', '/', ';', ':', '@', '#', '!', '-',
+    '--', '<!--', '-->', '1', '.5', 'e', 'f', 'px', '%', ' ', '\t', '\n',
+    '\r\n', '\f', 'a', 'é', '\x00']
+
+
+def _parse_stylesheet(tokenize_name):
+    def parse(css_source):
+        with install_tokenizer(tokenize_name):
+            return CSS21Parser().parse_stylesheet(css_source)
+    return parse
+
+
+def _identity(css_source):
+    return css_source
+
+
+def _tokenize(css_source):
+    return list(python_tokenize_flat(css_source))
+
+
+def _regroup(tokens):
+    return list(regroup(tokens))
+
+
+#: ``(name, prepare, function)`` tuples: ``prepare`` is not measured and
+#: turns the source into the argument of the measured ``function``.
+TARGETS = [
+    ('python_tokenize_flat', _identity, python_tokenize_flat),
+    ('cython_tokenize_flat', _identity, cython_tokenize_flat),
+    ('regroup', _tokenize, _regroup),
+    ('python_parse_stylesheet', _identity,
+     _parse_stylesheet('python_tokenize_flat')),
+    ('cython_parse_stylesheet', _identity,
+     _parse_stylesheet('cython_tokenize_flat')),
+]
+TARGETS = [target for target in TARGETS if target[2] is not None]
+if cython_tokenize_flat is None:
+    TARGETS = [target for target in TARGETS if 'cython' not in target[0]]
+
+
+def _base_name(name):
+    """Return the target name without its backend."""
+    if name.startswith(('python_', 'cython_')):
+        return name.split('_', 1)[1]
+    return name
+
+
+def expand(prefix, repeated, size=SIZE):
+    """Return ``prefix`` followed by ``repeated`` up to about ``size``
+    characters, with ``repeated`` at least once.
+
+    """
+    if not repeated:
+        return prefix
+    return prefix + repeated * max(1, (size - len(prefix)) // len(repeated))
+
+
+def load_corpus():
+    """Return the list of ``{target, prefix, repeated}`` dicts of the
+    regression corpus.
+
+    """
+    if not os.path.exists(CORPUS_FILE):
+        return []
+    with io.open(CORPUS_FILE, encoding='utf-8') as fd:
+        return json.load(fd)
+
+
+def save_corpus(corpus):
+    corpus = sorted(
+        corpus, key=lambda entry: (
+            entry['target'], entry['prefix'], entry['repeated']))
+    data = json.dumps(corpus, indent=2, sort_keys=True)
+    with io.open(CORPUS_FILE, 'w', encoding='utf-8') as fd:
+        fd.write(type('')(data) + '\n')
+
+
+def _strings(filename):
+    with io.open(filename, encoding='utf-8') as fd:
+        try:
+            tree = ast.parse(fd.read().encode('utf-8'), filename)
+        except SyntaxError:  # Python 3 only test modules on Python 2
+            return
+    for node in ast.walk(tree):
+        kind = type(node).__name__
+        if kind == 'Constant':
+            value = node.value
+        elif kind in ('Str', 'Bytes'):
+            value = node.s
+        else:
+            continue
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        if isinstance(value, type('')) and value.strip():
+            yield value
+
+
+def load_seeds():
+    """Return a list of ``(prefix, repeated)`` seed inputs."""
+    directory = os.path.dirname(__file__)
+    seeds = set(('', rule + '}') for rule in load_reference().split('}'))
+    for filename in glob.glob(os.path.join(directory, 'test_*.py')):
+        for string in _strings(filename):
+            seeds.add(('', string))
+    for entry in load_corpus():
+        seeds.add((entry['prefix'], entry['repeated']))
+    return sorted(seeds)
+
+
+def measure_time(prepare, function, css_source):
+    """Return the best time per character to run ``function``."""
+    argument = prepare(css_source)
+    seconds = min(timeit.repeat(
+        lambda: function(argument), number=1, repeat=TIMEIT_REPEAT))
+    return seconds / max(len(css_source), 1)
+
+
+def measure_memory(prepare, function, css_source):
+    """Return the peak memory allocated per character by ``function``."""
+    argument = prepare(css_source)
+    tracemalloc.start()
+    try:
+        function(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / max(len(css_source), 1)
+
+
+def measure(prefix, repeated, targets=TARGETS):
+    """Return a ``{(target name, metric): cost per character}`` dict,
+    or ``None`` if the input is nested too deeply to be parsed without
+    :attr:`~tinycss.parsing.ParseLimits.max_depth`.
+
+    """
+    costs = {}
+    css_source = expand(prefix, repeated)
+    large_source = expand(prefix, repeated, SIZE * 8)
+    try:
+        for name, prepare, function in targets:
+            costs[name, 'time'] = measure_time(prepare, function, css_source)
+            if repeated:
+                costs[name, 'growth'] = measure_time(
+                    prepare, function, large_source) / costs[name, 'time']
+            if tracemalloc is not None:
+                costs[name, 'memory'] = measure_memory(
+                    prepare, function, css_source)
+    except RuntimeError:  # RecursionError
+        return None
+    return costs
+
+
+def load_reference():
+    """Return the stylesheet that costs are measured against."""
+    filename = os.path.join(
+        os.path.dirname(__file__), '..', '..', 'docs', '_static',
+        'custom.css')
+    if not os.path.exists(filename):
+        return 'a { color: red; margin: 0 auto }\n'
+    with io.open(filename, encoding='utf-8') as fd:
+        return fd.read()
+
+
+def baselines():
+    """Return the cost per target and metric of the reference
+    stylesheet.
+
+    """
+    return measure('', load_reference())
+
+
+def relative(costs, baseline):
+    return dict(
+        (key, cost if key[1] == 'growth' else cost / (baseline[key] or 1e-12))
+        for key, cost in costs.items())
+
+
+def flags(relative_costs):
+    """Return a list of ``(target name, reason)`` for the costs over the
+    thresholds.
+
+    """
+    found = []
+    for (name, metric), cost in sorted(relative_costs.items()):
+        if metric == 'growth':
+            if cost >= GROWTH_RATIO:
+                found.append((name, '{0:.1f}x per character at 8x the '
+                                    'size'.format(cost)))
+        elif cost >= FLAG_RATIO:
+            found.append((name, '{0:.1f}x the reference {1}'.format(
+                cost, metric)))
+        if name.startswith('python_') and metric != 'growth':
+            other = relative_costs.get(('cython_' + name[7:], metric))
+            if other is None:
+                continue
+            # Only when the slower backend is also slower than usual:
+            # the relative speed of the backends depends on the tokens.
+            if cost >= max(other * BACKEND_RATIO, MIN_BACKEND_COST):
+                found.append((name, '{0:.1f}x slower than cython'.format(
+                    cost / other)))
+            elif other >= max(cost * BACKEND_RATIO, MIN_BACKEND_COST):
+                found.append(('cython_' + name[7:], '{0:.1f}x slower '
+                              'than python'.format(other / cost)))
+    return found
+
+
+def score(relative_costs):
+    return max(
+        cost / (GROWTH_RATIO if metric == 'growth' else FLAG_RATIO)
+        for (name, metric), cost in relative_costs.items())
+
+
+def mutate(rng, prefix, repeated, seeds):
+    """Return a random mutation of ``(prefix, repeated)``."""
+    choice = rng.randrange(6)
+    part = rng.randrange(2)
+    text = [prefix, repeated][part]
+    position = rng.randint(0, len(text))
+    if choice == 0:
+        text = text[:position] + rng.choice(ALPHABET) + text[position:]
+    elif choice == 1 and text:
+        end = rng.randint(position, min(len(text), position + 8))
+        text = text[:position] + text[end:]
+    elif choice == 2 and text:
+        end = rng.randint(position, min(len(text), position + 8))
+        text = text[:position] + rng.choice(ALPHABET) + text[end:]
+    elif choice == 3 and text:
+        end = rng.randint(position, min(len(text), position + 16))
+        text = text[:end] + text[position:end] + text[end:]
+    elif choice == 4:
+        other = rng.choice(seeds)[1]
+        start = rng.randint(0, len(other))
+        end = rng.randint(start, min(len(other), start + 64))
+        text = text[:position] + other[start:end] + text[position:]
+    else:
+        # Move the start of the repeated unit to the prefix, or back
+        cut = rng.randint(0, len(repeated))
+        if part:
+            prefix, repeated = prefix + repeated[:cut], repeated[cut:]
+        else:
+            prefix, repeated = prefix[:cut], prefix[cut:] + repeated
+        return prefix, repeated or rng.choice(ALPHABET)
+    if part:
+        repeated = text or rng.choice(ALPHABET)
+    else:
+        prefix = text
+    return prefix[:SIZE // 4], repeated[:SIZE // 4]
+
+
+def minimize(prefix, repeated, is_flagged):
+    """Remove chunks of ``prefix`` and ``repeated`` while
+    ``is_flagged(prefix, repeated)`` stays true.
+
+    """
+    for part in (1, 0):
+        chunk = max(len(prefix), len(repeated)) // 2 or 1
+        while chunk:
+            text = [prefix, repeated][part]
+            start = 0
+            while start < len(text):
+                candidate = text[:start] + text[start + chunk:]
+                if part:
+                    pair = (prefix, candidate)
+                else:
+                    pair = (candidate, repeated)
+                if (part == 0 or candidate) and is_flagged(*pair):
+                    prefix, repeated = pair
+                    text = candidate
+                else:
+                    start += chunk
+            chunk //= 2
+    return prefix, repeated
+
+
+def fuzz(seconds, random_seed=None):
+    """Search for slow inputs for ``seconds`` and save the findings in
+    the regression corpus. Return the list of new corpus entries.
+
+    """
+    rng = random.Random(random_seed)
+    seeds = load_seeds()
+    print('{0} seeds, {1} targets: {2}.'.format(
+        len(seeds), len(TARGETS), ', '.join(name for name, _, _ in TARGETS)))
+    baseline = baselines()
+    for key in sorted(baseline):
+        print('  Reference {0[1]} for {0[0]}: {1:.3g}'.format(
+            key, baseline[key]))
+    corpus = load_corpus()
+    known = set((entry['target'], entry['prefix'], entry['repeated'])
+                for entry in corpus)
+    new_entries = []
+    population = []
+    deadline = timeit.default_timer() + seconds
+    tries = too_deep = 0
+    while timeit.default_timer() < deadline:
+        tries += 1
+        population.sort(key=lambda item: -item[0])
+        del population[POPULATION:]
+        # Mutate the costliest inputs found so far, or sometimes a seed
+        if population and rng.random() < 0.75:
+            prefix, repeated = rng.choice(population)[1]
+        else:
+            prefix, repeated = rng.choice(seeds)
+        for i in range(rng.randint(1, 4)):
+            prefix, repeated = mutate(rng, prefix, repeated, seeds)
+        costs = measure(prefix, repeated)
+        if costs is None:
+            too_deep += 1
+            continue
+        relative_costs = relative(costs, baseline)
+        population.append((score(relative_costs), (prefix, repeated)))
+        found = flags(relative_costs)
+        if not found:
+            continue
+
+        for name, reason in found:
+            targets = [target for target in TARGETS
+                       if _base_name(target[0]) == _base_name(name)]
+
+            def is_flagged(prefix, repeated):
+                # Measure twice to rule out noise
+                for i in range(2):
+                    costs = measure(prefix, repeated, targets)
+                    if costs is None or name not in dict(
+                            flags(relative(costs, baseline))):
+                        return False
+                return True
+
+            if not is_flagged(prefix, repeated):
+                continue
+            small = minimize(prefix, repeated, is_flagged)
+            key = (name,) + small
+            print('{0}: {1}\n  {2!r} + {3!r} * n'.format(
+                name, reason, *small))
+            if key not in known:
+                known.add(key)
+                entry = dict(target=name, prefix=small[0], repeated=small[1])
+                corpus.append(entry)
+                new_entries.append(entry)
+                save_corpus(corpus)
+            break
+    print('{0} inputs tried, {1} too deeply nested, {2} new slow inputs.'
+          .format(tries, too_deep, len(new_entries)))
+    return new_entries
+
+
+if __name__ == '__main__':
+    # python -m tinycss.tests.fuzz [seconds] [random_seed]
+    fuzz(float(sys.argv[1]) if len(sys.argv) > 1 else 60,
+         int(sys.argv[2]) if len(sys.argv) > 2 else None)
@@ -13,17 +13,18 @@
 
 from __future__ import division, unicode_literals
 
-import contextlib
 import functools
+import multiprocessing
 import os.path
+import pickle
 import sys
+import threading
 import timeit
 
-from cssutils import parseString
-
 from .. import tokenizer
 from ..css21 import CSS21Parser
 from ..parsing import remove_whitespace
+from . import install_tokenizer
 
 CSS_REPEAT = 4
 TIMEIT_REPEAT = 3
@@ -41,16 +42,6 @@ def load_css():
 CSS = load_css()
 
 
-@contextlib.contextmanager
-def install_tokenizer(name):
-    original = tokenizer.tokenize_flat
-    try:
-        tokenizer.tokenize_flat = getattr(tokenizer, name)
-        yield
-    finally:
-        tokenizer.tokenize_flat = original
-
-
 def parse(tokenizer_name):
     with install_tokenizer(tokenizer_name):
         stylesheet = CSS21Parser().parse_stylesheet_bytes(CSS)
@@ -69,6 +60,7 @@ parse_python = functools.partial(parse, 'python_tokenize_flat')
 
 
 def parse_cssutils():
+    from cssutils import parseString
     stylesheet = parseString(CSS)
     result = []
     for rule in stylesheet.cssRules:
@@ -129,7 +121,118 @@ def run():
         print('{}  {} ms  {:.2f}x'.format(label, result, result / ref))
 
 
+def run_serialize():
+    parser = CSS21Parser()
+    stylesheet = parser.parse_stylesheet_bytes(CSS)
+    data = stylesheet.dumps()
+    print('{} bytes of CSS, {} bytes serialized.'.format(len(CSS), len(data)))
+    ref = time(functools.partial(parser.parse_stylesheet_bytes, CSS))
+    print('parse                {:4} ms'.format(ref))
+    for label, lazy in [('loads               ', False),
+                        ('loads(lazy=True)    ', True)]:
+        result = time(functools.partial(stylesheet.loads, data, lazy))
+        print('{} {:4} ms  {:.1f}x faster'.format(
+            label, result, ref / max(result, 1)))
+
+
+def run_pickle():
+    stylesheet = CSS21Parser().parse_stylesheet_bytes(CSS)
+    data = pickle.dumps(stylesheet, pickle.HIGHEST_PROTOCOL)
+    print('{} bytes of CSS, {} bytes pickled.'.format(len(CSS), len(data)))
+    dumps = time(functools.partial(
+        pickle.dumps, stylesheet, pickle.HIGHEST_PROTOCOL))
+    print('pickle.dumps  {:4} ms'.format(dumps))
+    loads = time(functools.partial(pickle.loads, data))
+    print('pickle.loads  {:4} ms'.format(loads))
+
+
+def run_memory():
+    import tracemalloc
+    from ..css21 import Declaration
+    parser = CSS21Parser()
+    css = b'\n'.join([CSS] * 10)
+    parser.parse_stylesheet('').freeze()  # Import modules first
+    tracemalloc.start()
+    stylesheet = parser.parse_stylesheet_bytes(css)
+    allocated, _ = tracemalloc.get_traced_memory()
+    frozen = stylesheet.freeze()
+    frozen_size = tracemalloc.get_traced_memory()[0] - allocated
+    assert len(frozen.rules) == len(stylesheet.rules)
+    declarations = [declaration for rule in stylesheet.rules
+                    for declaration in getattr(rule, 'declarations', [])]
+    start, _ = tracemalloc.get_traced_memory()
+    copies = [Declaration(declaration.name, declaration.value,
+                          declaration.priority, declaration.line,
+                          declaration.column)
+              for declaration in declarations]
+    copies_size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    tracemalloc.start()
+    shared = CSS21Parser(share_values=True).parse_stylesheet_bytes(css)
+    shared_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(shared.rules) == len(stylesheet.rules)
+    print('{} rules, {} declarations.'.format(
+        len(stylesheet.rules), len(declarations)))
+    print('Declaration objects  {:5.0f} bytes each'.format(
+        copies_size / len(copies)))
+    for label, size in [('Whole stylesheet   ', allocated),
+                        ('Frozen stylesheet  ', frozen_size),
+                        ('With shared values ', shared_size)]:
+        print('{}  {:5.0f} bytes per declaration'.format(
+            label, size / len(declarations)))
+
+
+def parse_in_threads(threads):
+    """Parse the CSS TIMEIT_NUMBER times in each thread, with one parser
+    per thread. Return the elapsed time in seconds.
+
+    """
+    def target():
+        parser = CSS21Parser()
+        for i in range(TIMEIT_NUMBER):
+            parser.parse_stylesheet_bytes(CSS)
+
+    threads = [threading.Thread(target=target) for i in range(threads)]
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timeit.default_timer() - start
+
+
+def run_threads(max_threads):
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('GIL {}, speedups {}available.'.format(
+        'enabled' if gil_enabled else 'disabled',
+        '' if tokenizer.cython_tokenize_flat else 'NOT '))
+    ref = None
+    for threads in range(1, max_threads + 1):
+        seconds = min(
+            parse_in_threads(threads) for i in range(TIMEIT_REPEAT))
+        throughput = threads * TIMEIT_NUMBER / seconds
+        if ref is None:
+            ref = throughput
+        print('{:2} threads  {:6.1f} stylesheets/s  {:.2f}x'.format(
+            threads, throughput, throughput / ref))
+
+
 if __name__ == '__main__':
-    check_consistency()
-    warm_up()
-    run()
+    if sys.argv[1:2] == ['memory']:
+        # python -m tinycss.tests.speed memory
+        run_memory()
+    elif sys.argv[1:2] == ['pickle']:
+        # python -m tinycss.tests.speed pickle
+        run_pickle()
+    elif sys.argv[1:2] == ['serialize']:
+        # python -m tinycss.tests.speed serialize
+        run_serialize()
+    elif sys.argv[1:2] == ['threads']:
+        # python -m tinycss.tests.speed threads [max_threads]
+        run_threads(int(sys.argv[2]) if len(sys.argv) > 2
+                    else multiprocessing.cpu_count())
+    else:
+        check_consistency()
+        warm_up()
+        run()
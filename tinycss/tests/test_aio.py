@@ -0,0 +1,149 @@
+# coding: utf-8
+"""
+    Tests for the asyncio front-end
+    -------------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+import asyncio
+import io
+
+import pytest
+from tinycss import make_parser
+from tinycss.aio import AsyncParser
+from tinycss.css21 import CSS21Parser
+from tinycss.parsing import ParseLimits
+
+from . import random_stylesheets
+from .test_css21 import dump_positions
+
+CSS_BYTES = (
+    '@charset "latin1"; @import "a";\n' +
+    ''.join('b%d { c: "é" }\n@page :first { d: e } f { g }\n' % i
+            for i in range(30))).encode('latin1')
+
+
+def assert_same_stylesheets(stylesheet, expected):
+    assert stylesheet.encoding == expected.encoding
+    assert dump_positions(stylesheet.rules) == dump_positions(expected.rules)
+    assert [str(error) for error in stylesheet.errors] == [
+        str(error) for error in expected.errors]
+
+
+def run(coroutine):
+    """Run a coroutine in a new event loop, as ``asyncio.run`` does."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_parse_stylesheet(tmpdir):
+    parser = make_parser('page3')
+    expected = parser.parse_stylesheet_bytes(CSS_BYTES)
+    path = tmpdir.join('style.css')
+    path.write_binary(CSS_BYTES)
+    async_parser = AsyncParser(parser, concurrency=2, chunk_size=100)
+
+    async def parse():
+        return await asyncio.gather(
+            async_parser.parse_stylesheet_bytes(CSS_BYTES),
+            async_parser.parse_stylesheet_file(str(path)),
+            async_parser.parse_stylesheet_file(io.BytesIO(CSS_BYTES)))
+
+    for stylesheet in run(parse()):
+        assert_same_stylesheets(stylesheet, expected)
+
+
+def test_event_loops():
+    parser = make_parser('page3')
+    expected = parser.parse_stylesheet_bytes(CSS_BYTES)
+    async_parser = AsyncParser(parser, concurrency=1, chunk_size=100)
+
+    async def parse():
+        return await asyncio.gather(*(
+            async_parser.parse_stylesheet_bytes(CSS_BYTES)
+            for _ in range(3)))
+
+    for _ in range(2):
+        for stylesheet in run(parse()):
+            assert_same_stylesheets(stylesheet, expected)
+
+
+@pytest.mark.parametrize('limits', [
+    ParseLimits(max_bytes=50), ParseLimits(max_rules=5),
+    ParseLimits(max_tokens=100)])
+def test_limits(limits):
+    parser = CSS21Parser(limits=limits)
+    expected = parser.parse_stylesheet_bytes(CSS_BYTES)
+    async_parser = AsyncParser(parser, chunk_size=100)
+
+    async def parse():
+        errors = []
+        rules = [rule async for rule in async_parser.iter_rules(
+            CSS_BYTES, errors=errors)]
+        stylesheet = await async_parser.parse_stylesheet_bytes(CSS_BYTES)
+        return type(expected)(rules, errors, expected.encoding), stylesheet
+
+    for stylesheet in run(parse()):
+        assert_same_stylesheets(stylesheet, expected)
+    assert 'limit exceeded' in str(expected.errors[-1])
+
+
+def test_iter_rules():
+    parser = make_parser('page3')
+    expected = parser.parse_stylesheet_bytes(CSS_BYTES)
+    async_parser = AsyncParser(parser, chunk_size=100)
+
+    async def parse():
+        errors = []
+        rules = [rule async for rule in async_parser.iter_rules(
+            CSS_BYTES, errors=errors)]
+        return rules, errors
+
+    rules, errors = run(parse())
+    assert_same_stylesheets(
+        type(expected)(rules, errors, expected.encoding), expected)
+
+
+def test_cancel():
+    parsed_chunks = []
+
+    class CountingParser(CSS21Parser):
+        def parse_rules(self, tokens, context):
+            parsed_chunks.append(context)
+            return super(CountingParser, self).parse_rules(tokens, context)
+
+    async_parser = AsyncParser(CountingParser(), chunk_size=100)
+
+    async def parse():
+        task = asyncio.ensure_future(
+            async_parser.parse_stylesheet_bytes(CSS_BYTES))
+        while not parsed_chunks:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run(parse())
+    assert 0 < len(parsed_chunks) < 10
+
+
+def test_split_statements():
+    parser = CSS21Parser()
+    async_parser = AsyncParser(parser, chunk_size=10)
+    css_sources = ['x{#url({)} y{color:red}' * 10, '<!--url({)} a{}' * 10] + [
+        ''.join(random_stylesheets(10, seed)) for seed in range(50)]
+
+    async def parse():
+        return await asyncio.gather(*(
+            async_parser.parse_stylesheet_bytes(css_source.encode('utf8'))
+            for css_source in css_sources))
+
+    for css_source, stylesheet in zip(css_sources, run(parse())):
+        assert_same_stylesheets(stylesheet, parser.parse_stylesheet_bytes(
+            css_source.encode('utf8')))
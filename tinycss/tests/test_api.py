@@ -10,8 +10,11 @@
 
 from __future__ import unicode_literals
 
+import pickle
+
 from pytest import raises
 from tinycss import make_parser
+from tinycss.fonts3 import CSSFonts3Parser
 from tinycss.page3 import CSSPage3Parser
 
 
@@ -43,3 +46,21 @@ def test_make_parser():
     raises(TypeError, make_parser, 'page3', some_config=4)
     raises(TypeError, make_parser, MyParser)
     raises(TypeError, make_parser, MyParser, some_config=4, other_config=7)
+
+
+def test_make_parser_classes():
+    parser = make_parser('page3', 'fonts3')
+    assert type(make_parser('page3', 'fonts3')) is type(parser)
+    assert type(make_parser('page3')) is not type(parser)
+    assert type(make_parser('fonts3', 'page3')) is not type(parser)
+    assert type(pickle.loads(pickle.dumps(parser))) is type(parser)
+
+    # At-rules of all the features, resolved once for the class
+    stylesheet = parser.parse_stylesheet(
+        '@page { @top-left {} } @font-face {} @media print {}')
+    assert stylesheet.errors == []
+    assert [rule.at_keyword for rule in stylesheet.rules] == [
+        '@page', '@font-face', '@media']
+    assert stylesheet.rules[0].at_rules[0].at_keyword == '@top-left'
+    assert '_at_rule_handlers' in type(parser).__dict__
+    assert '_at_rule_handlers' not in CSSFonts3Parser.__dict__
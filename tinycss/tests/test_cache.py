@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+    Tests for the parse cache
+    -------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+from __future__ import unicode_literals
+
+import io
+import os
+import subprocess
+import sys
+
+from tinycss import make_parser
+from tinycss.cache import CachingParser, DiskCache, ParseCache
+
+from .test_css21 import dump_positions
+
+
+def assert_same_stylesheets(stylesheet, expected):
+    assert stylesheet.encoding == expected.encoding
+    assert dump_positions(stylesheet.rules) == dump_positions(expected.rules)
+    assert [str(error) for error in stylesheet.errors] == [
+        str(error) for error in expected.errors]
+
+
+def test_caching_parser():
+    parser = make_parser('page3', raw_at_keywords=['@keyframes'])
+    caching_parser = CachingParser(parser)
+    cache = caching_parser.cache
+    css_bytes = '@page :first { a: "é" } @keyframes b {} c { d }'.encode(
+        'latin1')
+    expected = parser.parse_stylesheet_bytes(css_bytes)
+
+    for i in range(3):
+        stylesheet = caching_parser.parse_stylesheet_bytes(css_bytes)
+        assert_same_stylesheets(stylesheet, expected)
+        # Modifying results does not change the cache
+        stylesheet.rules[0].declarations.pop()
+        stylesheet.rules.pop()
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 1)
+
+    stylesheet = caching_parser.parse_stylesheet_file(io.BytesIO(css_bytes))
+    assert_same_stylesheets(stylesheet, expected)
+    assert (cache.hits, cache.misses, len(cache)) == (3, 1, 1)
+
+    # Different encoding arguments
+    stylesheet = caching_parser.parse_stylesheet_bytes(
+        css_bytes, protocol_encoding='utf8')
+    assert_same_stylesheets(stylesheet, parser.parse_stylesheet_bytes(
+        css_bytes, protocol_encoding='utf8'))
+    assert (cache.hits, cache.misses, len(cache)) == (3, 2, 2)
+
+    # Unicode sources
+    css_unicode = css_bytes.decode('latin1')
+    for i in range(2):
+        stylesheet = caching_parser.parse_stylesheet(css_unicode)
+        assert_same_stylesheets(
+            stylesheet, parser.parse_stylesheet(css_unicode))
+    assert (cache.hits, cache.misses, len(cache)) == (4, 3, 3)
+
+    # Different parsers sharing a cache
+    other_parser = CachingParser(make_parser('page3'), cache)
+    stylesheet = other_parser.parse_stylesheet_bytes(css_bytes)
+    assert len(stylesheet.errors) == 2
+    assert (cache.hits, cache.misses, len(cache)) == (4, 4, 4)
+    same_parser = CachingParser(
+        make_parser('page3', raw_at_keywords=['@keyframes']), cache)
+    stylesheet = same_parser.parse_stylesheet_bytes(css_bytes)
+    assert_same_stylesheets(stylesheet, expected)
+    assert (cache.hits, cache.misses, len(cache)) == (5, 4, 4)
+
+
+def test_eviction():
+    cache = ParseCache(max_size=100)
+    cache.put('a', b'a' * 40)
+    cache.put('b', b'b' * 40)
+    assert cache.get('a') == b'a' * 40
+    cache.put('c', b'c' * 40)  # Removes b, the least recently used
+    assert cache.get('b') is None
+    assert cache.get('c') == b'c' * 40
+    assert (len(cache), cache.size) == (2, 80)
+    cache.put('d', b'd' * 101)  # Too big
+    assert (len(cache), cache.size) == (2, 80)
+    cache.put('a', b'a' * 10)
+    assert (len(cache), cache.size) == (2, 50)
+    cache.clear()
+    assert (len(cache), cache.size) == (0, 0)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_disk_cache(tmpdir):
+    source = tmpdir.join('a.css')
+    source.write_binary('@charset "latin1"; a { b: "é" } c {'.encode('latin1'))
+    filename = str(source)
+    parser = make_parser('page3')
+    disk_cache = DiskCache(str(tmpdir.join('cache')))
+    caching_parser = CachingParser(parser, disk_cache=disk_cache)
+
+    def check(hits, misses):
+        # A new memory cache each time, as in a new process.
+        stylesheet = CachingParser(
+            make_parser('page3'), disk_cache=disk_cache
+        ).parse_stylesheet_file(filename)
+        assert_same_stylesheets(
+            stylesheet, parser.parse_stylesheet_file(filename))
+        assert (disk_cache.hits, disk_cache.misses) == (hits, misses)
+
+    check(0, 1)
+    check(1, 1)
+    # Same content, new modification time: the hash is checked.
+    os.utime(filename, (0, 0))
+    check(2, 1)
+    check(3, 1)
+    # New content
+    source.write_binary(b'd { e: f }')
+    os.utime(filename, (0, 0))
+    check(3, 2)
+    assert len(os.listdir(disk_cache.directory)) == 1
+
+    # Other features and arguments do not use the same entry
+    CachingParser(disk_cache=disk_cache).parse_stylesheet_file(filename)
+    caching_parser.parse_stylesheet_file(filename, protocol_encoding='utf8')
+    assert (disk_cache.hits, disk_cache.misses) == (3, 4)
+    assert len(os.listdir(disk_cache.directory)) == 3
+
+    # Broken entries are replaced
+    for name in os.listdir(disk_cache.directory):
+        tmpdir.join('cache', name).write_binary(b'broken')
+    check(3, 5)
+    check(4, 5)
+
+    disk_cache.clear()
+    assert os.listdir(disk_cache.directory) == []
+
+
+def test_disk_cache_eviction(tmpdir):
+    disk_cache = DiskCache(str(tmpdir.join('cache')))
+    caching_parser = CachingParser(disk_cache=disk_cache)
+    filenames = []
+    for i in range(4):
+        source = tmpdir.join('%d.css' % i)
+        source.write_binary(b'a { b: c }')
+        filenames.append(str(source))
+        caching_parser.parse_stylesheet_file(filenames[-1])
+        # Set distinct access times, as some file systems are not precise.
+        for entry, size, mtime in disk_cache._entries():
+            if mtime > 1000:
+                os.utime(entry, (i, i))
+        if i == 0:
+            disk_cache.max_size = size * 2.5
+    # Not all entries fit, the least recently used are removed.
+    assert len(list(disk_cache._entries())) == 2
+    caching_parser.cache.clear()
+    caching_parser.parse_stylesheet_file(filenames[-1])
+    caching_parser.parse_stylesheet_file(filenames[0])
+    assert (disk_cache.hits, disk_cache.misses) == (1, 5)
+    # Entries are removed down to 3/4 of max_size, the size is then counted
+    # without listing the directory.
+    assert len(list(disk_cache._entries())) == 1
+    assert disk_cache._size == size
+    caching_parser.parse_stylesheet_file(filenames[1])
+    assert disk_cache._size == 2 * size
+
+
+def test_disk_cache_hash_seeds(tmpdir):
+    # Entries are found by processes with other hash seeds.
+    source = tmpdir.join('a.css')
+    source.write_binary(b'@a {} @b {} @c {} d { e: f }')
+    script = (
+        'from tinycss import make_parser\n'
+        'from tinycss.cache import CachingParser, DiskCache\n'
+        'disk_cache = DiskCache({0!r})\n'
+        'CachingParser(make_parser("page3", raw_at_keywords=["@a", "@b",'
+        ' "@c"]), disk_cache=disk_cache).parse_stylesheet_file({1!r})\n'
+        'print(disk_cache.hits)\n'.format(
+            str(tmpdir.join('cache')), str(source)))
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    hits = []
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=root)
+        hits.append(subprocess.check_output(
+            [sys.executable, '-c', script], env=env).strip())
+    assert hits == [b'0', b'1']
@@ -12,13 +12,18 @@ from __future__ import unicode_literals
 
 import io
 import os
+import pickle
+import random
 import tempfile
 
 import pytest
-from tinycss.css21 import CSS21Parser
+from tinycss import css21, make_parser
+from tinycss.css21 import CSS21Parser, _attributes
+from tinycss.parsing import ParseLimitError, ParseLimits
+from tinycss.token_data import SKIP_IGNORABLE
 
-from . import assert_errors
-from .test_tokenizer import jsonify
+from . import assert_errors, random_stylesheets
+from .test_tokenizer import jsonify, token_statements
 
 
 def parse_bytes(css_bytes, kwargs):
@@ -351,3 +356,493 @@ def test_at_media(css_source, expected_rules, expected_errors):
         for rule in stylesheet.rules
     ]
     assert result == expected_rules
+
+
+@pytest.mark.parametrize(('css_source', 'expected_selectors',
+                          'expected_errors'), [
+    (' /* hey */\n', [], []),
+    ('a{} b c, d:not(.e) {f: g}', [
+        ('a', 1, 1), ('b c, d:not(.e)', 1, 5)], []),
+    ('<!-- a{b: url(c{)} --> @import "foo.css";\n d[e="}"] {}', [
+        ('a', 1, 6), ('d[e="}"]', 2, 2)], []),
+    ('a{} @media print {\n  b {} @media screen { c {} } d {} } e {}', [
+        ('a', 1, 1), ('b', 2, 3), ('d', 2, 31), ('e', 2, 38)], []),
+    ('@page { a {} } @font-face { b {} } c {}', [('c', 1, 36)], []),
+    ('{} a@b {} c {', [('c', 1, 11)], [
+        'empty selector', 'unexpected ATKEYWORD token in selector']),
+    ('@media {a{}} @media 4 {b{}} @media print;', [],
+        ['expected media types for @media',
+         'expected a media type, got INTEGER']),
+    ('a {} b', [('a', 1, 1)], ['no declaration block found']),
+])
+def test_parse_selectors(css_source, expected_selectors, expected_errors):
+    selectors, errors = CSS21Parser().parse_selectors(css_source)
+    assert_errors(errors, expected_errors)
+    result = [
+        (selector.as_css(), selector.line, selector.column)
+        for selector in selectors]
+    assert result == expected_selectors
+
+
+@pytest.mark.parametrize(('css_source', 'expected_rules', 'expected_errors'), [
+    ('@keyframes spin { from { a: "}" } } b {}', [
+        ('@keyframes', '@keyframes spin { from { a: "}" } }', 1, 1),
+        (None, 'b', 1, 37)], []),
+    ('a {} /**/ @Supports (a: b) { c {} }\n@font-feature-values x;', [
+        (None, 'a', 1, 1),
+        ('@supports', '@Supports (a: b) { c {} }', 1, 11),
+        ('@font-feature-values', '@font-feature-values x;', 2, 1)], []),
+    # Only top-level at-rules are raw
+    ('@media print { @keyframes a {} }', [('@media', None, 1, 1)],
+        ['unknown at-rule in @media context: @keyframes']),
+    ('@keyframes a { b {} c', [
+        ('@keyframes', '@keyframes a { b {} c', 1, 1)], []),
+    ('a {} @keyframes b {} @import "c";', [
+        (None, 'a', 1, 1), ('@keyframes', '@keyframes b {}', 1, 6)],
+        ['@import rule not allowed after a ruleset']),
+])
+def test_raw_at_rules(css_source, expected_rules, expected_errors):
+    parser = CSS21Parser(raw_at_keywords=[
+        '@keyframes', '@supports', '@font-feature-values'])
+    stylesheet = parser.parse_stylesheet(css_source)
+    assert_errors(stylesheet.errors, expected_errors)
+    result = [
+        (rule.at_keyword,
+         rule.selector.as_css() if rule.at_keyword is None else
+         rule.as_css() if hasattr(rule, 'as_css') else None,
+         rule.line, rule.column)
+        for rule in stylesheet.rules]
+    assert result == expected_rules
+
+
+class AtRulesParser(CSS21Parser):
+    AT_RULES = {
+        ('@foo', 'stylesheet'): 'parse_foo_rule',
+        ('@foo', '@media'): 'parse_foo_rule',
+        ('@media', 'stylesheet'): 'parse_foo_rule',
+        ('@bar', None): 'parse_foo_rule',
+    }
+
+    def parse_foo_rule(self, rule, previous_rules, errors, context):
+        return rule
+
+
+@pytest.mark.parametrize(('css_source', 'expected_rules', 'expected_errors'), [
+    ('@foo; @FOO {}', ['@foo', '@foo'], []),
+    ('@media print {} @bar;', ['@media', '@bar'], []),
+    ('@page { @foo; @bar; }', ['@page'], ['@foo rule not allowed in @page']),
+    ('@import "a"; @charset "utf-8"; @baz;', ['@import'], [
+        'mis-placed or malformed @charset rule',
+        'unknown at-rule in stylesheet context: @baz']),
+])
+def test_at_rules_registry(css_source, expected_rules, expected_errors):
+    stylesheet = AtRulesParser().parse_stylesheet(css_source)
+    assert_errors(stylesheet.errors, expected_errors)
+    assert [rule.at_keyword for rule in stylesheet.rules] == expected_rules
+
+
+def test_parse_media_tokens():
+    media_tokens = []
+
+    class MediaParser(CSS21Parser):
+        def parse_media(self, tokens):
+            # Overrides get a list, as strip_whitespace returns lists
+            media_tokens.append(list(tokens))
+            tokens.append(tokens[-1])
+            return super(MediaParser, self).parse_media(tokens[:-1])
+
+    stylesheet = MediaParser().parse_stylesheet('@import "a" print, tv ;')
+    assert stylesheet.rules[0].media == ['print', 'tv']
+    assert [token.as_css() for token in media_tokens[0]] == [
+        'print', ',', ' ', 'tv']
+
+
+def dump_positions(obj):
+    """Everything in parsed objects, with the position of rules and tokens."""
+    if isinstance(obj, list):
+        return [dump_positions(item) for item in obj]
+    result = [type(obj).__name__, getattr(obj, 'line', None),
+              getattr(obj, 'column', None)]
+    if hasattr(obj, 'content'):
+        result.append(dump_positions(obj.content))
+    elif hasattr(obj, 'as_css'):
+        result.append(obj.as_css())
+    elif hasattr(obj, '__dict__'):
+        result.append(sorted(
+            (name, dump_positions(value))
+            for name, value in _attributes(obj).items()
+            if name != '_statements'))
+    else:
+        result.append(obj)
+    return result
+
+
+@pytest.mark.parametrize(('css_source', 'edits'), [
+    ('@import "a";\na { b: c }\n\nd, e {\n f: g; h: i\n}\n'
+     '@media print { j { k: l } }\n @page :first { m: n }  \n', [
+         ('b: c', 'b: cc; o: p'),
+         ('d, e', 'd'),
+         ('\n f', '\n\n\n f'),
+         ('j { k', 'q {} j {\n k'),
+         ('}\n@media', '@media'),
+         ('@page', '@media'),
+         ('h: i\n', 'h: i }'),
+         ('n }  \n', 'n } r { s: t }'),
+         ('@import "a";\n', ''),
+         ('a {', 'a { u: v } @import "w"; a {'),
+         ('a', '/* x */'),
+     ]),
+    ('a {}\n\nb {}\nc {}', [
+        ('\n\nb', '/* \n*/ b'),
+        ('}\nc', '"}\nc'),
+        ('"}', '}'),
+        ('c {}', ''),
+        ('b {}', 'b {} c {'),
+    ]),
+    ('a { b: c } d { e: f } g {}\nh {}', [
+        ('b: c', 'b: cc'),
+        ('a {', 'a {\n'),
+        ('e: f', 'e:\n f'),
+        ('cc', ''),
+        (' g', '\ng'),
+    ]),
+    ('@charset "x";\n@import "a";\nb {}\n@import "c";\n@media print {}', [
+        ('@charset', '@import "d";\n@charset'),
+        ('b {}', ''),
+        ('@media', '@import "e"; @page {} @media'),
+        ('@page {}', ''),
+        ('@import "a";', 'f {}'),
+        ('@import "d";', ''),
+        ('@import "c";', '@import "c"; g {}'),
+        ('f {}', ''),
+        ('@charset "x";\n', ''),
+        ('@import "e";', ' @import "e";'),
+    ]),
+])
+def test_reparse_stylesheet(css_source, edits):
+    parser = CSS21Parser()
+    stylesheet = parser.parse_stylesheet(css_source)
+    for old, new in edits:
+        start = css_source.index(old)
+        end = start + len(old)
+        css_source = css_source[:start] + new + css_source[end:]
+        expected = parser.parse_stylesheet(css_source)
+        stylesheet = parser.reparse_stylesheet(
+            stylesheet, css_source, start, end)
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_reparse_stylesheet_random(seed, monkeypatch):
+    # Keep statements in several segments.
+    monkeypatch.setattr(css21, '_SEGMENT_SIZE', 4)
+    parser = CSS21Parser()
+    generator = random.Random(seed)
+    sources = random_stylesheets(130, seed)
+    css_source = '\n'.join(next(sources) for _ in range(30))
+    stylesheet = parser.parse_stylesheet(css_source)
+    for new in sources:
+        start = generator.randint(0, len(css_source))
+        end = min(len(css_source), start + generator.randint(0, 10))
+        css_source = css_source[:start] + new + css_source[end:]
+        expected = parser.parse_stylesheet(css_source)
+        stylesheet = parser.reparse_stylesheet(
+            stylesheet, css_source, start, end)
+        if generator.random() < 0.5:
+            # Reparse again before anything is moved.
+            continue
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+
+
+def test_reparse_stylesheet_one_line(monkeypatch):
+    monkeypatch.setattr(css21, '_SEGMENT_SIZE', 2)
+    parser = CSS21Parser()
+    generator = random.Random(0)
+    css_source = ''.join('a%d{b:c}' % i for i in range(40))
+    stylesheet = parser.parse_stylesheet(css_source)
+    for _ in range(100):
+        start = generator.randint(0, len(css_source))
+        end = min(len(css_source), start + generator.randint(0, 3))
+        new = generator.choice(['', 'd', '\n', 'e{f:g}', '@import "h";'])
+        css_source = css_source[:start] + new + css_source[end:]
+        stylesheet = parser.reparse_stylesheet(
+            stylesheet, css_source, start, end)
+        if generator.random() < 0.5:
+            continue
+        expected = parser.parse_stylesheet(css_source)
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+
+
+def test_reparse_stylesheet_lazy():
+    parser = CSS21Parser()
+    css_source = ''.join('a%d { b: c }\n' % i for i in range(100))
+    stylesheet = parser.reparse_stylesheet(
+        parser.parse_stylesheet(css_source), css_source, 0, 0)
+    last_rule = stylesheet.rules[-1]
+    assert (last_rule.line, last_rule.declarations[0].line) == (100, 100)
+
+    # Only the edited statement is parsed again.
+    start = css_source.index('a1 {')
+    css_source = css_source[:start] + '\n\n' + css_source[start:]
+    stylesheet = parser.reparse_stylesheet(
+        stylesheet, css_source, start, start)
+    assert (last_rule.line, last_rule.declarations[0].line) == (100, 100)
+    assert stylesheet.rules[-1] is last_rule
+    assert (last_rule.line, last_rule.declarations[0].line) == (102, 102)
+
+    # So is the first statement.
+    css_source = '\n' + css_source
+    stylesheet = parser.reparse_stylesheet(stylesheet, css_source, 0, 0)
+    assert stylesheet.rules[-1] is last_rule
+    assert (last_rule.line, last_rule.declarations[0].line) == (103, 103)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_split_statements_consumers(seed):
+    # Everything using split_statements() agrees with the tokenizer.
+    parser = CSS21Parser()
+    raw_parser = CSS21Parser(raw_at_keywords=['@a', '@media'])
+    sources = list(random_stylesheets(600, seed))
+    previous = ''
+    stylesheet = parser.parse_stylesheet(previous)
+    for css_source in [
+            'x{#url({)} y{color:red}', '@a x{#url({)} y{}',
+            '@media print { a{#url({)} b{} } c{}', '<!--url({)} a{}'] + [
+            ''.join(pair) for pair in zip(sources[::2], sources[1::2])]:
+        expected = parser.parse_stylesheet(css_source)
+
+        selectors, _ = parser.parse_selectors(css_source)
+        expected_selectors = []
+        for rule in expected.rules:
+            for rule in getattr(rule, 'rules', [rule]):
+                if rule.at_keyword is None:
+                    expected_selectors.append(rule.selector)
+        assert [(selector.as_css(), selector.line, selector.column)
+                for selector in selectors] == [
+            (selector.as_css(), selector.line, selector.column)
+            for selector in expected_selectors], css_source
+
+        raw_rules = raw_parser.parse_stylesheet(css_source).rules
+        assert [rule.as_css() for rule in raw_rules
+                if rule.at_keyword in ('@a', '@media')] == [
+            css_source[SKIP_IGNORABLE(css_source, start).end():end]
+            for start, end, at_keyword, _, _ in token_statements(css_source)
+            if at_keyword in ('@a', '@media')], css_source
+
+        # Edit the previous source into this one.
+        start = 0
+        while previous[start:start + 1] == css_source[start:start + 1] != '':
+            start += 1
+        end = len(previous)
+        while (end > start and end - len(previous) + len(css_source) > start
+               and previous[end - 1] == css_source[
+                   end - 1 - len(previous) + len(css_source)]):
+            end -= 1
+        stylesheet = parser.reparse_stylesheet(
+            stylesheet, css_source, start, end)
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules), (previous, css_source)
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+        previous = css_source
+
+
+def test_share_values():
+    css_source = (
+        'a { b: rgba(0, 0, 0, .5) c; d: e } f { b: rgba(0, 0, 0, .5) c }\n'
+        'g { b: rgba(0, 0, 0, .5) c; d: e }\n'
+        '@media print { h { i: 1px rgba(0, 0, 0, .5) !important } }\n'
+        'j { k: l/**/m; n: lm; o: [rgba(0, 0, 0, .5)] }')
+    parser = CSS21Parser(share_values=True)
+    stylesheet = parser.parse_stylesheet(css_source)
+    expected = CSS21Parser().parse_stylesheet(css_source)
+
+    def values(rules):
+        return [(declaration.name, declaration.value.as_css(),
+                 [token.type for token in declaration.value])
+                for rule in rules for declaration in rule.declarations]
+    a, f, g, media, j = stylesheet.rules
+    assert values(stylesheet.rules[:3]) == values(expected.rules[:3])
+    assert values(media.rules) == values(expected.rules[3].rules)
+    assert values([j]) == values([expected.rules[4]])
+    # Same blocks, declarations and values
+    assert a.declarations is g.declarations
+    assert f.declarations[0] is a.declarations[0]
+    assert f.declarations[0].value is a.declarations[0].value
+    # Same tokens with content in different values
+    function = a.declarations[0].value[0]
+    assert media.rules[0].declarations[0].value[2] is function
+    assert j.declarations[2].value[0].content[0] is function
+    # Different tokens with the same CSS are not shared.
+    assert j.declarations[0].value is not j.declarations[1].value
+
+    assert pickle.loads(pickle.dumps(parser)).share_values
+    edited = parser.reparse_stylesheet(
+        stylesheet, css_source.replace('d: e', 'd: p'), 0, len(css_source))
+    assert [value[1] for value in values([edited.rules[0]])] == [
+        'rgba(0, 0, 0, .5) c', 'p']
+
+
+@pytest.mark.parametrize((
+    'error_mode', 'expected_errors', 'expected_counts'), [
+    ('collect', [
+        "expected ':', got IDENT", 'expected a property name, got INTEGER',
+        "expected ':', got IDENT", 'unknown at-rule in stylesheet context',
+        'unexpected ; token in FUNCTION'], {}),
+    ('count', [], {
+        "expected ':', got {0}": 2,
+        'expected a property name, got {0}': 1,
+        'unknown at-rule in {0} context: {1}': 1,
+        '{0} {1} token in {2}': 1}),
+    ('first', [
+        "expected ':', got IDENT", 'expected a property name, got INTEGER'],
+     {}),
+    ('ignore', [], {}),
+])
+def test_error_modes(error_mode, expected_errors, expected_counts):
+    css_source = (
+        'a { b c; 1: 2 } @media print { d { e f } } @g; h { i: j(;) }')
+    parser = CSS21Parser(error_mode=error_mode, first_errors=2)
+    stylesheet = parser.parse_stylesheet(css_source)
+    assert_errors(stylesheet.errors, expected_errors)
+    assert getattr(stylesheet.errors, 'counts', {}) == expected_counts
+    assert getattr(stylesheet.errors, 'dropped', 0) == (
+        5 - len(expected_errors) if error_mode != 'collect' else 0)
+    errors = pickle.loads(pickle.dumps(stylesheet.errors))
+    assert [str(error) for error in errors] == [
+        str(error) for error in stylesheet.errors]
+    assert getattr(errors, 'counts', {}) == expected_counts
+
+    edited = parser.reparse_stylesheet(
+        stylesheet, css_source + ' @k;', len(css_source), len(css_source))
+    assert len(edited.errors) == len(stylesheet.errors) + (
+        error_mode == 'collect')
+    _, errors = parser.parse_style_attr('a: b; c; d e')
+    assert len(errors) == {'collect': 2, 'first': 2}.get(error_mode, 0)
+
+    with pytest.raises(ValueError):
+        CSS21Parser(error_mode='first-10')
+
+
+def test_lazy_parse_error():
+    error = CSS21Parser().parse_stylesheet('a { 1: b }').errors[0]
+    assert error.reason_format == 'expected a property name, got {0}'
+    assert error.reason == 'expected a property name, got INTEGER'
+    assert error.args == (
+        'Parse error at 1:5, expected a property name, got INTEGER',)
+    assert str(error) == error.args[0]
+    assert repr(error) == 'ParseError({0!r})'.format(error.args[0])
+
+    error.reason = 'no {0}'
+    assert error.reason == error.reason_format == 'no {0}'
+    assert str(error) == 'Parse error at 1:5, no {0}'
+    error = pickle.loads(pickle.dumps(error))
+    assert error.reason == error.reason_format == 'no {0}'
+
+
+@pytest.mark.parametrize(('limits', 'expected_rules', 'expected_error'), [
+    ({}, 4, None),
+    ({'max_bytes': 1000}, 4, None),
+    ({'max_bytes': 10}, 0, '1:1, max_bytes limit exceeded (10)'),
+    ({'max_tokens': 12}, 1, '1:13, max_tokens limit exceeded (12)'),
+    ({'max_depth': 1}, 1, '1:19, max_depth limit exceeded (1)'),
+    ({'max_depth': 2}, 3, '1:62, max_depth limit exceeded (2)'),
+    ({'max_rules': 2}, 2, '1:26, max_rules limit exceeded (2)'),
+    # The nested rule exceeds the limit, the @media rule is dropped
+    ({'max_rules': 3}, 2, '1:41, max_rules limit exceeded (3)'),
+    ({'max_rules': 5}, 4, None),
+    ({'max_errors': 0}, 2, '1:26, max_errors limit exceeded (0)'),
+    ({'max_errors': 1}, 4, None),
+])
+def test_parse_limits(limits, expected_rules, expected_error):
+    css_source = (
+        'a { b: c } d { e: f(;) } @media print { h { i: j } } k { l: [(m)] }')
+    for error_mode in ('collect', 'ignore'):
+        parser = CSS21Parser(
+            limits=ParseLimits(**limits), error_mode=error_mode)
+        for stylesheet in (
+                parser.parse_stylesheet(css_source),
+                parser.parse_stylesheet_bytes(css_source.encode('ascii')),
+                parser.reparse_stylesheet(
+                    parser.parse_stylesheet(''), css_source, 0, 0)):
+            assert len(stylesheet.rules) == expected_rules
+            errors = [error for error in stylesheet.errors
+                      if isinstance(error, ParseLimitError)]
+            if expected_error is None:
+                assert not errors
+            else:
+                assert_errors(errors, [expected_error])
+                assert errors[0].limit == expected_error.split()[1]
+                assert stylesheet.errors[-1] is errors[0]
+                assert pickle.loads(pickle.dumps(errors[0])).limit == (
+                    errors[0].limit)
+
+
+def test_parse_limits_other_methods():
+    parser = CSS21Parser(limits=ParseLimits(max_tokens=5))
+    declarations, errors = parser.parse_style_attr('a: b; c: d')
+    assert declarations == []
+    assert_errors(errors, ['1:6, max_tokens limit exceeded (5)'])
+    selectors, errors = parser.parse_selectors('a {} b { c: d } e {}')
+    assert [selector.as_css() for selector in selectors] == ['a']
+    assert_errors(errors, ['1:7, max_tokens limit exceeded (5)'])
+
+    # Slices of a stylesheet count its whole length.
+    parser = CSS21Parser(limits=ParseLimits(max_bytes=10))
+    statements = parser._parse_statement('a {} b { c: d }', 0, 4, 1, 1)
+    assert statements.rules == []
+    assert_errors(statements.errors, ['max_bytes limit exceeded (10)'])
+
+    # The tokenizer stops at the limit.
+    parser = CSS21Parser(limits=ParseLimits(max_tokens=100))
+    stylesheet = parser.parse_stylesheet('a {}' + '.' * 100000)
+    assert_errors(stylesheet.errors, ['max_tokens limit exceeded (100)'])
+
+    # No RecursionError
+    parser = CSS21Parser(limits=ParseLimits(max_depth=100))
+    stylesheet = parser.parse_stylesheet('a {} ' + '(' * 10000)
+    assert len(stylesheet.rules) == 1
+    assert_errors(stylesheet.errors, ['max_depth limit exceeded (100)'])
+
+    parser = CSS21Parser(limits=ParseLimits(cpu_time=0))
+    stylesheet = parser.parse_stylesheet('a { b: c }' * 5000)
+    assert len(stylesheet.rules) < 5000
+    assert_errors(stylesheet.errors, ['cpu_time limit exceeded (0)'])
+
+
+@pytest.mark.parametrize(('extensions', 'limits', 'css_source', 'error'), [
+    # Errors in a single declaration block
+    ((), {'max_errors': 10}, 'a {' + '; :' * 100 + '}',
+     '1:39, max_errors limit exceeded (10)'),
+    ((), {'max_errors': 10}, '@media print { a {' + ': ;' * 100 + '}}',
+     '1:52, max_errors limit exceeded (10)'),
+    (['page3'], {'max_errors': 2}, '@page {' + ': ;' * 100 + '}',
+     '1:17, max_errors limit exceeded (2)'),
+    (['page3'], {'max_errors': 2}, '@page {' + '@top-left{:}' * 100 + '}',
+     '1:44, max_errors limit exceeded (2)'),
+    (['page3'], {'max_errors': 2}, '@page { @top-left {' + ': ;' * 100 + '}}',
+     '1:29, max_errors limit exceeded (2)'),
+    # Nested at-rules
+    (['page3'], {'max_rules': 3}, '@page {' + '@top-left{}' * 100 + '}',
+     '1:30, max_rules limit exceeded (3)'),
+    (['fonts3'], {'max_rules': 3},
+     '@font-feature-values a {' + '@swash{b:1}' * 100 + '}',
+     '1:47, max_rules limit exceeded (3)'),
+    (['fonts3'], {'max_errors': 2},
+     '@font-feature-values a { @swash {' + ': ;' * 100 + '}}',
+     '1:43, max_errors limit exceeded (2)'),
+])
+def test_parse_limits_nested(extensions, limits, css_source, error):
+    parser = make_parser(*extensions, limits=ParseLimits(**limits))
+    stylesheet = parser.parse_stylesheet(css_source)
+    assert stylesheet.rules == []
+    assert_errors(stylesheet.errors, [error])
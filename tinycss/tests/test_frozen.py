@@ -0,0 +1,78 @@
+# coding: utf-8
+"""
+    Tests for frozen stylesheets
+    ----------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+from __future__ import unicode_literals
+
+import pickle
+
+import pytest
+from tinycss import make_parser
+from tinycss.css21 import CSS21Parser, RuleSet, Stylesheet
+from tinycss.frozen import FrozenRule, FrozenStylesheet
+
+from .test_serialize import CSS_SOURCE, assert_same_stylesheets
+
+
+def test_freeze():
+    parser = make_parser('page3', 'fonts3', raw_at_keywords=['@keyframes'])
+    expected = parser.parse_stylesheet(CSS_SOURCE)
+    frozen = expected.freeze()
+    assert isinstance(frozen, FrozenStylesheet)
+    assert hash(frozen) == hash(parser.parse_stylesheet(CSS_SOURCE).freeze())
+    assert frozen == parser.parse_stylesheet(CSS_SOURCE).freeze()
+    assert frozen != parser.parse_stylesheet(CSS_SOURCE + 'a {}').freeze()
+    assert_same_stylesheets(frozen.thaw(), expected)
+    assert [str(error) for error in frozen.errors] == [
+        str(error) for error in expected.errors]
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+
+    ruleset = frozen.rules[1]
+    assert isinstance(ruleset, FrozenRule)
+    assert ruleset.rule_class is RuleSet
+    assert ruleset.at_keyword is None
+    assert ruleset.selector.as_css() == 'a, b[c~="d"] > e:f(2n+1)'
+    assert (ruleset.line, ruleset.column) == (3, 5)
+    assert isinstance(ruleset.declarations, tuple)
+    declaration = ruleset.declarations[0]
+    assert declaration.name == 'g'
+    assert declaration.priority == 'important'
+    assert [(token.type, token.line, token.column)
+            for token in declaration.value][:3] == [
+        ('DIMENSION', 3, 35), ('S', 3, 41), ('FUNCTION', 3, 42)]
+    # Tokens are made again each time, and can be modified.
+    declaration.value.pop()
+    assert len(declaration.value) == 5
+    with pytest.raises(AttributeError):
+        declaration.name = 'h'
+    with pytest.raises(AttributeError):
+        declaration.as_css
+    assert repr(ruleset) == '<Frozen RuleSet 3:5>'
+    assert repr(frozen) == '<FrozenStylesheet 10 rules 4 errors>'
+
+
+def test_added_attributes():
+    class CustomParser(CSS21Parser):
+        def parse_declaration(self, tokens):
+            declaration = super(CustomParser, self).parse_declaration(tokens)
+            declaration.custom = [declaration.name]
+            return declaration
+
+    stylesheet = CustomParser().parse_stylesheet('a { b: c }')
+    frozen = stylesheet.freeze()
+    assert frozen.rules[0].declarations[0].custom == ('b',)
+    thawed = frozen.thaw()
+    assert thawed.rules[0].declarations[0].custom == ['b']
+    # Freezing does not change the original objects.
+    assert vars(stylesheet.rules[0]) == {}
+
+
+def test_errors():
+    with pytest.raises(TypeError):
+        Stylesheet([RuleSet([], [[]], 1, 1)], [], None).freeze()
@@ -0,0 +1,176 @@
+# coding: utf-8
+"""
+    Tests for parsing in multiple processes
+    ---------------------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+from __future__ import unicode_literals
+
+import pickle
+
+import pytest
+from tinycss import make_parser
+from tinycss.css21 import CSS21Parser
+from tinycss.parsing import ParseLimits
+from tinycss.parallel import (
+    parse_many, parse_stylesheet, parse_stylesheet_files, split_chunks)
+
+from . import random_stylesheets
+from .test_css21 import dump_positions
+
+
+@pytest.mark.parametrize(('css_source', 'chunk_size', 'expected_chunks'), [
+    ('', 10, [(0, 0, 1, 1)]),
+    ('a {} b {}\nc {}  ', 1, [(0, 4, 1, 1), (4, 9, 1, 5), (9, 16, 1, 10)]),
+    ('a {} b {}\nc {}\n', 5, [(0, 9, 1, 1), (9, 15, 1, 10)]),
+    ('a {} @import "b"; c {} d {}', 1, [
+        (0, 17, 1, 1), (17, 22, 1, 18), (22, 27, 1, 23)]),
+])
+def test_split_chunks(css_source, chunk_size, expected_chunks):
+    assert split_chunks(css_source, chunk_size) == expected_chunks
+
+
+@pytest.mark.parametrize(('parser', 'encoding'), [
+    (CSS21Parser(), None),
+    (CSS21Parser(), 'utf8'),
+    (make_parser('page3', raw_at_keywords=['@keyframes']), None),
+    (make_parser('page3', share_values=True), None),
+])
+def test_parse_stylesheet(parser, encoding):
+    css_source = (
+        '@charset "utf-8"; @import "a.css";\n' +
+        ''.join('a%d, b { c: d(e) }\n@page :first { f: g; @top-left {} }\n'
+                '@keyframes h { i {} } @media print { j { k: l } }\n'
+                '%s ;\n' % (i, '@import "m";' if i == 5 else '')
+                for i in range(50)) +
+        '@media { n {} } o { p')
+    expected = parser.parse_stylesheet(css_source, encoding)
+    stylesheet = parse_stylesheet(
+        parser, css_source, encoding, workers=2, chunk_size=500)
+    assert stylesheet.encoding == encoding
+    assert dump_positions(stylesheet.rules) == dump_positions(expected.rules)
+    assert [str(error) for error in stylesheet.errors] == [
+        str(error) for error in expected.errors]
+
+
+@pytest.mark.parametrize('css_source', [
+    'x{#url({)} y{color:red}\n' * 50,
+    '<!--url({)} a{}\n' * 50,
+    '\n'.join(random_stylesheets(500, 0)),
+    '\n'.join(random_stylesheets(500, 1)),
+])
+def test_parse_stylesheet_random(css_source):
+    parser = CSS21Parser()
+    expected = parser.parse_stylesheet(css_source)
+    stylesheet = parse_stylesheet(
+        parser, css_source, workers=2, chunk_size=100)
+    assert dump_positions(stylesheet.rules) == dump_positions(expected.rules)
+    assert [str(error) for error in stylesheet.errors] == [
+        str(error) for error in expected.errors]
+
+
+@pytest.mark.parametrize('limits', [
+    ParseLimits(max_bytes=50), ParseLimits(max_rules=5),
+    ParseLimits(max_tokens=100)])
+def test_parse_stylesheet_limits(limits):
+    parser = CSS21Parser(limits=limits)
+    css_source = ''.join('a%d { b: c }\n' % i for i in range(100))
+    expected = parser.parse_stylesheet(css_source)
+    stylesheet = parse_stylesheet(
+        parser, css_source, workers=2, chunk_size=100)
+    assert dump_positions(stylesheet.rules) == dump_positions(expected.rules)
+    assert [str(error) for error in stylesheet.errors] == [
+        str(error) for error in expected.errors]
+    assert 'limit exceeded' in str(expected.errors[-1])
+
+
+def test_pickle():
+    parser = make_parser('page3', 'fonts3', raw_at_keywords=['@keyframes'])
+    new_parser = pickle.loads(pickle.dumps(parser))
+    assert type(new_parser).__mro__[1:] == type(parser).__mro__[1:]
+    assert new_parser.raw_at_keywords == parser.raw_at_keywords
+
+    errors = CSS21Parser().parse_stylesheet('a { b }').errors
+    new_errors = pickle.loads(pickle.dumps(errors))
+    assert [str(error) for error in new_errors] == [
+        str(error) for error in errors]
+    assert new_errors[0].reason == errors[0].reason
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_parse_stylesheet_files(tmpdir, ordered):
+    paths = []
+    for i in range(10):
+        path = tmpdir.join('%d.css' % i)
+        path.write_binary(
+            ('@charset "latin1"; @page :first { a: "é%d" } '
+             '@keyframes b {} c {' % i).encode('latin1'))
+        paths.append(str(path))
+    results = list(parse_stylesheet_files(
+        paths, workers=2, parser_features=['page3'],
+        parser_kwargs={'raw_at_keywords': ['@keyframes']},
+        ordered=ordered, batch_size=3))
+    if not ordered:
+        results.sort(key=lambda result: paths.index(result[0]))
+    parser = make_parser('page3', raw_at_keywords=['@keyframes'])
+    assert [path for path, _ in results] == paths
+    for path, stylesheet in results:
+        expected = parser.parse_stylesheet_file(path)
+        assert stylesheet.encoding == expected.encoding == 'latin1'
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+
+
+def test_parse_many(tmpdir):
+    paths = []
+    for i in range(20):
+        path = tmpdir.join('%d.css' % i)
+        path.write_binary(
+            ('@charset "latin1"; a { b: "é%d" } c {' % i).encode('latin1'))
+        paths.append(str(path))
+    parser = make_parser('page3')
+    timings = {}
+    results = list(parse_many(
+        paths, parser, threads=3, queue_size=2, timings=timings))
+    assert [path for path, _ in results] == paths
+    for path, stylesheet in results:
+        expected = parser.parse_stylesheet_file(path)
+        assert stylesheet.encoding == expected.encoding == 'latin1'
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+    assert sorted(timings) == ['decode', 'parse', 'read', 'tokenize']
+    assert all(seconds > 0 for seconds in timings.values())
+
+    # Limits and shared values are the same as in parse_stylesheet_file()
+    path = tmpdir.join('limits.css')
+    path.write_binary(''.join(
+        'a%d { b: c }\n' % i for i in range(200)).encode('ascii'))
+    for parser in [
+            CSS21Parser(limits=ParseLimits(max_bytes=50)),
+            CSS21Parser(limits=ParseLimits(max_rules=5)),
+            CSS21Parser(share_values=True)]:
+        (_, stylesheet), = parse_many([str(path)], parser)
+        expected = parser.parse_stylesheet_file(str(path))
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+        assert [str(error) for error in stylesheet.errors] == [
+            str(error) for error in expected.errors]
+    first, second = stylesheet.rules[:2]
+    assert first.declarations is second.declarations
+
+    # Stop early
+    for path, stylesheet in parse_many(paths, queue_size=2):
+        break
+    assert path == paths[0]
+
+    # Errors are raised in the calling thread
+    with pytest.raises(IOError):
+        list(parse_many(paths[:3] + [str(tmpdir.join('missing.css'))]))
@@ -0,0 +1,166 @@
+# coding: utf-8
+"""
+    Tests for the binary format
+    ---------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+from __future__ import unicode_literals
+
+import mmap
+import pickle
+
+import pytest
+from tinycss import make_parser
+from tinycss.css21 import CSS21Parser, RuleSet, Stylesheet
+from tinycss.parsing import ParseLimits
+
+from .test_css21 import dump_positions
+
+CSS_SOURCE = '''
+    @charset "utf-8"; @import url(a.css) print;
+    a, b[c~="d"] > e:f(2n+1) { g: -1.5em h(i, [j], (k)) 50% !important }
+    l { m: "n\\"o" \\70 x U+0-7F #p -7 +.5 1e3; q: url( "r s" ) }
+    @media screen { t { u: v } }
+    @page chapter:first { w: x; @top-left { y: z } }
+    @font-face { src: url(a.woff) }
+    @font-feature-values Font One { @styleset { nice-style: 12 } }
+    @keyframes aa { from { bb: cc } }
+    @unknown dd; ee { ff } gg { hh: "\ud800" } ii
+'''
+
+
+def dump(rules):
+    """Like dump_positions, loaded tokens are Token even with speedups."""
+    def without_ctoken(dumped):
+        if isinstance(dumped, (list, tuple)):
+            return [without_ctoken(item) for item in dumped]
+        return 'Token' if dumped == 'CToken' else dumped
+    return without_ctoken(dump_positions(list(rules)))
+
+
+def token_values(token):
+    value = getattr(token, 'value', None)
+    return token.type, value, type(value), token.unit
+
+
+def assert_same_stylesheets(stylesheet, expected):
+    assert stylesheet.encoding == expected.encoding
+    assert dump(stylesheet.rules) == dump(expected.rules)
+    assert [str(error) for error in stylesheet.errors] == [
+        str(error) for error in expected.errors]
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_round_trip(lazy):
+    parser = make_parser('page3', 'fonts3', raw_at_keywords=['@keyframes'])
+    for expected in [
+            parser.parse_stylesheet(CSS_SOURCE),
+            parser.parse_stylesheet_bytes(
+                CSS_SOURCE.replace('\ud800', 'é').encode('utf8')),
+            parser.parse_stylesheet('')]:
+        stylesheet = Stylesheet.loads(expected.dumps(), lazy=lazy)
+        assert_same_stylesheets(stylesheet, expected)
+        for rule, expected_rule in zip(stylesheet.rules, expected.rules):
+            assert type(rule) is type(expected_rule)
+            if isinstance(rule, RuleSet):
+                assert (rule.selector.as_css() ==
+                        expected_rule.selector.as_css())
+                for declaration, expected_declaration in zip(
+                        rule.declarations, expected_rule.declarations):
+                    value = declaration.value
+                    expected_value = expected_declaration.value
+                    assert value.as_css() == expected_value.as_css()
+                    assert [token_values(token) for token in value] == [
+                        token_values(token) for token in expected_value]
+
+
+def test_lazy(tmpdir):
+    expected = make_parser('page3').parse_stylesheet(CSS_SOURCE)
+    path = tmpdir.join('stylesheet.bin')
+    path.write_binary(expected.dumps())
+    with path.open('rb') as fd:
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        stylesheet = Stylesheet.loads(data, lazy=True)
+        assert len(stylesheet.rules) == len(expected.rules)
+        assert stylesheet.rules._rules.count(None) == len(expected.rules)
+        assert dump([stylesheet.rules[-2]]) == dump([expected.rules[-2]])
+        assert stylesheet.rules[-2] is stylesheet.rules[
+            len(expected.rules) - 2]
+        assert dump(stylesheet.rules[1:4]) == dump(expected.rules[1:4])
+        assert stylesheet.rules._rules.count(None) == len(expected.rules) - 4
+        assert_same_stylesheets(stylesheet, expected)
+        del stylesheet
+        data.close()
+
+
+def test_pickle():
+    parser = make_parser('page3', 'fonts3', raw_at_keywords=['@keyframes'])
+    expected = parser.parse_stylesheet(CSS_SOURCE)
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        stylesheet = pickle.loads(pickle.dumps(expected, protocol))
+        assert_same_stylesheets(stylesheet, expected)
+        # Tokens made by the speedups stay CToken objects.
+        assert dump_positions(stylesheet.rules) == dump_positions(
+            expected.rules)
+        for rule, expected_rule in zip(stylesheet.rules, expected.rules):
+            for declaration, expected_declaration in zip(
+                    getattr(rule, 'declarations', []),
+                    getattr(expected_rule, 'declarations', [])):
+                assert declaration.value.as_css() == (
+                    expected_declaration.value.as_css())
+                assert [token_values(token) for token in declaration.value] \
+                    == [token_values(token)
+                        for token in expected_declaration.value]
+
+    # Attributes set after parsing are kept.
+    edited = parser.reparse_stylesheet(expected, CSS_SOURCE, 0, 0)
+    stylesheet = pickle.loads(pickle.dumps(edited))
+    assert stylesheet._statements[0] == len(CSS_SOURCE)
+    css_source = CSS_SOURCE.replace('u: v', 'u: w')
+    start = CSS_SOURCE.index('u: v') + 3
+    stylesheet = parser.reparse_stylesheet(
+        stylesheet, css_source, start, start + 1)
+    assert dump_positions(stylesheet.rules) == dump_positions(
+        parser.parse_stylesheet(css_source).rules)
+
+
+def dump_errors(errors):
+    """Everything in a list of errors, including ErrorList counts."""
+    return (type(errors).__name__, getattr(errors, 'mode', None),
+            getattr(errors, 'counts', None), getattr(errors, 'dropped', None),
+            [(type(error).__name__, str(error), error.reason_format,
+              getattr(error, 'limit', None)) for error in errors])
+
+
+@pytest.mark.parametrize('load', [
+    lambda stylesheet: pickle.loads(pickle.dumps(stylesheet)),
+    lambda stylesheet: Stylesheet.loads(stylesheet.dumps()),
+    lambda stylesheet: Stylesheet.loads(stylesheet.dumps(), lazy=True),
+    lambda stylesheet: stylesheet.freeze().thaw(),
+])
+def test_error_fields(load):
+    css_source = 'a { b } c { d } @e; f { g: h; i }'
+    for parser in [
+            CSS21Parser(),
+            CSS21Parser(error_mode='count'),
+            CSS21Parser(error_mode='first', first_errors=1,
+                        limits=ParseLimits(max_rules=2))]:
+        expected = parser.parse_stylesheet(css_source)
+        assert dump_errors(load(expected).errors) == dump_errors(
+            expected.errors)
+
+
+def test_errors():
+    with pytest.raises(ValueError):
+        Stylesheet.loads(b'not a stylesheet')
+    with pytest.raises(ValueError):
+        Stylesheet.loads(b'TCSS\x7f')
+
+    class CustomRule(object):
+        line = column = 1
+    with pytest.raises(TypeError):
+        Stylesheet([CustomRule()], [], None).dumps()
@@ -0,0 +1,63 @@
+# coding: utf-8
+"""
+    Tests for stylesheets in shared memory
+    --------------------------------------
+
+    :copyright: (c) 2012 by Simon Sapin.
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+from __future__ import unicode_literals
+
+import multiprocessing
+
+import pytest
+from tinycss import make_parser
+
+from .test_serialize import CSS_SOURCE, assert_same_stylesheets, dump
+
+shared = pytest.importorskip('tinycss.shared')
+
+
+def read_shared(name):
+    with shared.SharedStylesheet(name) as shared_stylesheet:
+        stylesheet = shared_stylesheet.stylesheet
+        return (dump(stylesheet.rules),
+                [str(error) for error in stylesheet.errors])
+
+
+def test_shared_stylesheet():
+    parser = make_parser('page3', 'fonts3', raw_at_keywords=['@keyframes'])
+    expected = parser.parse_stylesheet(CSS_SOURCE)
+    shared_stylesheet = shared.SharedStylesheet.create(expected)
+    try:
+        assert_same_stylesheets(shared_stylesheet.stylesheet, expected)
+
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(read_shared, [shared_stylesheet.name] * 2)
+        finally:
+            pool.close()
+            pool.join()
+        assert results == [(dump(expected.rules), [
+            str(error) for error in expected.errors])] * 2
+
+        with shared.SharedStylesheet(shared_stylesheet.name) as other:
+            rules = other.stylesheet.rules
+            assert dump([rules[1]]) == dump([expected.rules[1]])
+        # Rules already read stay available after closing.
+        assert dump([rules[1]]) == dump([expected.rules[1]])
+        with pytest.raises(ValueError):
+            rules[2]
+    finally:
+        shared_stylesheet.close()
+        shared_stylesheet.unlink()
+
+
+def test_empty_stylesheet():
+    expected = make_parser().parse_stylesheet('')
+    shared_stylesheet = shared.SharedStylesheet.create(expected)
+    with shared_stylesheet:
+        assert_same_stylesheets(shared_stylesheet.stylesheet, expected)
+    shared_stylesheet.unlink()
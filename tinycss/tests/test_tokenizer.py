@@ -12,10 +12,19 @@ from __future__ import unicode_literals
 
 import os
 import sys
+import threading
+import timeit
 
 import pytest
+from tinycss import token_data
+from tinycss.parsing import find_invalid_token, strip_whitespace
+from tinycss.token_data import TokenSlice
 from tinycss.tokenizer import (
-    cython_tokenize_flat, python_tokenize_flat, regroup)
+    advance_position, cython_tokenize_flat, python_tokenize_flat, regroup,
+    split_statements, tokenize_grouped)
+
+from . import random_stylesheets
+from .fuzz import TARGETS, load_corpus
 
 
 def test_speedups():
@@ -118,6 +127,30 @@ def test_speedups():
             ('BAD_STRING', r'"Lorem\26Ipsum'), ('S', '\n'),
             ('IDENT', 'dolor'), ('STRING', ' sit')]),
 
+        # Bad comments end after their last *, or at EOF
+        ('a /* b * c', [
+            ('IDENT', 'a'), ('S', ' '), ('BAD_COMMENT', '/* b *'),
+            ('S', ' '), ('IDENT', 'c')]),
+        ('/*/ b', [('BAD_COMMENT', '/*/ b')]),
+
+        # Bad URIs and unicode ranges
+        ('url(a b)', [
+            ('BAD_URI', 'url(a '), ('IDENT', 'b'), (')', ')')]),
+        ('URL("a" b)', [
+            ('BAD_URI', 'URL('), ('STRING', 'a'), ('S', ' '),
+            ('IDENT', 'b'), (')', ')')]),
+        ('U+1f-2Ag u+?? u+', [
+            ('UNICODE-RANGE', 'U+1f-2A'), ('IDENT', 'g'), ('S', ' '),
+            ('UNICODE-RANGE', 'u+??'), ('S', ' '),
+            ('IDENT', 'u'), ('DELIM', '+')]),
+
+        # Signs, numbers and CDC
+        ('-a -1e -.5% +- --> <!-', [
+            ('IDENT', '-a'), ('S', ' '), ('DIMENSION', -1, 'e'), ('S', ' '),
+            ('PERCENTAGE', -.5, '%'), ('S', ' '), ('DELIM', '+'),
+            ('DELIM', '-'), ('S', ' '), ('CDC', '-->'), ('S', ' '),
+            ('DELIM', '<'), ('DELIM', '!'), ('DELIM', '-')]),
+
     ]])
 def test_tokens(tokenize, css_source, expected_tokens):
     if tokenize is None:  # pragma: no cover
@@ -155,6 +188,264 @@ def test_positions(tokenize):
         ('S', 5, 5), ('}', 5, 6)]
 
 
+@pytest.mark.parametrize('tokenize', [
+    python_tokenize_flat, cython_tokenize_flat])
+def test_start_position(tokenize):
+    """Test tokenizing a fragment that does not start at 1:1."""
+    if tokenize is None:  # pragma: no cover
+        pytest.skip('Speedups not available')
+    tokens = tokenize('a {\n  b', line=3, column=7)
+    result = [(token.type, token.line, token.column) for token in tokens]
+    assert result == [
+        ('IDENT', 3, 7), ('S', 3, 8), ('{', 3, 9), ('S', 3, 10),
+        ('IDENT', 4, 3)]
+
+
+@pytest.mark.parametrize('tokenize', [
+    python_tokenize_flat, cython_tokenize_flat])
+def test_tokenizer_limits(tokenize):
+    """Test stopping at max_tokens and cpu_time."""
+    if tokenize is None:  # pragma: no cover
+        pytest.skip('Speedups not available')
+    css = 'a { b: c }'
+    assert len(tokenize(css, max_tokens=20)) == 10
+    assert len(tokenize(css, max_tokens=10)) == 10
+    tokens = tokenize(css, max_tokens=3)
+    assert [token.type for token in tokens] == ['IDENT', 'S', '{', 'S']
+    assert len(tokenize(css, max_tokens=0)) == 1
+    assert len(tokenize('a ' * 5000, cpu_time=0)) == 1024
+    assert len(tokenize('a ' * 5000, max_tokens=99, cpu_time=0)) == 100
+    assert len(tokenize('a ' * 5000, cpu_time=60)) == 10000
+
+
+@pytest.mark.parametrize('tokenize', [
+    python_tokenize_flat, cython_tokenize_flat])
+def test_long_integers(tokenize):
+    """Test numbers too long for int()."""
+    if tokenize is None:  # pragma: no cover
+        pytest.skip('Speedups not available')
+    digits = '1' * token_data.MAX_INTEGER_LENGTH
+    tokens = tokenize('{0} {0}1 {0}1% {0}1px'.format(digits))
+    assert [(token.type, token.value) for token in tokens[::2]] == [
+        ('INTEGER', int(digits)), ('NUMBER', float('inf')),
+        ('PERCENTAGE', float('inf')), ('DIMENSION', float('inf'))]
+
+
+def _split_statements(css_source):
+    return list(split_statements(css_source))
+
+
+@pytest.mark.parametrize(('tokenize', 'prefix', 'repeated'), [
+    (tokenize, prefix, repeated)
+    for tokenize in (
+        python_tokenize_flat, cython_tokenize_flat, _split_statements)
+    for prefix, repeated in [
+        # Unclosed strings, URIs and names with ambiguous escapes
+        ('"', '\\aaaaaa'),
+        ('"', '\\a '),
+        ('"', '\\a\r\n'),
+        ("'", '\\\n\\aaaaaa'),
+        ('a', '\\aaaaaa'),
+        ('@', '\\aaaaaa'),
+        ('#', '\\aaaaaa'),
+        ('1', '\\aaaaaa'),
+        ('url(', '\\aaaaaa'),
+        ('url(', '\\a\r\n'),
+        ('url("', '\\aaaaaa'),
+        # White space on both sides of an empty URI
+        ('url(', ' '),
+        # Unclosed comments
+        ('/*', '*a'),
+        ('/*', '**a'),
+        ('', '/*/'),
+        # Tokens that are tried and fail on the same span
+        ('', 'url('),
+        ('', 'url("'),
+        ('', 'a('),
+        ('u+', '?'),
+    ]
+])
+def test_linear_time(tokenize, prefix, repeated):
+    """Test that worst-case sources for the token regexps are tokenized
+    in linear time.
+
+    """
+    if tokenize is None:  # pragma: no cover
+        pytest.skip('Speedups not available')
+    times = [
+        min(timeit.repeat(
+            lambda: tokenize(prefix + repeated * size), number=1, repeat=5))
+        for size in (2000, 16000)]
+    # 8 times longer, not 64 times (quadratic) or worse
+    assert times[1] < times[0] * 24
+
+
+@pytest.mark.parametrize(('target', 'prefix', 'repeated'), [
+    (entry['target'], entry['prefix'], entry['repeated'])
+    for entry in load_corpus()])
+def test_perf_corpus(target, prefix, repeated):
+    """Test that the slow inputs found by the fuzzer are handled in linear
+    time.
+
+    """
+    targets = dict((target[0], target[1:]) for target in TARGETS)
+    if target not in targets:  # pragma: no cover
+        pytest.skip('Speedups not available')
+    prepare, function = targets[target]
+    times = []
+    for size in (100, 800):
+        argument = prepare(prefix + repeated * size)
+        times.append(min(timeit.repeat(
+            lambda: function(argument), number=1, repeat=5)))
+    assert times[1] < times[0] * 24
+
+
+@pytest.mark.parametrize('tokenize', [
+    python_tokenize_flat, cython_tokenize_flat])
+def test_threads(tokenize):
+    """Test tokenizing in many threads at the same time."""
+    if tokenize is None:  # pragma: no cover
+        pytest.skip('Speedups not available')
+    css = 'a { b: url(c) "d" 1.5em } /* e */ @f g;\n' * 200
+    expected = list(jsonify(tokenize(css)))
+    results = []
+
+    def target():
+        for i in range(5):
+            results.append(list(jsonify(tokenize(css))) == expected)
+
+    threads = [threading.Thread(target=target) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 40
+
+
+def test_interned_names(monkeypatch):
+    """Test that both tokenizers give the same objects for equal names."""
+    tokenizers = [tokenize for tokenize in (
+        python_tokenize_flat, cython_tokenize_flat) if tokenize is not None]
+    # Join the sources, to get other objects than the constants.
+    css = ''.join(['@Media fn(', 'Color: 2PX Auto', ' #ab', ' \\62 c', ')'])
+    names = [
+        [token.unit or token.value for token in tokenize(css)
+         if token.type not in ('S', ':', ')')]
+        for tokenize in tokenizers * 2]
+    assert names[0] == ['@Media', 'fn(', 'Color', 'px', 'Auto', '#ab', 'bc']
+    for interned in list(zip(*names))[:5]:
+        assert len(set(map(id, interned))) == 1
+    # Hashes and escaped names are not interned.
+    for not_interned in list(zip(*names))[5:]:
+        assert len(set(map(id, not_interned))) == len(names)
+    assert token_data.intern_lower(''.join(['COL', 'OR'])) is (
+        token_data.intern_lower(''.join(['col', 'or'])))
+
+    # Long names are not interned.
+    length = token_data.MAX_INTERNED_LENGTH + 1
+    name = ''.join(['a'] * length)
+    assert token_data.intern_name(name) is name
+    assert token_data.intern_name(''.join(['a'] * length)) is not name
+
+    # Full tables are emptied, new names are still interned.
+    monkeypatch.setattr(token_data, 'MAX_INTERNED', 2)
+    for letter in 'abcAB':
+        token_data.intern_lower(''.join([letter, '-', 'name']))
+    assert len(token_data.INTERNED) <= 2
+    assert len(token_data.INTERNED_LOWER) <= 2
+    name = ''.join(['new-', 'name'])
+    assert token_data.intern_name(name) is name
+    assert token_data.intern_name(''.join(['new', '-name'])) is name
+    assert token_data.intern_lower(''.join(['NEW', '-name'])) is name
+
+
+@pytest.mark.parametrize(('css_source', 'start', 'end', 'expected'), [
+    ('a', 0, 1, (1, 2)),
+    ('ab', 0, 2, (1, 3)),
+    ('a\nbc', 0, 4, (2, 3)),
+    ('a\r\nb\fc\rd', 0, 8, (4, 2)),
+    ('a\r\nb\fc\rd', 3, 7, (4, 1)),
+])
+def test_advance_position(css_source, start, end, expected):
+    assert advance_position(css_source, 0, end, 1, 1) == expected
+    line, column = advance_position(css_source, 0, start, 1, 1)
+    assert advance_position(
+        css_source, start, end, line, column) == expected
+
+
+@pytest.mark.parametrize(('css_source', 'expected_statements'), [
+    ('', []),
+    (' /* a */ <!-- ', []),
+    ('a{} b {c: d}', [('a{}', None, '{}'), (' b {c: d}', None, '{c: d}')]),
+    ('@import "a;b";@import url(a;b) ; @media print {a{}}', [
+        ('@import "a;b";', '@import', None),
+        ('@import url(a;b) ;', '@import', None),
+        (' @media print {a{}}', '@media', '{a{}}')]),
+    # Semicolons only end at-rules.
+    (r'a; b{} @\6d ediA;', [
+        ('a; b{}', None, '{}'), (r' @\6d ediA;', '@media', None)]),
+    # At-keywords only start a statement at its beginning.
+    ('a @b; c{}', [('a @b; c{}', None, '{}')]),
+    # Structural characters hidden in comments, strings, URIs or escapes.
+    (r'a/*}*/{"}" url(}) \}}b{}', [
+        (r'a/*}*/{"}" url(}) \}}', None, r'{"}" url(}) \}}'),
+        ('b{}', None, '{}')]),
+    # Blocks match pairs of {} () and [] like regroup()
+    ('a{(})} b{[}]}', [('a{(})}', None, '{(})}'), (' b{[}]}', None, '{[}]}')]),
+    ('}a{}', [('}a{}', None, '{}')]),
+    # Implicitly closed at the end of the source
+    ('a{} b{c', [('a{}', None, '{}'), (' b{c', None, '{c')]),
+    ('a{} b', [('a{}', None, '{}'), (' b', None, None)]),
+    # "url(" is part of a hash, but not of a CDO.
+    ('x{#url({)} y{color:red}', [('x{#url({)} y{color:red}', None,
+                                  '{#url({)} y{color:red}')]),
+    ('<!--url({)} a{}', [('<!--url({)} a{}', None, '{}')]),
+])
+def test_split_statements(css_source, expected_statements):
+    result = [
+        (css_source[start:end], at_keyword,
+         None if block_start is None
+         else css_source[block_start:block_end + 1])
+        for start, end, at_keyword, block_start, block_end
+        in split_statements(css_source)]
+    assert result == expected_statements
+
+
+def token_statements(css_source):
+    """Like :func:`split_statements`, but from the tokenizer."""
+    statements = []
+    start = position = 0
+    at_keyword = None
+    in_statement = False
+    for token in tokenize_grouped(css_source, ignore_comments=False):
+        token_end = position + len(token.as_css())
+        if not in_statement and token.type not in (
+                'S', 'CDO', 'CDC', 'COMMENT', 'BAD_COMMENT'):
+            in_statement = True
+            if token.type == 'ATKEYWORD':
+                at_keyword = token.value.lower()
+        if in_statement and token.type == '{':
+            block_end = token_end - 1 if token._css_end else token_end
+            statements.append(
+                (start, token_end, at_keyword, position, block_end))
+            start, in_statement, at_keyword = token_end, False, None
+        elif in_statement and token.type == ';' and at_keyword:
+            statements.append((start, token_end, at_keyword, None, None))
+            start, in_statement, at_keyword = token_end, False, None
+        position = token_end
+    assert position == len(css_source)
+    if in_statement:
+        statements.append((start, position, at_keyword, None, None))
+    return statements
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_split_statements_tokens(seed):
+    for css_source in random_stylesheets(2000, seed):
+        assert list(split_statements(css_source)) == token_statements(
+            css_source), css_source
+
+
 @pytest.mark.parametrize(('tokenize', 'css_source', 'expected_tokens'), [
     (tokenize,) + test_data
     for tokenize in (python_tokenize_flat, cython_tokenize_flat)
@@ -300,3 +591,59 @@ def test_token_api(tokenize, css_source):
     token = tokens[0]
     expected_len = 7  # 2 spaces, 2 commas, 3 others.
     assert len(token.content) == expected_len
+
+
+def test_token_slice():
+    tokens = list(python_tokenize_flat(' a b c d '))
+    view = TokenSlice(tokens, 1, 5)
+    assert len(view) == 4
+    assert view.as_css() == 'a b '
+    assert (view.line, view.column) == (1, 2)
+    assert list(view) == tokens[1:5]
+    assert view[0] is tokens[1]
+    assert view[-1] is tokens[4]
+    with pytest.raises(IndexError):
+        view[4]
+
+    # Slices are views of the same list
+    part = view[1:]
+    assert (part.tokens, part.start, part.stop) == (tokens, 2, 5)
+    assert part.as_css() == ' b '
+    assert view[-2:10].as_css() == 'b '
+    assert not view[3:1]
+    assert view[::2] == tokens[1:5:2]
+
+    # strip_whitespace takes views but returns new lists
+    stripped = strip_whitespace(tokens)
+    assert type(stripped) is list
+    assert stripped == tokens[1:-1]
+    assert strip_whitespace(stripped) == stripped
+    assert strip_whitespace(view) == tokens[1:4]
+    assert strip_whitespace(view[1:2]) == []
+    assert strip_whitespace(iter(tokens)) == tokens[1:-1]
+
+
+@pytest.mark.parametrize(('css_source', 'valid'), [
+    ('a { b: c }', True),
+    ('a { b: f(c ; d) }', False),
+    ('a { b: f(c {d}) [e}] }', False),
+    ('a { b: (c [d @e]) ; f: {g; @h {i)}} }', False),
+    ('f(a, b) {c: d} [e', True),
+    ('a { b: f(c(d(e(;', False),
+])
+def test_validate_while_grouping(css_source, valid):
+    def results(tokens):
+        for token in tokens:
+            if hasattr(token, 'content'):
+                invalid = find_invalid_token(token)
+                yield (token.type, token.line, token.column, invalid and (
+                    invalid[0].type, invalid[0].line, invalid[0].column,
+                    invalid[1]))
+                for result in results(token.content):
+                    yield result
+
+    expected = list(results(regroup(python_tokenize_flat(css_source))))
+    assert all(result[3] is None for result in expected) == valid
+    # Results recorded by regroup are the same.
+    tokens = regroup(python_tokenize_flat(css_source), validate=True)
+    assert list(results(tokens)) == expected
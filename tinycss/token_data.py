@@ -26,6 +26,10 @@ import sys
 # * The syntax is otherwise compatible with re.compile.
 # * Some parentheses were added to add capturing groups.
 #   (in unicode, DIMENSION and URI)
+# * Repetitions of alternatives are unrolled to repeat a character class
+#   when possible: a (a|b)* group takes time and memory for each character.
+#   nmplain is [_a-z0-9-]|{nonascii} as a single class, urlplain is
+#   [!#$%&*-\[\]-~]|{nonascii} and baduri1 has [!#$%&*-~]|{nonascii}.
 
 # *** Willful violation: ***
 # Numbers can take a + or - sign, but the sign is a separate DELIM token.
@@ -41,24 +45,29 @@ MACROS = r'''
     nl	\n|\r\n|\r|\f
     w	[ \t\r\n\f]*
     nonascii	[^\0-\237]
-    unicode	\\([0-9a-f]{{1,6}})(\r\n|[ \n\r\t\f])?
+    h	[0-9a-f]
+    unicode	\\({h}{{6}}|{h}{{1,5}}(?!{h}))(\r\n|[ \n\r\t\f]|(?![ \n\r\t\f]))
     simple_escape	[^\n\r\f0-9a-f]
     escape	{unicode}|\\{simple_escape}
     nmstart	[_a-z]|{nonascii}|{escape}
     nmchar	[_a-z0-9-]|{nonascii}|{escape}
-    name	{nmchar}+
-    ident	[-]?{nmstart}{nmchar}*
+    nmplain	[^\0-,./:-@\[-^`{{-\237]
+    nmchars	{nmplain}*({escape}{nmplain}*)*
+    name	{nmchar}{nmchars}
+    ident	[-]?{nmstart}{nmchars}
     num	[-+]?(?:[0-9]*\.[0-9]+|[0-9]+)
-    string1	\"([^\n\r\f\\"]|\\{nl}|{escape})*\"
-    string2	\'([^\n\r\f\\']|\\{nl}|{escape})*\'
+    string1	\"[^\n\r\f\\"]*((?:\\{nl}|{escape})[^\n\r\f\\"]*)*\"
+    string2	\'[^\n\r\f\\']*((?:\\{nl}|{escape})[^\n\r\f\\']*)*\'
     string	{string1}|{string2}
-    badstring1	\"([^\n\r\f\\"]|\\{nl}|{escape})*\\?
-    badstring2	\'([^\n\r\f\\']|\\{nl}|{escape})*\\?
+    badstring1	\"[^\n\r\f\\"]*((?:\\{nl}|{escape})[^\n\r\f\\"]*)*\\?
+    badstring2	\'[^\n\r\f\\']*((?:\\{nl}|{escape})[^\n\r\f\\']*)*\\?
     badstring	{badstring1}|{badstring2}
+    urlplain	[^\0- "'()\\\177-\237]
+    urlchars	{urlplain}*({escape}{urlplain}*)*
     badcomment1	\/\*[^*]*\*+([^/*][^*]*\*+)*
     badcomment2	\/\*[^*]*(\*+[^/*][^*]*)*
     badcomment	{badcomment1}|{badcomment2}
-    baduri1	url\({w}([!#$%&*-~]|{nonascii}|{escape})*{w}
+    baduri1	url\({w}[^\0- "'()\177-\237]*{w}
     baduri2	url\({w}{string}{w}
     baduri3	url\({w}{badstring}
     baduri	{baduri1}|{baduri2}|{baduri3}
@@ -76,7 +85,7 @@ MACROS = r'''
 TOKENS = r'''
     S	[ \t\r\n\f]+
 
-    URI	url\({w}({string}|([!#$%&*-\[\]-~]|{nonascii}|{escape})*){w}\)
+    URI	url\({w}(?![ \t\r\n\f])({string}|{urlchars}){w}\)
     BAD_URI	{baduri}
     FUNCTION	{ident}\(
     UNICODE-RANGE	u\+[0-9a-f?]{{1,6}}(-[0-9a-f]{{1,6}})?
@@ -108,20 +117,6 @@ TOKENS = r'''
 '''
 
 
-# Strings with {macro} expanded
-COMPILED_MACROS = {}
-
-
-COMPILED_TOKEN_REGEXPS = []  # [(name, regexp.match)]  ordered
-COMPILED_TOKEN_INDEXES = {}  # {name: i}  helper for the C speedups
-
-
-# Indexed by codepoint value of the first character of a token.
-# Codepoints >= 160 (aka nonascii) all use the index 160.
-# values are (i, name, regexp.match)
-TOKEN_DISPATCH = []
-
-
 try:
     unichr
 except NameError:
@@ -129,21 +124,32 @@ except NameError:
     unichr = chr
     unicode = str
 
+try:
+    from types import MappingProxyType
+except ImportError:
+    # Python 2: dicts that are never modified after _init()
+    MappingProxyType = dict
+
 
 def _init():
-    """Import-time initialization."""
-    COMPILED_MACROS.clear()
+    """Import-time initialization.
+
+    The results are never modified afterwards, so that they can be shared
+    by threads without locks, even on Python builds without a GIL.
+
+    """
+    compiled_macros = {}
     for line in MACROS.splitlines():
         if line.strip():
             name, value = line.split('\t')
-            COMPILED_MACROS[name.strip()] = '(?:%s)' \
-                % value.format(**COMPILED_MACROS)
+            compiled_macros[name.strip()] = '(?:%s)' \
+                % value.format(**compiled_macros)
 
-    COMPILED_TOKEN_REGEXPS[:] = (
+    compiled_token_regexps = tuple(
         (
             name.strip(),
             re.compile(
-                value.format(**COMPILED_MACROS),
+                value.format(**compiled_macros),
                 # Case-insensitive when matching eg. uRL(foo)
                 # but preserve the case in extracted groups
                 re.I
@@ -154,9 +160,8 @@ def _init():
         for name, value in [line.split('\t')]
     )
 
-    COMPILED_TOKEN_INDEXES.clear()
-    for i, (name, regexp) in enumerate(COMPILED_TOKEN_REGEXPS):
-        COMPILED_TOKEN_INDEXES[name] = i
+    compiled_token_indexes = dict(
+        (name, i) for i, (name, regexp) in enumerate(compiled_token_regexps))
 
     dispatch = [[] for i in range(161)]
     for chars, names in [
@@ -177,17 +182,30 @@ def _init():
     for char in ':;{}()[]':
         dispatch[ord(char)] = [char]
 
-    TOKEN_DISPATCH[:] = (
-        [
-            (index,) + COMPILED_TOKEN_REGEXPS[index]
+    token_dispatch = tuple(
+        tuple(
+            (index,) + compiled_token_regexps[index]
             for name in names
-            for index in [COMPILED_TOKEN_INDEXES[name]]
-        ]
+            for index in [compiled_token_indexes[name]]
+        )
         for names in dispatch
     )
+    return (MappingProxyType(compiled_macros), compiled_token_regexps,
+            MappingProxyType(compiled_token_indexes), token_dispatch)
 
 
-_init()
+(
+    # Strings with {macro} expanded
+    COMPILED_MACROS,
+    # ((name, regexp.match), ...)  ordered
+    COMPILED_TOKEN_REGEXPS,
+    # {name: i}  helper for the C speedups
+    COMPILED_TOKEN_INDEXES,
+    # Indexed by codepoint value of the first character of a token.
+    # Codepoints >= 160 (aka nonascii) all use the index 160.
+    # values are ((i, name, regexp.match), ...)
+    TOKEN_DISPATCH,
+) = _init()
 
 
 def _unicode_replace(match, int=int, unichr=unichr, maxunicode=sys.maxunicode):
@@ -213,6 +231,119 @@ SIMPLE_UNESCAPE = functools.partial(
 
 FIND_NEWLINES = re.compile(COMPILED_MACROS['nl']).finditer
 
+# Longer numbers are parsed as floats, even without a dot: int() takes
+# quadratic time on long strings, and raises ValueError after 4300 digits
+# on recent versions of Python.
+MAX_INTEGER_LENGTH = 4300
+
+# Property names, units, at-keywords, function names and identifiers are
+# interned in these tables, shared by both tokenizers and the parser, so
+# that equal names are the same object. Only short names are interned, and
+# the tables are emptied when they are full, so that hostile stylesheets
+# can not fill the memory nor keep the names of other stylesheets out.
+MAX_INTERNED = 8192
+MAX_INTERNED_LENGTH = 32
+INTERNED = {}
+# Names and their interned lower-case version
+INTERNED_LOWER = {}
+
+
+def intern_name(name):
+    """Return a string equal to ``name``.
+
+    Equal short names give the same object, until the table is full and
+    emptied. Look up ``INTERNED`` first, to avoid calling this function for
+    names already interned.
+
+    """
+    interned = INTERNED.get(name)
+    if interned is None:
+        if len(name) > MAX_INTERNED_LENGTH:
+            return name
+        if len(INTERNED) >= MAX_INTERNED:
+            INTERNED.clear()
+        interned = INTERNED.setdefault(name, name)
+    return interned
+
+
+def intern_lower(name):
+    """Return ``intern_name(name.lower())``.
+
+    Look up ``INTERNED_LOWER`` first, to avoid calling this function for
+    names already seen.
+
+    """
+    lower = INTERNED_LOWER.get(name)
+    if lower is None:
+        lower = intern_name(name.lower())
+        if len(name) <= MAX_INTERNED_LENGTH:
+            if len(INTERNED_LOWER) >= MAX_INTERNED:
+                INTERNED_LOWER.clear()
+            lower = INTERNED_LOWER.setdefault(name, lower)
+    return lower
+
+
+def _token_pattern(name):
+    """Return the regexp for a token in TOKENS, with macros expanded."""
+    for line in TOKENS.splitlines():
+        if line.strip():
+            token_name, value = line.split('\t')
+            if token_name.strip() == name:
+                return value.format(**COMPILED_MACROS)
+    raise KeyError(name)
+
+
+def _non_capturing(pattern):
+    """Make the unnamed groups of a regexp non-capturing.
+
+    Regexps save the position of all the groups before the current one on
+    each repetition, which takes time and memory when many groups are
+    before the repeated part of a long pattern.
+
+    """
+    return re.sub(
+        r'\\.|\[(?:\\.|[^\]\\])*\]|\((?!\?)',
+        lambda match: '(?:' if match.group() == '(' else match.group(),
+        pattern)
+
+
+# Used to find statements without tokenizing the whole source.
+# Everything is skipped except at-keywords and the characters that open or
+# close blocks and at-rules. Tokens that can contain these characters
+# (comments, strings, URIs and escaped characters in names) are matched
+# with the same regexps as in the tokenizer, so that they are skipped the
+# same way. Each match ends with one of the named groups, or at the end of
+# the source.
+SCAN_STATEMENTS = re.compile(_non_capturing(
+    '(?:%s)*(?:%s)?' % ('|'.join([
+        _token_pattern('COMMENT'),
+        COMPILED_MACROS['badcomment'],
+        COMPILED_MACROS['string'],
+        COMPILED_MACROS['badstring'],
+        # Tokens that end just before "url(", as in the tokenizer
+        _token_pattern('HASH'),
+        '<!--',
+        _token_pattern('URI'),
+        COMPILED_MACROS['baduri'],
+        _token_pattern('UNICODE-RANGE'),
+        COMPILED_MACROS['name'],
+        # A single @ is a DELIM token
+        '@(?!%s)' % COMPILED_MACROS['ident'],
+        r'[^{}()\[\];@]',
+    ]), '|'.join([
+        '(?P<atkeyword>@%s)' % COMPILED_MACROS['ident'],
+        r'(?P<open>[{(\[])',
+        r'(?P<close>[})\]])',
+        '(?P<semicolon>;)',
+    ]))),
+    re.I).finditer
+
+# Skips the tokens ignored between statements: white space, comments,
+# CDO and CDC.
+SKIP_IGNORABLE = re.compile(_non_capturing(
+    r'(?:[ \t\r\n\f]+|%s|%s|<!--|-->)*' % (
+        _token_pattern('COMMENT'), COMPILED_MACROS['badcomment']))).match
+
 
 class Token(object):
     """A single atomic token.
@@ -330,6 +461,10 @@ class Token(object):
         return ('<Token {0.type} at {0.line}:{0.column} {0.value!r}{1}>'
                 .format(self, self.unit or ''))
 
+    def __reduce__(self):
+        return type(self), (self.type, self._as_css, self.value, self.unit,
+                            self.line, self.column)
+
     def __eq__(self, other):
         if type(self) != type(other):
             raise TypeError(
@@ -378,7 +513,8 @@ class ContainerToken(object):
     """
     is_container = True
     unit = None
-    __slots__ = 'type', '_css_start', '_css_end', 'content', 'line', 'column'
+    __slots__ = ('type', '_css_start', '_css_end', 'content', 'line', 'column',
+                 '_invalid_token')
 
     def __init__(self, type_, css_start, css_end, content, line, column):
         self.type = type_
@@ -403,6 +539,10 @@ class ContainerToken(object):
     def __repr__(self):
         return (self.format_string + ' {0.content}').format(self)
 
+    def __reduce__(self):
+        return type(self), (self.type, self._css_start, self._css_end,
+                            self.content, self.line, self.column)
+
 
 class FunctionToken(ContainerToken):
     """A specialized :class:`ContainerToken` for a ``FUNCTION`` group.
@@ -422,6 +562,11 @@ class FunctionToken(ContainerToken):
         # Remove the ( marker:
         self.function_name = function_name[:-1]
 
+    def __reduce__(self):
+        return type(self), (
+            self.type, self._css_start, self._css_end,
+            self.function_name + '(', self.content, self.line, self.column)
+
     format_string = ('<FunctionToken {0.function_name}() at '
                      '{0.line}:{0.column}>')
 
@@ -452,3 +597,85 @@ class TokenList(list):
         as parsed in the source.
         """
         return ''.join(token.as_css() for token in self)
+
+
+class TokenSlice(object):
+    """
+    A view of a part of a list of tokens, used by the parser to pass parts
+    of a token list around without copying them.
+
+    It can be iterated, indexed and sliced like a list, slicing gives
+    another view of the same list, and it has the same additional API as
+    :class:`TokenList`. Views and their list must not be changed while
+    they are used.
+
+    :param tokens:
+        A list or a tuple of tokens, another :class:`TokenSlice`, or any
+        iterable of tokens, copied in a new list.
+    :param start:
+        The index of the first token of the view in ``tokens``.
+    :param stop:
+        The index after the last token of the view in ``tokens``, or
+        ``None`` for the end of ``tokens``.
+
+    """
+    __slots__ = 'tokens', 'start', 'stop'
+
+    def __init__(self, tokens, start=0, stop=None):
+        if type(tokens) is TokenSlice:
+            start += tokens.start
+            stop = tokens.stop if stop is None else min(
+                tokens.start + stop, tokens.stop)
+            tokens = tokens.tokens
+        else:
+            if not isinstance(tokens, (list, tuple)):
+                tokens = list(tokens)
+            if stop is None or stop > len(tokens):
+                stop = len(tokens)
+        #: The list of tokens.
+        self.tokens = tokens
+        #: The index of the first token of the view in :attr:`tokens`.
+        self.start = start
+        #: The index after the last token of the view in :attr:`tokens`.
+        self.stop = stop if stop > start else start
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        # A short-lived copy is faster to iterate than indexing the list.
+        return iter(self.tokens[self.start:self.stop])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.stop - self.start)
+            if step == 1:
+                return TokenSlice(self, start, stop)
+            return self.tokens[self.start:self.stop][index]
+        length = self.stop - self.start
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('TokenSlice index out of range')
+        return self.tokens[self.start + index]
+
+    @property
+    def line(self):
+        """The line number in the CSS source of the first token."""
+        return self[0].line
+
+    @property
+    def column(self):
+        """The column number (inside a source line) of the first token."""
+        return self[0].column
+
+    def as_css(self):
+        """
+        Return as an Unicode string the CSS representation of the tokens,
+        as parsed in the source.
+        """
+        return ''.join(token.as_css() for token in self)
+
+    def __repr__(self):
+        return '<TokenSlice {0}:{1} of {2} tokens>'.format(
+            self.start, self.stop, len(self.tokens))
@@ -15,17 +15,25 @@
 from __future__ import unicode_literals
 
 from . import token_data
+from .parsing import _ANY_CONTENT_TYPES, _BLOCK_CONTENT_TYPES, _process_time
 
 
 def tokenize_flat(
-        css_source, ignore_comments=True,
+        css_source, ignore_comments=True, line=1, column=1, max_tokens=None,
+        cpu_time=None,
         # Make these local variable to avoid global lookups in the loop
         tokens_dispatch=token_data.TOKEN_DISPATCH,
         unicode_unescape=token_data.UNICODE_UNESCAPE,
         newline_unescape=token_data.NEWLINE_UNESCAPE,
         simple_unescape=token_data.SIMPLE_UNESCAPE,
         find_newlines=token_data.FIND_NEWLINES,
+        max_integer_length=token_data.MAX_INTEGER_LENGTH,
+        interned=token_data.INTERNED.get,
+        interned_lower=token_data.INTERNED_LOWER.get,
+        intern_name=token_data.intern_name,
+        intern_lower=token_data.intern_lower,
         Token=token_data.Token,
+        process_time=_process_time,
         len=len,
         int=int,
         float=float,
@@ -37,16 +45,34 @@ def tokenize_flat(
     :param ignore_comments:
         if true (the default) comments will not be included in the
         return value
+    :param line:
+        The line number of the start of ``css_source``, when it is
+        a fragment of a larger stylesheet.
+    :param column:
+        The column number of the start of ``css_source``.
+    :param max_tokens:
+        If not ``None``, stop after ``max_tokens + 1`` tokens: when the
+        source has more than ``max_tokens`` tokens, the last token returned
+        is the first one over the limit.
+    :param cpu_time:
+        If not ``None``, stop when this CPU time in seconds is exceeded.
+        It is checked every 1024 tokens.
     :return:
         An iterator of :class:`Token`
 
     """
 
     pos = 0
-    line = 1
-    column = 1
     source_len = len(css_source)
     tokens = []
+    # Only one check per token: at stop_at, either max_tokens is exceeded
+    # or it is time to check the CPU time.
+    limit = -1 if max_tokens is _None else max_tokens + 1
+    stop_at = limit
+    if cpu_time is not _None:
+        deadline = process_time() + cpu_time
+        if limit == -1 or limit > 1024:
+            stop_at = 1024
     while pos < source_len:
         char = css_source[pos]
         if char in ':;{}()[]':
@@ -77,18 +103,25 @@ def tokenize_flat(
             unit = _None
             if type_ == 'DIMENSION':
                 value = match.group(1)
-                value = float(value) if '.' in value else int(value)
+                if '.' in value or len(value) > max_integer_length:
+                    value = float(value)
+                else:
+                    value = int(value)
                 unit = match.group(2)
                 unit = simple_unescape(unit)
                 unit = unicode_unescape(unit)
-                unit = unit.lower()  # normalize
+                # Normalize, and intern
+                unit = interned_lower(unit) or intern_lower(unit)
             elif type_ == 'PERCENTAGE':
                 value = css_value[:-1]
-                value = float(value) if '.' in value else int(value)
+                if '.' in value or len(value) > max_integer_length:
+                    value = float(value)
+                else:
+                    value = int(value)
                 unit = '%'
             elif type_ == 'NUMBER':
                 value = css_value
-                if '.' in value:
+                if '.' in value or len(value) > max_integer_length:
                     value = float(value)
                 else:
                     value = int(value)
@@ -96,6 +129,8 @@ def tokenize_flat(
             elif type_ in ('IDENT', 'ATKEYWORD', 'HASH', 'FUNCTION'):
                 value = simple_unescape(css_value)
                 value = unicode_unescape(value)
+                if value is css_value and type_ != 'HASH':  # Not escaped
+                    css_value = value = interned(value) or intern_name(value)
             elif type_ == 'URI':
                 value = match.group(1)
                 if value and value[0] in '"\'':
@@ -125,6 +160,12 @@ def tokenize_flat(
             else:
                 value = css_value
             tokens.append(Token(type_, css_value, value, unit, line, column))
+            if len(tokens) == stop_at:
+                if stop_at == limit or process_time() > deadline:
+                    break
+                stop_at += 1024
+                if limit != -1 and stop_at > limit:
+                    stop_at = limit
 
         pos = next_pos
         newlines = list(find_newlines(css_value))
@@ -137,7 +178,7 @@ def tokenize_flat(
     return tokens
 
 
-def regroup(tokens):
+def regroup(tokens, validate=False, budget=None):
     """
     Match pairs of tokens: () [] {} function()
     (Strings in "" or '' are taken care of by the tokenizer.)
@@ -149,18 +190,38 @@ def regroup(tokens):
 
     :param tokens:
         a *flat* iterable of tokens, as returned by :func:`tokenize_flat`.
+    :param validate:
+        If true, record the first invalid token of each container for the
+        core grammar while grouping, as :func:`~.parsing.find_invalid_token`
+        does, so that the validation functions of :mod:`tinycss.parsing` do
+        not walk its content again.
+    :param budget:
+        A :class:`~.parsing.ParseBudget` to count tokens in, and to check
+        the nesting depth against. :class:`~.parsing.ParseLimitError`
+        is raised while iterating when a limit is exceeded.
     :return:
         A tree of tokens.
 
     """
     # "global" objects for the inner recursion
     pairs = {'FUNCTION': ')', '(': ')', '[': ']', '{': '}'}
-    tokens = iter(tokens)
+    if budget is None:
+        tokens = iter(tokens)
+        max_depth = -1
+    else:
+        tokens = budget.count_tokens(tokens)
+        max_depth = budget.limits.max_depth
+        if max_depth is None:
+            max_depth = -1
     eof = [False]
 
-    def _regroup_inner(stop_at=None, tokens=tokens, pairs=pairs, eof=eof,
+    def _regroup_inner(stop_at=None, invalid=None, allowed=None,
+                       context=None, depth=0, tokens=tokens, pairs=pairs,
+                       eof=eof,
                        ContainerToken=token_data.ContainerToken,
                        FunctionToken=token_data.FunctionToken):
+        # If ``invalid`` is a list, add the first invalid token for the
+        # core grammar, and its context, as for find_invalid_token().
         for token in tokens:
             type_ = token.type
             if type_ == stop_at:
@@ -168,38 +229,230 @@ def regroup(tokens):
 
             end = pairs.get(type_)
             if end is None:
+                if invalid is not None and not invalid and (
+                        type_ not in allowed):
+                    invalid.append((token, context))
                 yield token  # Not a grouping token
             else:
                 assert not isinstance(token, ContainerToken), (
                     'Token looks already grouped: {0}'.format(token))
-                content = list(_regroup_inner(end))
+                if depth == max_depth:
+                    budget.exceed(token, 'max_depth')
+                if validate:
+                    content_invalid = []
+                    if type_ == '{':
+                        content = list(_regroup_inner(
+                            end, content_invalid, _BLOCK_CONTENT_TYPES,
+                            None, depth + 1))
+                    else:
+                        content = list(_regroup_inner(
+                            end, content_invalid, _ANY_CONTENT_TYPES, type_,
+                            depth + 1))
+                else:
+                    content = list(_regroup_inner(end, depth=depth + 1))
                 if eof[0]:
                     end = ''  # Implicit end of structure at EOF.
                 if type_ == 'FUNCTION':
-                    yield FunctionToken(token.type, token.as_css(), end,
-                                        token.value, content,
-                                        token.line, token.column)
+                    token = FunctionToken(token.type, token.as_css(), end,
+                                          token.value, content,
+                                          token.line, token.column)
                 else:
-                    yield ContainerToken(token.type, token.as_css(), end,
-                                         content,
-                                         token.line, token.column)
+                    token = ContainerToken(token.type, token.as_css(), end,
+                                           content,
+                                           token.line, token.column)
+                if validate:
+                    token._invalid_token = (
+                        content_invalid[0] if content_invalid else None)
+                    if invalid is not None and not invalid:
+                        if type_ not in allowed:
+                            invalid.append((token, context))
+                        elif content_invalid:
+                            invalid.append(content_invalid[0])
+                yield token
         else:
             eof[0] = True  # end of file/stylesheet
     return _regroup_inner()
 
 
-def tokenize_grouped(css_source, ignore_comments=True):
+def tokenize_grouped(css_source, ignore_comments=True, line=1, column=1,
+                     raw_at_keywords=(), validate=False, budget=None):
     """
     :param css_source:
         CSS as an unicode string
     :param ignore_comments:
         if true (the default) comments will not be included in the
         return value
+    :param line:
+        The line number of the start of ``css_source``, when it is
+        a fragment of a larger stylesheet.
+    :param column:
+        The column number of the start of ``css_source``.
+    :param raw_at_keywords:
+        A set of normalized (lower-case) at-keywords. Top-level at-rules
+        with these keywords are not tokenized: each is replaced by a single
+        ``RAW_AT_RULE`` token whose value is the at-keyword.
+    :param validate:
+        Passed to :func:`regroup`.
+    :param budget:
+        Passed to :func:`regroup`. The tokenizer also stops at the
+        ``max_tokens`` and ``cpu_time`` limits of the budget.
     :return:
         An iterator of :class:`Token`
 
     """
-    return regroup(tokenize_flat(css_source, ignore_comments))
+    if not raw_at_keywords:
+        if budget is None:
+            tokens = tokenize_flat(css_source, ignore_comments, line, column)
+        else:
+            tokens = tokenize_flat(css_source, ignore_comments, line, column,
+                                   budget.tokens_left(), budget.time_left())
+        return regroup(tokens, validate, budget)
+    return _tokenize_raw_at_rules(
+        css_source, ignore_comments, line, column, raw_at_keywords,
+        validate, budget)
+
+
+def advance_position(css_source, start, end, line, column):
+    """Find the line and column of a position in the source.
+
+    :param css_source:
+        CSS as an unicode string
+    :param start:
+        An index in ``css_source`` whose position is known.
+    :param end:
+        The index to find the position of, not before ``start``.
+    :param line:
+        The line number of ``start``.
+    :param column:
+        The column number of ``start``.
+    :return:
+        A ``(line, column)`` tuple for ``end``.
+
+    """
+    # Newlines are \n, \r\n, \r or \f. See the 'nl' macro.
+    newlines = (
+        css_source.count('\n', start, end) +
+        css_source.count('\r', start, end) +
+        css_source.count('\f', start, end) -
+        css_source.count('\r\n', start, end))
+    if newlines:
+        last_newline = max(
+            css_source.rfind('\n', start, end),
+            css_source.rfind('\r', start, end),
+            css_source.rfind('\f', start, end))
+        return line + newlines, end - last_newline
+    else:
+        return line, column + end - start
+
+
+def split_statements(css_source, start=0, end=None,
+                     scan=token_data.SCAN_STATEMENTS,
+                     skip_ignorable=token_data.SKIP_IGNORABLE,
+                     unicode_unescape=token_data.UNICODE_UNESCAPE,
+                     simple_unescape=token_data.SIMPLE_UNESCAPE):
+    """Find the top-level statements of a stylesheet without tokenizing it.
+
+    The source is only scanned for the characters that delimit statements,
+    which is much cheaper than :func:`tokenize_flat`. Statements are split
+    where :meth:`~.css21.CSS21Parser.parse_rules` would split them.
+
+    :param css_source:
+        CSS as an unicode string
+    :param start:
+        Where to start scanning in ``css_source``.
+    :param end:
+        Where to stop scanning in ``css_source``. Defaults to the end.
+    :return:
+        An iterator of ``(start, end, at_keyword, block_start, block_end)``
+        tuples, one for each statement:
+
+        * ``start`` and ``end`` delimit the source of the statement,
+          including any white space or comment before it.
+        * ``at_keyword`` is the normalized (lower-case) at-keyword of an
+          at-rule, or ``None`` for a ruleset.
+        * ``block_start`` and ``block_end`` are the indexes of the ``{`` and
+          ``}`` delimiting the block of the statement, or ``None`` if
+          the statement has no block. ``block_end`` is ``end`` if the block
+          is implicitly closed at the end of the source.
+
+    """
+    pairs = {'{': '}', '(': ')', '[': ']'}
+    if end is None:
+        end = len(css_source)
+    stack = []
+    statement_start = start
+    at_keyword = None
+    block_start = None
+    classified = False
+    for match in scan(css_source, start, end):
+        kind = match.lastgroup
+        if kind is None:
+            break  # End of the source
+        position = match.start(kind)
+        char = css_source[position]
+        if stack:
+            if kind == 'open':
+                stack.append(pairs[char])
+            elif kind == 'close' and char == stack[-1]:
+                stack.pop()
+                if not stack and block_start is not None:
+                    yield (statement_start, match.end(), at_keyword,
+                           block_start, position)
+                    statement_start = match.end()
+                    at_keyword = block_start = None
+                    classified = False
+            continue
+
+        if not classified:
+            # Only at-keywords at the start of a statement make an at-rule.
+            classified = True
+            if kind == 'atkeyword' and skip_ignorable(
+                    css_source, statement_start, position).end() == position:
+                at_keyword = token_data.intern_lower(unicode_unescape(
+                    simple_unescape(match.group(kind))))
+        if kind == 'open':
+            if char == '{':
+                block_start = position
+            stack.append(pairs[char])
+        elif kind == 'semicolon' and at_keyword is not None:
+            yield statement_start, match.end(), at_keyword, None, None
+            statement_start = match.end()
+            at_keyword = None
+            classified = False
+    if statement_start < end and (classified or skip_ignorable(
+            css_source, statement_start, end).end() != end):
+        yield (statement_start, end, at_keyword,
+               block_start, None if block_start is None else end)
+
+
+def _tokenize_raw_at_rules(css_source, ignore_comments, line, column,
+                           raw_at_keywords, validate, budget,
+                           skip_ignorable=token_data.SKIP_IGNORABLE,
+                           Token=token_data.Token):
+    """Implement ``raw_at_keywords`` for :func:`tokenize_grouped`."""
+    # Everything before this has been tokenized. (line, column) is here.
+    tokenized = 0
+    for start, end, at_keyword, _, _ in split_statements(css_source):
+        if at_keyword not in raw_at_keywords:
+            continue
+        # Start at the at-keyword, after any white space or comment.
+        start = skip_ignorable(css_source, start).end()
+        if tokenized < start:
+            for token in tokenize_grouped(
+                    css_source[tokenized:start], ignore_comments,
+                    line, column, validate=validate, budget=budget):
+                yield token
+        line, column = advance_position(
+            css_source, tokenized, start, line, column)
+        raw_css = css_source[start:end]
+        yield Token('RAW_AT_RULE', raw_css, at_keyword, None, line, column)
+        line, column = advance_position(css_source, start, end, line, column)
+        tokenized = end
+    if tokenized < len(css_source):
+        for token in tokenize_grouped(
+                css_source[tokenized:], ignore_comments, line, column,
+                validate=validate, budget=budget):
+            yield token
 
 
 # Optional Cython version of tokenize_flat